@@ -0,0 +1,2 @@
+export AWS_DEFAULT_REGION=us-east-1
+python src/tests/benchmarks/run_benchmarks.py --compare default "$@"
@@ -1,48 +1,101 @@
 import os
+import boto3
+from botocore.config import Config
+from ees.handlers.analysis_projector import statistics_projection
+from ees.handlers.publisher import Publisher
 from ees.handlers.version import VersionHandler
-from ees.handlers.commit import CommitHandler
+from ees.handlers.commit import CommitHandler, StreamHeadCache
+from ees.handlers.batch_commit import BatchCommitHandler
 from ees.handlers.invalid import InvalidEndpointHandler
 from ees.handlers.changesets import FetchChangesetsHandler
 from ees.handlers.events import FetchEventsHandler
+from ees.handlers.snapshots import CommitSnapshotHandler
 from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_events import FetchGlobalEventsHandler
 from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.projections import ProjectionsEngine
 from ees.handlers.stats import StatsHandler
 from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.infrastructure.page_cache import GlobalPageCache
+from ees.infrastructure.sns import SNS
 from ees.commands import *
+from ees.model import GlobalShards
 
-db = DynamoDB(events_table=os.getenv('EventStoreTable'),
-              analysis_table=os.getenv('AnalysisTable'))
 
+# Clients are shared by all invocations served by the same container,
+# so their connections are kept alive and reused between invocations
+client_config = Config(
+    max_pool_connections=50,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={ 'max_attempts': 3, 'mode': 'standard' })
 
-def route_request(cmd):
-    commit = CommitHandler(db)
-    version = VersionHandler()
-    stats = StatsHandler(db)
-    changesets = FetchChangesetsHandler(db)
-    events = FetchEventsHandler(db)    
-    global_changesets = FetchGlobalChangesetsHandler(db)
-    invalid = InvalidEndpointHandler()
-    global_indexer = GlobalIndexer(db)
-
-    if isinstance(cmd, Version):
-        return version
-    
-    if isinstance(cmd, Stats):
-        return stats
 
-    if isinstance(cmd, Commit):
-        return commit
-    
-    if isinstance(cmd, FetchStreamChangesets):
-        return changesets
+# Seconds the global readers cache the enumeration index's settings for,
+# and the re-indexer waits before moving changesets to the new page size
+index_settings_ttl = 60
 
-    if isinstance(cmd, FetchStreamEvents):
-        return events
-    
-    if isinstance(cmd, FetchGlobalChangesets):
-        return global_changesets
-    
-    if isinstance(cmd, AssignGlobalIndexes):
-        return global_indexer
+
+def create_storage_engine():
+    if os.getenv('StorageEngine') == 'in-memory':
+        return InMemoryStorage()
+
+    page_cache = None
+    page_cache_mb = int(os.getenv('GlobalPageCacheMB') or 0)
+    if page_cache_mb:
+        page_cache = GlobalPageCache(page_cache_mb * 1024 * 1024)
     
-    return invalid
+    return DynamoDB(events_table=os.getenv('EventStoreTable'),
+                    analysis_table=os.getenv('AnalysisTable'),
+                    snapshots_table=os.getenv('SnapshotsTable'),
+                    compress_payloads=os.getenv('CompressPayloads', '').lower() == 'true',
+                    client=boto3.client('dynamodb', config=client_config),
+                    prefetch_pages=int(os.getenv('GlobalChangesetsPrefetch') or 0),
+                    page_cache=page_cache,
+                    settings_ttl=index_settings_ttl)
+
+
+class Resources:
+    # Created once per container. Handlers are stateless and are reused
+    # across invocations along with the clients they depend on.
+    def __init__(self, db, shards):
+        self.db = db
+        self.shards = shards
+        self.stream_heads = StreamHeadCache()
+        self.invalid = InvalidEndpointHandler()
+        self.global_changesets = FetchGlobalChangesetsHandler(db, shards)
+        self.handlers = {
+            Version: VersionHandler(),
+            Stats: StatsHandler(db),
+            Commit: CommitHandler(db, self.stream_heads),
+            BatchCommit: BatchCommitHandler(db, self.stream_heads),
+            CommitSnapshot: CommitSnapshotHandler(db),
+            FetchStreamChangesets: FetchChangesetsHandler(db),
+            FetchStreamEvents: FetchEventsHandler(db),
+            FetchGlobalChangesets: self.global_changesets,
+            FetchGlobalEvents: FetchGlobalEventsHandler(db, shards),
+            AssignGlobalIndexes: GlobalIndexer(db, shards)
+        }
+        self.projections = ProjectionsEngine(db, self.global_changesets, [statistics_projection(db, shards)], shards)
+        self._publisher = None
+
+    def route(self, cmd):
+        return self.handlers.get(type(cmd), self.invalid)
+
+    @property
+    def publisher(self):
+        # Topics are only configured for the publisher function
+        if not self._publisher:
+            sns = boto3.client('sns', config=client_config)
+            self._publisher = Publisher(SNS(os.getenv('ChangesetsTopic'), client=sns),
+                                        SNS(os.getenv('EventsTopic'), client=sns))
+        return self._publisher
+
+
+db = create_storage_engine()
+resources = Resources(db, GlobalShards(int(os.getenv('GlobalIndexShards') or 1)))
+
+
+def route_request(cmd):
+    return resources.route(cmd)
@@ -14,22 +14,67 @@ Commit = namedtuple(
      'events',
      'metadata'])
 
+BatchCommit = namedtuple('BatchCommit', ['commits'])
+
+CommitSnapshot = namedtuple(
+    'CommitSnapshot',
+    ['stream_id',
+     'changeset_id',
+     'data'])
+
+# The fields are a tuple of the response fields to return,
+# None returns all of them. if_none_match is the request's
+# If-None-Match header value.
 FetchStreamChangesets = namedtuple(
     'FetchStreamChangesets',
     ['stream_id',
      'from_changeset',
-     'to_changeset'])
+     'to_changeset',
+     'limit',
+     'from_snapshot',
+     'fields',
+     'if_none_match'],
+    defaults=[None, False, None, None])
+
+changeset_fields = ('changeset_id', 'events', 'metadata')
 
 FetchStreamEvents = namedtuple(
     'FetchStreamEvents',
     ['stream_id',
      'from_event',
-     'to_event'])
+     'to_event',
+     'limit',
+     'from_snapshot',
+     'fields',
+     'if_none_match'],
+    defaults=[None, False, None, None])
 
+event_fields = ('id', 'data')
+
+# wait is the number of seconds to wait for new changesets
+# when the checkpoint is at the head of the feed. stream_prefix and
+# event_type are tuples of the accepted stream id prefixes and event types.
 FetchGlobalChangesets = namedtuple(
     'FetchGlobalChangesets',
     ['checkpoint',
-     'limit'])
+     'limit',
+     'shard',
+     'wait',
+     'stream_prefix',
+     'event_type',
+     'fields'],
+    defaults=[None, None, None, None, None])
+
+global_changeset_fields = ('stream_id', 'changeset_id', 'events', 'metadata', 'checkpoint')
+
+# The checkpoint is a (changeset checkpoint, event offset) position,
+# or a list of positions, one for each shard
+FetchGlobalEvents = namedtuple(
+    'FetchGlobalEvents',
+    ['checkpoint',
+     'limit',
+     'shard'],
+    defaults=[None])
 
 AssignGlobalIndexes = namedtuple(
     'AssignGlobalIndexes', ['changesets'])
\ No newline at end of file
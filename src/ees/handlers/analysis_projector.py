@@ -1,53 +1,62 @@
-import json
 import logging
 
-from ees.commands import FetchGlobalChangesets
-from ees.model import AnalysisState
+from ees.model import AnalysisState, GlobalShards, Projection, ProjectionState, make_vector_checkpoint, parse_vector_checkpoint
 
 logger = logging.getLogger('ees.handlers.analysis_projector')
 
-class AnalysisProjector(object):
-    def __init__(self, db, global_changesets_handler):
+# The statistics returned by the stats endpoint are projected by the
+# projections engine, sharing its reads of the global feed with the other
+# projections. Their state is kept in the analysis state item, where the
+# version is the sum of the checkpoints, and the vector checkpoint is only
+# stored in the sharded mode.
+
+def project_statistics(state, changeset):
+    if changeset["changeset_id"] == 1:
+        state["total_streams"] += 1
+    state["total_changesets"] += 1
+    state["total_events"] += len(changeset["events"])
+    state["max_stream_length"] = max(state["max_stream_length"], changeset["changeset_id"])
+    return state
+
+
+def statistics_projection(db, shards=None):
+    return Projection("statistics", project_statistics, store=AnalysisStateStore(db, shards))
+
+
+class AnalysisStateStore:
+    # Stores the statistics projection's state in the analysis state item
+    def __init__(self, db, shards=None):
         self.db = db
-        self.global_changesets_handler = global_changesets_handler
-        self.query_limit = 1000
-    
-    def execute(self):
-        logger.info(f"Analysis projection strated.")
-        prev_state = self.db.get_analysis_state()
-
-        new_total_streams = prev_state.total_streams
-        new_total_changesets = prev_state.total_changesets
-        new_total_events = prev_state.total_events
-        new_max_stream_length = prev_state.max_stream_length
-        new_version = prev_state.version
-
-        new_changesets = self.global_changesets_handler.execute(
-            FetchGlobalChangesets(new_version, self.query_limit)
-        )
-        print(FetchGlobalChangesets(new_version, self.query_limit))
-        print(new_changesets)
-        while new_changesets.body["changesets"]:
-            changesets = new_changesets.body["changesets"]
-            for c in changesets:
-                if c["changeset_id"] == 1:
-                    new_total_streams += 1
-                new_total_changesets += 1
-                if c["changeset_id"] > new_max_stream_length:
-                    new_max_stream_length = c["changeset_id"]
-                new_total_events += len(c["events"])
-            new_version = new_changesets.body["next_checkpoint"]
-            
-            new_changesets = self.global_changesets_handler.execute(
-                FetchGlobalChangesets(new_version, self.query_limit)
-            )
-        
+        self.shards = shards or GlobalShards()
+
+    def get_projection_state(self, projection_id):
+        state = self.db.get_analysis_state()
+        if state.checkpoint:
+            checkpoint = parse_vector_checkpoint(state.checkpoint)
+        elif state.version == 0:
+            checkpoint = [0] * self.shards.count
+        else:
+            checkpoint = [state.version]
+        return ProjectionState(
+            projection_id=projection_id,
+            state={
+                "total_streams": state.total_streams,
+                "total_changesets": state.total_changesets,
+                "total_events": state.total_events,
+                "max_stream_length": state.max_stream_length
+            },
+            checkpoint=checkpoint,
+            version=state.version)
+
+    def set_projection_state(self, state, expected_version):
+        checkpoint = None
+        if len(state.checkpoint) > 1:
+            checkpoint = make_vector_checkpoint(state.checkpoint)
         self.db.set_analysis_state(AnalysisState(
-            total_streams=new_total_streams,
-            total_changesets=new_total_changesets,
-            total_events=new_total_events,
-            max_stream_length=new_max_stream_length,
-            version=new_version
-        ), prev_state.version)
-            
-        logger.info(f"Finished projecting new state.")
+            total_streams=state.state["total_streams"],
+            total_changesets=state.state["total_changesets"],
+            total_events=state.state["total_events"],
+            max_stream_length=state.state["max_stream_length"],
+            version=state.version,
+            checkpoint=checkpoint
+        ), expected_version)
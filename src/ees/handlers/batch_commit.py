@@ -0,0 +1,69 @@
+import logging
+from ees.handlers.commit import CommitHandler
+from ees.model import BatchConcurrencyException, Response
+
+logger = logging.getLogger("ees.handlers.batch_commit")
+
+
+class BatchCommitHandler:
+    def __init__(self, db, stream_heads=None):
+        self.db = db
+        self.commit_handler = CommitHandler(db, stream_heads)
+
+    def execute(self, cmd):
+        commits = []
+        errors = []
+        for c in cmd.commits:
+            (commit, error) = self.commit_handler.prepare_commit(c)
+            if error:
+                errors.append(error)
+            else:
+                commits.append(commit)
+
+        if errors:
+            return self.batch_rejected(errors)
+
+        try:
+            self.db.append_batch(commits)
+        except BatchConcurrencyException as e:
+            conflicting_streams = set(c.stream_id for c in e.conflicts)
+            logger.debug(f"Batch commit conflicts: {conflicting_streams}")
+            return self.batch_rejected([
+                self.commit_handler.concurrency_exception(c.stream_id, c.expected_last_changeset, c.expected_last_event)
+                for c in cmd.commits if c.stream_id in conflicting_streams
+            ])
+
+        for c in commits:
+            self.commit_handler.remember_head(c)
+
+        return Response(
+            http_status=200,
+            body={
+                "changesets": [{
+                    "stream_id": c.stream_id,
+                    "changeset_id": c.changeset_id
+                } for c in commits]
+            })
+
+    def batch_rejected(self, errors):
+        # Invalid expectations take precedence over concurrency conflicts,
+        # as retrying the batch wouldn't resolve them
+        conflicts = [e.body for e in errors if e.http_status == 409]
+        invalid = [e.body for e in errors if e.http_status != 409]
+
+        if invalid:
+            return Response(
+                http_status=400,
+                body={
+                    "error": "INVALID_BATCH_COMMIT",
+                    "errors": invalid,
+                    "message": "The batch wasn't committed, since some of its commits are invalid."
+                })
+
+        return Response(
+            http_status=409,
+            body={
+                "error": "OPTIMISTIC_CONCURRENCY_EXCEPTION",
+                "conflicts": conflicts,
+                "message": "The batch wasn't committed, since some of its streams were modified. Review the changesets appended to them."
+            })
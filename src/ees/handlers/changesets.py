@@ -1,30 +1,98 @@
-from ees.model import Response
+from ees.model import Response, make_continuation_token, make_stream_etag, etag_matches
 
 class FetchChangesetsHandler:
+    # Reads that are not based on snapshots carry an ETag derived from the
+    # request and the last changeset it returned: as streams are append-only,
+    # these determine the response. A conditional read only queries the
+    # stream's head, which tells the last changeset the read would return.
     def __init__(self, db):
         self.db = db
 
     def execute(self, cmd):
-        changesets = self.db.fetch_stream_changesets(
+        head = None
+        if cmd.if_none_match and not cmd.from_snapshot:
+            head = self.db.fetch_last_commit(cmd.stream_id, meta_only=True)
+            if head:
+                etag = self.etag(cmd, self.last_changeset(cmd, head.changeset_id))
+                if etag_matches(cmd.if_none_match, etag):
+                    return self.not_modified(etag)
+
+        from_changeset = cmd.from_changeset
+        snapshot = None
+        if cmd.from_snapshot:
+            snapshot = self.db.fetch_latest_snapshot(cmd.stream_id, cmd.to_changeset)
+            if snapshot:
+                from_changeset = snapshot.changeset_id + 1
+
+        stored = self.db.fetch_stream_changesets(
             cmd.stream_id,
-            from_changeset=cmd.from_changeset,
-            to_changeset=cmd.to_changeset)
+            from_changeset=from_changeset,
+            to_changeset=cmd.to_changeset,
+            limit=cmd.limit,
+            payload=cmd.fields and [f for f in ("events", "metadata") if f in cmd.fields])
 
         changesets = [{ "changeset_id": c.changeset_id,
                         "events": c.events,
-                        "metadata": c.metadata } for c in changesets]
+                        "metadata": c.metadata } for c in stored]
         
-        if not changesets:
-            last_commit = self.db.fetch_last_commit(cmd.stream_id)
-            if not last_commit:
+        if not changesets and not snapshot:
+            head = head or self.db.fetch_last_commit(cmd.stream_id, meta_only=True)
+            if not head:
                 return self.stream_not_found(cmd.stream_id)
         
+        body = {
+            "stream_id": cmd.stream_id,
+            "changesets": changesets
+        }
+
+        if cmd.from_snapshot:
+            body["snapshot"] = snapshot and {
+                "changeset_id": snapshot.changeset_id,
+                "data": snapshot.data
+            }
+
+        if cmd.limit:
+            body["limit"] = cmd.limit
+            body["continuation_token"] = self.continuation_token(cmd, changesets)
+
+        if cmd.fields:
+            body["changesets"] = [{ f: c[f] for f in cmd.fields } for c in changesets]
+
+        headers = None
+        if not cmd.from_snapshot:
+            headers = { "ETag": self.etag(cmd, stored[-1].changeset_id if stored else None) }
+
         return Response(
             http_status=200,
-            body={
-                "stream_id": cmd.stream_id,
-                "changesets": changesets
-            })
+            body=body,
+            headers=headers)
+
+    def etag(self, cmd, last_changeset):
+        return make_stream_etag(cmd.stream_id, (last_changeset,), cmd._replace(if_none_match=None))
+
+    def last_changeset(self, cmd, head_changeset):
+        # The last changeset the read returns, or None if it returns none,
+        # when the stream's last changeset is head_changeset
+        first = cmd.from_changeset or 1
+        last = head_changeset
+        if cmd.to_changeset:
+            last = min(last, cmd.to_changeset)
+        if cmd.limit:
+            last = min(last, first + cmd.limit - 1)
+        return last if last >= first else None
+
+    def not_modified(self, etag):
+        return Response(http_status=304, body=None, headers={ "ETag": etag })
+
+    def continuation_token(self, cmd, changesets):
+        if len(changesets) < cmd.limit:
+            return None
+
+        next_changeset = changesets[-1]["changeset_id"] + 1
+        if cmd.to_changeset and next_changeset > cmd.to_changeset:
+            return None
+
+        return make_continuation_token(cmd.stream_id, "changeset", next_changeset)
     
     def stream_not_found(self, stream_id):
         return Response(
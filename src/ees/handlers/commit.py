@@ -1,65 +1,124 @@
 import logging
+import threading
+from collections import OrderedDict
 from ees.model import make_initial_commit, make_next_commit, ConcurrencyException, Response
 
 logger = logging.getLogger("ees.handlers.commit")
 
 
+class StreamHeadCache:
+    # Remembers the most recent changeset seen for each stream. A changeset's
+    # ids never change once it's written, so a cached head stays a valid
+    # predecessor for commits that expect it, even after the stream has
+    # moved on: appending after it would just fail the conditional write.
+    def __init__(self, max_streams=10000):
+        self.max_streams = max_streams
+        self.heads = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, stream_id):
+        with self.lock:
+            head = self.heads.get(stream_id)
+            if head:
+                self.heads.move_to_end(stream_id)
+            return head
+
+    def clear(self):
+        with self.lock:
+            self.heads.clear()
+
+    def put(self, commit):
+        with self.lock:
+            head = self.heads.get(commit.stream_id)
+            if not head or head.changeset_id <= commit.changeset_id:
+                self.heads[commit.stream_id] = commit._replace(events=None, metadata=None)
+            self.heads.move_to_end(commit.stream_id)
+            while len(self.heads) > self.max_streams:
+                self.heads.popitem(last=False)
+
+
 class CommitHandler:
-    def __init__(self, db):
+    def __init__(self, db, stream_heads=None):
         self.db = db
+        self.stream_heads = stream_heads
 
     def execute(self, cmd):
-        logger.debug(f'expected last changeset id {cmd.expected_last_changeset}')
-        logger.debug(f'expected last event id {cmd.expected_last_event}')
-        
-        commit = None
-        if cmd.expected_last_changeset == 0 or cmd.expected_last_event == 0:
-            commit = make_initial_commit(cmd.stream_id, cmd.events, cmd.metadata)
-        else:
-            prev_commit = self.db.fetch_last_commit(cmd.stream_id)
-            if cmd.expected_last_changeset and \
-               prev_commit.changeset_id > cmd.expected_last_changeset:
-               return self.concurrency_exception(cmd.stream_id, cmd.expected_last_changeset, cmd.expected_last_event)
-            
-            if cmd.expected_last_changeset and \
-               prev_commit.changeset_id < cmd.expected_last_changeset:
-               return self.missing_expected_changeset_exception(cmd.stream_id, 'changeset', cmd.expected_last_changeset, prev_commit.changeset_id)
-            
-            if cmd.expected_last_event and \
-               prev_commit.last_event_id > cmd.expected_last_event:
-               return self.concurrency_exception(cmd.stream_id, cmd.expected_last_changeset, cmd.expected_last_event)
-            
-            if cmd.expected_last_event and \
-               prev_commit.last_event_id < cmd.expected_last_event:
-               return self.missing_expected_changeset_exception(cmd.stream_id, 'event', cmd.expected_last_event, prev_commit.last_event_id)
-        
-            commit = make_next_commit(prev_commit, cmd.events, cmd.metadata)
+        (commit, error) = self.prepare_commit(cmd)
+        if error:
+            return error
 
         try:
             self.db.append(commit)
         except ConcurrencyException:
             return self.concurrency_exception(cmd.stream_id, cmd.expected_last_changeset, cmd.expected_last_event)
 
+        self.remember_head(commit)
+
         return Response(
             http_status=200,
             body={
                 "stream_id": commit.stream_id,
                 "changeset_id": commit.changeset_id
             }) 
+
+    def prepare_commit(self, cmd):
+        # Returns the changeset to append, or the response describing
+        # why the command's concurrency expectations cannot be met
+        logger.debug(f'expected last changeset id {cmd.expected_last_changeset}')
+        logger.debug(f'expected last event id {cmd.expected_last_event}')
+        
+        if cmd.expected_last_changeset == 0 or cmd.expected_last_event == 0:
+            return (make_initial_commit(cmd.stream_id, cmd.events, cmd.metadata), None)
+
+        # Blind append: if the expected changeset is already known, the next one
+        # can be written without reading the stream. The conditional write
+        # rejects it if the expectation is outdated.
+        head = self.stream_heads.get(cmd.stream_id) if self.stream_heads else None
+        if head and (head.changeset_id == cmd.expected_last_changeset or
+                     head.last_event_id == cmd.expected_last_event):
+            return (make_next_commit(head, cmd.events, cmd.metadata), None)
+
+        prev_commit = self.db.fetch_last_commit(cmd.stream_id, meta_only=True)
+        if prev_commit:
+            self.remember_head(prev_commit)
+        prev_changeset_id = prev_commit.changeset_id if prev_commit else 0
+        prev_last_event_id = prev_commit.last_event_id if prev_commit else 0
+
+        if cmd.expected_last_changeset and \
+           prev_changeset_id > cmd.expected_last_changeset:
+           return (None, self.concurrency_exception(cmd.stream_id, cmd.expected_last_changeset, cmd.expected_last_event))
+        
+        if cmd.expected_last_changeset and \
+           prev_changeset_id < cmd.expected_last_changeset:
+           return (None, self.missing_expected_changeset_exception(cmd.stream_id, 'changeset', cmd.expected_last_changeset, prev_changeset_id))
+        
+        if cmd.expected_last_event and \
+           prev_last_event_id > cmd.expected_last_event:
+           return (None, self.concurrency_exception(cmd.stream_id, cmd.expected_last_changeset, cmd.expected_last_event))
+        
+        if cmd.expected_last_event and \
+           prev_last_event_id < cmd.expected_last_event:
+           return (None, self.missing_expected_changeset_exception(cmd.stream_id, 'event', cmd.expected_last_event, prev_last_event_id))
+    
+        return (make_next_commit(prev_commit, cmd.events, cmd.metadata), None)
     
+    def remember_head(self, commit):
+        if self.stream_heads:
+            self.stream_heads.put(commit)
+
     def concurrency_exception(self, stream_id, expected_last_changeset, expected_last_event):
         lock_by = None
         lock_value = None
         forthcoming_changesets = None
 
-        if expected_last_changeset:
+        if expected_last_changeset is not None:
             lock_by = "changeset"
             lock_value = expected_last_changeset
             forthcoming_changesets = self.db.fetch_stream_changesets(
                 stream_id,
                 from_changeset=expected_last_changeset + 1)
         
-        if expected_last_event:
+        if expected_last_event is not None:
             lock_by = "event"
             lock_value = expected_last_event
             forthcoming_changesets = self.db.fetch_stream_by_events(
@@ -1,39 +1,140 @@
-from ees.model import Response
+import itertools
+from ees.model import Response, make_continuation_token, make_stream_etag, etag_matches
 
 
 class FetchEventsHandler:
+    # Reads that are not based on snapshots carry an ETag derived from the
+    # request and the last event it returned: as streams are append-only,
+    # these determine the response. A conditional read only queries the
+    # stream's head, which tells the last event the read would return.
     def __init__(self, db):
         self.db = db
 
     def execute(self, cmd):
-        changesets = self.db.fetch_stream_by_events(
+        # DynamoDB pages -> changesets -> events -> requested range.
+        # Each stage is a generator, so only the pages needed to fill
+        # the response are fetched and kept in memory.
+        head = None
+        if cmd.if_none_match and not cmd.from_snapshot:
+            head = self.db.fetch_last_commit(cmd.stream_id, meta_only=True)
+            if head:
+                etag = self.etag(cmd, self.last_event(cmd, head.last_event_id))
+                if etag_matches(cmd.if_none_match, etag):
+                    return self.not_modified(etag)
+
+        from_event = cmd.from_event
+        snapshot = None
+        if cmd.from_snapshot:
+            snapshot = self.latest_snapshot_before_event(cmd.stream_id, cmd.to_event)
+            if snapshot:
+                from_event = snapshot.last_event_id + 1
+
+        changesets = self.db.iterate_stream_by_events(
             cmd.stream_id,
-            from_event=cmd.from_event,
-            to_event=cmd.to_event)
+            from_event=from_event,
+            to_event=cmd.to_event,
+            page_size=cmd.limit,
+            payload=None if not cmd.fields or "data" in cmd.fields else [])
 
-        events = []
-        for c in changesets:
-            for i, e in enumerate(c.events):
-                events.append({
-                    "id": c.first_event_id + i,
-                    "data": e
-                })
-        
-        events = [e for e in events
-                    if (not cmd.from_event or e["id"] >= cmd.from_event) and
-                       (not cmd.to_event or e["id"] <= cmd.to_event)]
+        events = self.expand_events(changesets)
+        events = self.clip_events(events, from_event, cmd.to_event)
+        if cmd.limit:
+            events = itertools.islice(events, cmd.limit)
+        events = list(events)
 
-        if not events:
-            last_commit = self.db.fetch_last_commit(cmd.stream_id)
-            if not last_commit:
+        if not events and not snapshot:
+            head = head or self.db.fetch_last_commit(cmd.stream_id, meta_only=True)
+            if not head:
                 return self.stream_not_found(cmd.stream_id)
         
+        body = {
+            "stream_id": cmd.stream_id,
+            "events": events
+        }
+
+        if cmd.from_snapshot:
+            body["snapshot"] = snapshot and {
+                "changeset_id": snapshot.changeset_id,
+                "last_event_id": snapshot.last_event_id,
+                "data": snapshot.data
+            }
+
+        if cmd.limit:
+            body["limit"] = cmd.limit
+            body["continuation_token"] = self.continuation_token(cmd, events)
+
+        if cmd.fields:
+            body["events"] = [{ f: e[f] for f in cmd.fields } for e in events]
+
+        headers = None
+        if not cmd.from_snapshot:
+            headers = { "ETag": self.etag(cmd, events[-1]["id"] if events else None) }
+
         return Response(
             http_status=200,
-            body={
-                "stream_id": cmd.stream_id,
-                "events": events
-            })
+            body=body,
+            headers=headers)
+
+    def etag(self, cmd, last_event):
+        return make_stream_etag(cmd.stream_id, (last_event,), cmd._replace(if_none_match=None))
+
+    def last_event(self, cmd, head_event):
+        # The last event the read returns, or None if it returns none, when
+        # the stream's last event is head_event. Changesets without events
+        # don't change it.
+        first = cmd.from_event or 1
+        last = head_event
+        if cmd.to_event:
+            last = min(last, cmd.to_event)
+        if cmd.limit:
+            last = min(last, first + cmd.limit - 1)
+        return last if last >= first else None
+
+    def not_modified(self, etag):
+        return Response(http_status=304, body=None, headers={ "ETag": etag })
+
+    def latest_snapshot_before_event(self, stream_id, to_event):
+        snapshot = self.db.fetch_latest_snapshot(stream_id)
+        if snapshot and to_event and snapshot.last_event_id > to_event:
+            # Snapshots are indexed by changesets, older ones
+            # have to be found by their changeset ids
+            containing = self.db.fetch_stream_by_events(stream_id, to_event, to_event)
+            if not containing:
+                return None
+            snapshot = self.db.fetch_latest_snapshot(stream_id, containing[0].changeset_id)
+            if snapshot and snapshot.last_event_id > to_event:
+                snapshot = self.db.fetch_latest_snapshot(stream_id, snapshot.changeset_id - 1)
+        return snapshot
+
+    def expand_events(self, changesets):
+        for c in changesets:
+            if c.events is None:
+                # The events' data wasn't read
+                for event_id in range(c.first_event_id, c.last_event_id + 1):
+                    yield { "id": event_id }
+                continue
+            for i, e in enumerate(c.events):
+                yield {
+                    "id": c.first_event_id + i,
+                    "data": e
+                }
+
+    def clip_events(self, events, from_event, to_event):
+        if from_event:
+            events = itertools.dropwhile(lambda e: e["id"] < from_event, events)
+        if to_event:
+            events = itertools.takewhile(lambda e: e["id"] <= to_event, events)
+        return events
+
+    def continuation_token(self, cmd, events):
+        if len(events) < cmd.limit:
+            return None
+
+        next_event = events[-1]["id"] + 1
+        if cmd.to_event and next_event > cmd.to_event:
+            return None
+
+        return make_continuation_token(cmd.stream_id, "event", next_event)
     
     def stream_not_found(self, stream_id):
         return Response(
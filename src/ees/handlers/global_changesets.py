@@ -1,35 +1,244 @@
+import itertools
 import json
-from ees.model import CheckpointCalc, Response
+import math
+import time
+from ees.model import CheckpointCalc, GlobalShards, Response, make_etag, make_vector_checkpoint
+
+def global_checkpoint(changeset, shards):
+    # The changeset's position in its shard
+    return CheckpointCalc(changeset.page_size).to_checkpoint(shards.shard_page(changeset.page), changeset.page_item)
+
+# Long polling: when the checkpoint is at the head of the feed, the request
+# waits for new changesets for up to `wait` seconds. While waiting, only the
+# requested shards' counters are polled; the index is queried again once
+# a counter moves past the checkpoint. The API Gateway's integration
+# timeout is 29 seconds, hence the maximum wait.
+max_wait = 20
+poll_interval = 0.25
+
+# Filtering: the limit is counted in the matching changesets, so the feed is
+# read in batches until enough changesets match. To bound the response time,
+# a request scans up to max_scanned_changesets changesets per shard; the
+# next checkpoint moves past the scanned changesets even if none matched.
+filter_batch_size = 100
+max_scanned_changesets = 1000
+
+# A full response of consecutive checkpoints doesn't change as the feed grows:
+# all of its positions were assigned and read. Such responses can be cached
+# by the API Gateway and the clients. Repairing or compacting the index can
+# still move changesets, and bumps the index settings' version: the version
+# is part of the ETag, and the max-age bounds how long a stale response can
+# be served without revalidation.
+complete_cache_control = "public, max-age=3600"
+
+
+def filter_changeset(changeset, stream_prefixes, event_types):
+    # Returns the changeset with only its events of the requested types,
+    # or None if it doesn't match
+    if stream_prefixes and not changeset["stream_id"].startswith(tuple(stream_prefixes)):
+        return None
+    if event_types:
+        events = [e for e in changeset["events"] if isinstance(e, dict) and e.get("type") in event_types]
+        if not events:
+            return None
+        changeset = dict(changeset, events=events)
+    return changeset
+
 
 class FetchGlobalChangesetsHandler:
-    def __init__(self, db):
+    def __init__(self, db, shards=None, clock=time.monotonic, sleep=time.sleep):
         self.db = db
-        self.checkpoint_calc = CheckpointCalc()
+        self.shards = shards or GlobalShards()
         self.default_limit=10
+        self.clock = clock
+        self.sleep = sleep
 
-    def execute(self, cmd):        
+    def execute(self, cmd):
+        response = self.wait_for_changesets(cmd, self.fetch(cmd))
+        if cmd.fields and response.http_status == 200:
+            fields = cmd.fields + ("shard",)
+            response.body["changesets"] = [{ f: c[f] for f in fields if f in c }
+                                           for c in response.body["changesets"]]
+        if response.headers:
+            version = self.db.cached_index_settings().version
+            response.headers["ETag"] = make_etag([version, response.body])
+        return response
+
+    def wait_for_changesets(self, cmd, response):
+        if not cmd.wait or response.http_status != 200 or not self.at_head(response):
+            return response
+
+        checkpoints = self.shard_checkpoints(cmd)
+        deadline = self.clock() + min(cmd.wait, max_wait)
+        while self.at_head(response):
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                break
+            self.sleep(min(poll_interval, remaining))
+            if any(self.head(shard) > checkpoint for shard, checkpoint in checkpoints.items()):
+                response = self.fetch(cmd)
+        return response
+
+    def fetch(self, cmd):
         limit = cmd.limit or self.default_limit
 
-        changesets = self.db.fetch_global_changesets(cmd.checkpoint, limit)
-
-        changesets = [{
-               "stream_id": c.stream_id,
-               "changeset_id": c.changeset_id,
-               "events": c.events,
-               "metadata": c.metadata,
-               "checkpoint":
-                    self.checkpoint_calc.to_checkpoint(c.page, c.page_item)
-                } for c in changesets]
-        
-        next_checkpoint = cmd.checkpoint
-        if changesets:
-            next_checkpoint = max([c["checkpoint"] for c in changesets]) + 1
+        if cmd.shard is not None:
+            if cmd.shard >= self.shards.count:
+                return self.invalid_shard(cmd.shard)
+            (changesets, next_checkpoint) = self.fetch_shard(cmd.shard, cmd.checkpoint, limit, cmd)
+            return Response(
+                http_status=200,
+                body={
+                    "shard": cmd.shard,
+                    "checkpoint": cmd.checkpoint,
+                    "limit": limit,
+                    "changesets": changesets,
+                    "next_checkpoint": next_checkpoint
+                },
+                headers=self.cache_headers(cmd, [(changesets, cmd.checkpoint, limit)]))
+
+        checkpoints = cmd.checkpoint
+        if not isinstance(checkpoints, list):
+            if self.shards.count == 1:
+                checkpoints = [checkpoints]
+            elif checkpoints == 0:
+                checkpoints = [0] * self.shards.count
+        if not isinstance(checkpoints, list) or len(checkpoints) != self.shards.count:
+            return self.invalid_vector_checkpoint(cmd.checkpoint)
+
+        if self.shards.count == 1:
+            (changesets, next_checkpoint) = self.fetch_shard(0, checkpoints[0], limit, cmd)
+            return Response(
+                http_status=200,
+                body={
+                    "checkpoint": checkpoints[0],
+                    "limit": limit,
+                    "changesets": changesets,
+                    "next_checkpoint": next_checkpoint
+                },
+                headers=self.cache_headers(cmd, [(changesets, checkpoints[0], limit)]))
+
+        # Each shard is read for its share of the limit; the shards that
+        # returned their full share are topped up until the limit is reached.
+        # The shards are merged in turns, so that all of them progress
+        shard_results = [([], checkpoint) for checkpoint in checkpoints]
+        requested = [0] * self.shards.count
+        open_shards = list(range(self.shards.count))
+        while open_shards:
+            missing = limit - sum(len(r[0]) for r in shard_results)
+            if missing <= 0:
+                break
+            share = math.ceil(missing / len(open_shards))
+            for shard in list(open_shards):
+                (shard_changesets, shard_next_checkpoint) = shard_results[shard]
+                (fetched, next_checkpoint) = self.fetch_shard(shard, shard_next_checkpoint, share, cmd)
+                shard_results[shard] = (shard_changesets + fetched, next_checkpoint)
+                requested[shard] += share
+                if len(fetched) < share:
+                    open_shards.remove(shard)
+
+        next_checkpoints = list(checkpoints)
+        taken = [0] * self.shards.count
+        changesets = []
+        for turn in itertools.zip_longest(*[r[0] for r in shard_results]):
+            for shard, c in enumerate(turn):
+                if c and len(changesets) < limit:
+                    changesets.append(dict(c, shard=shard))
+                    next_checkpoints[shard] = c["checkpoint"] + 1
+                    taken[shard] += 1
+        # A shard that had all its changesets taken continues after
+        # the changesets it scanned
+        for shard, (shard_changesets, shard_next_checkpoint) in enumerate(shard_results):
+            if taken[shard] == len(shard_changesets):
+                next_checkpoints[shard] = shard_next_checkpoint
 
         return Response(
             http_status=200,
             body={
-                "checkpoint": cmd.checkpoint,
+                "checkpoint": make_vector_checkpoint(checkpoints),
                 "limit": limit,
                 "changesets": changesets,
-                "next_checkpoint": next_checkpoint
-            })
\ No newline at end of file
+                "next_checkpoint": make_vector_checkpoint(next_checkpoints)
+            },
+            headers=self.cache_headers(cmd, [(r[0], c, n) for r, c, n in zip(shard_results, checkpoints, requested)]))
+
+    def fetch_shard(self, shard, checkpoint, limit, cmd=None):
+        filtered = cmd is not None and bool(cmd.stream_prefix or cmd.event_type)
+        batch_size = max(limit, filter_batch_size) if filtered else limit
+        payload = None
+        if cmd is not None and cmd.fields:
+            # The events are needed to filter by the events' types
+            payload = [f for f in ("events", "metadata")
+                       if f in cmd.fields or (f == "events" and cmd.event_type)]
+        max_scanned = max(limit, max_scanned_changesets)
+
+        changesets = []
+        next_checkpoint = checkpoint
+        scanned = 0
+        while True:
+            batch = self.db.fetch_global_changesets(next_checkpoint, batch_size, shard, self.shards.count,
+                                                    payload)
+            for c in batch:
+                changeset = {
+                    "stream_id": c.stream_id,
+                    "changeset_id": c.changeset_id,
+                    "events": c.events,
+                    "metadata": c.metadata,
+                    "checkpoint": global_checkpoint(c, self.shards)
+                }
+                next_checkpoint = changeset["checkpoint"] + 1
+                scanned += 1
+                if filtered:
+                    changeset = filter_changeset(changeset, cmd.stream_prefix, cmd.event_type)
+                if changeset:
+                    changesets.append(changeset)
+                    if len(changesets) >= limit:
+                        break
+            if not filtered or len(changesets) >= limit or len(batch) < batch_size or scanned >= max_scanned:
+                return (changesets, next_checkpoint)
+
+    def cache_headers(self, cmd, shard_reads):
+        # The merged shards' reads all have to be complete: with every shard
+        # returning all the changesets requested from it, new changesets
+        # can't change how the shards are merged
+        if cmd.stream_prefix or cmd.event_type:
+            return None
+        for (changesets, checkpoint, requested) in shard_reads:
+            if len(changesets) < requested or \
+               any(c["checkpoint"] != checkpoint + i for i, c in enumerate(changesets)):
+                return None
+        return { "Cache-Control": complete_cache_control }
+
+    def at_head(self, response):
+        # With filters, an empty response may still advance the checkpoint
+        return not response.body["changesets"] and \
+            response.body["next_checkpoint"] == response.body["checkpoint"]
+
+    def shard_checkpoints(self, cmd):
+        if cmd.shard is not None:
+            return { cmd.shard: cmd.checkpoint }
+        if isinstance(cmd.checkpoint, list):
+            return dict(enumerate(cmd.checkpoint))
+        return { shard: cmd.checkpoint for shard in range(self.shards.count) }
+
+    def head(self, shard):
+        counter = self.db.get_global_counter(shard)
+        return CheckpointCalc(counter.page_size).to_checkpoint(counter.page, counter.page_item) + 1
+
+    def invalid_shard(self, shard):
+        return Response(
+            http_status=400,
+            body={
+                "error": "INVALID_SHARD",
+                "message": f'The shard "{shard}" doesn\'t exist. The global index has {self.shards.count} shard(s).'
+            })
+
+    def invalid_vector_checkpoint(self, checkpoint):
+        if isinstance(checkpoint, list):
+            checkpoint = make_vector_checkpoint(checkpoint)
+        return Response(
+            http_status=400,
+            body={
+                "error": "INVALID_CHECKPOINT",
+                "message": f'"{checkpoint}" is an invalid checkpoint value. Expected a comma separated checkpoint for each of the {self.shards.count} shards.'
+            })
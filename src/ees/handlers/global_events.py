@@ -0,0 +1,130 @@
+import itertools
+import math
+from ees.handlers.global_changesets import global_checkpoint
+from ees.model import GlobalShards, Response, make_event_checkpoint
+
+class FetchGlobalEventsHandler:
+    def __init__(self, db, shards=None):
+        self.db = db
+        self.shards = shards or GlobalShards()
+        self.default_limit = 10
+
+    def execute(self, cmd):
+        limit = cmd.limit or self.default_limit
+
+        if cmd.shard is not None:
+            if cmd.shard >= self.shards.count:
+                return self.invalid_shard(cmd.shard)
+            (events, next_position) = self.fetch_shard(cmd.shard, cmd.checkpoint, limit)
+            return Response(
+                http_status=200,
+                body={
+                    "shard": cmd.shard,
+                    "checkpoint": make_event_checkpoint(cmd.checkpoint),
+                    "limit": limit,
+                    "events": [e for (e, _) in events],
+                    "next_checkpoint": make_event_checkpoint(next_position)
+                })
+
+        positions = cmd.checkpoint
+        if not isinstance(positions, list):
+            if self.shards.count == 1:
+                positions = [positions]
+            elif positions == (0, 0):
+                positions = [(0, 0)] * self.shards.count
+        if not isinstance(positions, list) or len(positions) != self.shards.count:
+            return self.invalid_vector_checkpoint(cmd.checkpoint)
+
+        if self.shards.count == 1:
+            (events, next_position) = self.fetch_shard(0, positions[0], limit)
+            return Response(
+                http_status=200,
+                body={
+                    "checkpoint": make_event_checkpoint(positions[0]),
+                    "limit": limit,
+                    "events": [e for (e, _) in events],
+                    "next_checkpoint": make_event_checkpoint(next_position)
+                })
+
+        # The shards are merged in turns, so that all of them progress
+        shard_events = [self.fetch_shard(shard, position, limit)[0]
+                        for shard, position in enumerate(positions)]
+        next_positions = list(positions)
+        events = []
+        for turn in itertools.zip_longest(*shard_events):
+            for shard, entry in enumerate(turn):
+                if entry and len(events) < limit:
+                    (e, next_position) = entry
+                    events.append(dict(e, shard=shard))
+                    next_positions[shard] = next_position
+
+        return Response(
+            http_status=200,
+            body={
+                "checkpoint": self.make_vector_checkpoint(positions),
+                "limit": limit,
+                "events": events,
+                "next_checkpoint": self.make_vector_checkpoint(next_positions)
+            })
+
+    def fetch_shard(self, shard, position, limit):
+        # Changesets are read in batches sized by the events per changeset
+        # seen so far, so that the limit is filled without reading many
+        # more changesets than needed. Only the requested events are returned,
+        # each along with the position that follows it.
+        (checkpoint, offset) = position
+        next_position = position
+        events = []
+        (changesets_read, events_read) = (0, 0)
+        batch_limit = limit
+        while len(events) < limit:
+            changesets = self.db.fetch_global_changesets(checkpoint, batch_limit, shard, self.shards.count)
+            if not changesets:
+                break
+
+            for c in changesets:
+                changeset_checkpoint = global_checkpoint(c, self.shards)
+                first = offset if changeset_checkpoint == position[0] else 0
+                for i in range(first, len(c.events)):
+                    if len(events) == limit:
+                        break
+                    next_position = (changeset_checkpoint, i + 1) if i + 1 < len(c.events) \
+                                    else (changeset_checkpoint + 1, 0)
+                    events.append(({
+                        "stream_id": c.stream_id,
+                        "changeset_id": c.changeset_id,
+                        "event_id": c.first_event_id + i,
+                        "checkpoint": make_event_checkpoint((changeset_checkpoint, i)),
+                        "data": c.events[i]
+                    }, next_position))
+                changesets_read += 1
+                events_read += len(c.events)
+            checkpoint = global_checkpoint(changesets[-1], self.shards) + 1
+
+            events_per_changeset = max(events_read / changesets_read, 1)
+            batch_limit = max(math.ceil((limit - len(events)) / events_per_changeset), 1)
+
+        return (events, next_position)
+
+    def make_vector_checkpoint(self, positions):
+        return ",".join(make_event_checkpoint(p) for p in positions)
+
+    def invalid_shard(self, shard):
+        return Response(
+            http_status=400,
+            body={
+                "error": "INVALID_SHARD",
+                "message": f'The shard "{shard}" doesn\'t exist. The global index has {self.shards.count} shard(s).'
+            })
+
+    def invalid_vector_checkpoint(self, checkpoint):
+        if isinstance(checkpoint, list):
+            checkpoint = self.make_vector_checkpoint(checkpoint)
+        elif isinstance(checkpoint, tuple):
+            checkpoint = make_event_checkpoint(checkpoint)
+        return Response(
+            http_status=400,
+            body={
+                "error": "INVALID_CHECKPOINT",
+                "message": f'"{checkpoint}" is an invalid checkpoint value. Expected a comma separated checkpoint(e.g. "42.1") for each of the {self.shards.count} shards.'
+            })
@@ -1,60 +1,132 @@
-from ees.model import ConcurrencyException, GlobalCounter, GlobalIndex, CheckpointCalc
+from datetime import datetime
+from ees.model import ConcurrencyException, GlobalCounter, GlobalIndex, GlobalShards, CheckpointCalc, IndexerState
 import logging
 
 
 logger = logging.getLogger("ees.handlers.global_indexer")
 
 # The algorithm:
-# R   assign global index to changeset:
-#         If changeset already has a global id - return
-# R       If the previous changeset in the stream has no global id then:
-#              assign global index to the stream's previous changeset
+# R   assign global indexes to a batch of changesets:
+# R       Collect the changesets that have no global index, along with their
+#         streams' preceding changesets that have no global index
+#         (a batch read, and a ranged query per stream with a gap)
 # R       Get the last assigned global index counter value
 # R       If the assigned global index wasn't written to the changeset then
 #              write the last assigned global index value to its changeset
-# W       Increment the last assigned global index value and assign it to the changeset
-# W       Write the global id to the changeset
+# W       Increment the counter by the number of collected changesets and
+#         write their global indexes, in a single transaction
+#
+# In the sharded mode the above is performed independently for each shard,
+# with the changesets of the streams assigned to it.
+
+# A transaction is limited to 100 items, one of them is the counter
+max_reserved_indexes = 99
 
 
 class GlobalIndexer:
-    def __init__(self, db):
+    def __init__(self, db, shards=None, clock=datetime.utcnow):
         self.db = db
-        self.checkpoint_calc = CheckpointCalc()
+        self.shards = shards or GlobalShards()
+        self.clock = clock
     
     def execute(self, cmd):
-        for c in cmd.changesets:
-            self.assign_global_index(c["stream_id"], c["changeset_id"])
-
-    def assign_global_index(self, stream_id, changeset_id):
-        logger.info(f"Assign global index to {stream_id}/{changeset_id}")
-        g_ind = self.db.get_global_index_value(stream_id, changeset_id)
-        if g_ind.page != None and g_ind.page_item != None:
-            logger.debug("The changeset already has an assigned global index")
-            return
-        
-        self.ensure_prev_changeset_has_global_index(stream_id, changeset_id)
-
-        last_assigned_index = self.db.get_global_counter()
-        logger.debug(f"Current global counter: {last_assigned_index}")
-        self.ensure_index_committed(last_assigned_index)
-
-        if last_assigned_index.prev_stream_id != stream_id or \
-           last_assigned_index.prev_changeset_id != changeset_id:
-           new_counter_value = self.increment_counter(stream_id, changeset_id, last_assigned_index)
-           new_global_index = GlobalIndex(stream_id,
-                                          changeset_id,
-                                          new_counter_value.page,
-                                          new_counter_value.page_item)
-           self.db.set_global_index(new_global_index)
-           logger.debug(f"Global index value set for {stream_id}/{changeset_id}: {new_global_index}")
-    
-    def ensure_prev_changeset_has_global_index(self, stream_id, changeset_id):
-        if changeset_id > 1:
-            prev_changeset_id = changeset_id - 1
-            logger.debug(f"First have to ensure that the prev changeset has a global index({stream_id}/{prev_changeset_id})")
-            self.assign_global_index(stream_id, prev_changeset_id)
-    
-    def ensure_index_committed(self, index):
+        started = self.clock()
+        keys = [(c["stream_id"], c["changeset_id"]) for c in cmd.changesets]
+        unindexed = self.collect_unindexed(keys)
+        if not unindexed:
+            logger.debug("All the changesets already have assigned global indexes")
+
+        by_shard = { }
+        for key in unindexed:
+            by_shard.setdefault(self.shards.shard_of(key[0]), []).append(key)
+
+        for shard, shard_keys in by_shard.items():
+            self.index_shard(shard, shard_keys)
+
+        self.record_lag(cmd.changesets, unindexed, started)
+
+    def record_lag(self, changesets, unindexed, started):
+        # Describes this batch only, each run overwrites the recorded state.
+        # The commit timestamps are known for the stream records' changesets,
+        # but not for the unindexed predecessors found along with them
+        committed = { (c["stream_id"], c["changeset_id"]): parse_timestamp(c["timestamp"])
+                      for c in changesets if c.get("timestamp") }
+        waiting = [committed[k] for k in unindexed if k in committed]
+        finished = self.clock()
+        latencies = [to_ms(finished - t) for t in waiting]
+
+        state = IndexerState(
+            timestamp=finished.isoformat("T") + "Z",
+            last_batch_indexed_changesets=len(unindexed),
+            last_batch_oldest_record_age_ms=to_ms(started - min(waiting)) if waiting else 0,
+            last_batch_average_latency_ms=sum(latencies) // len(latencies) if latencies else 0,
+            last_batch_max_latency_ms=max(latencies, default=0))
+        logger.debug(f"Indexer lag: {state}")
+        self.db.set_indexer_state(state)
+
+    def index_shard(self, shard, unindexed):
+        last_assigned_index = self.db.get_global_counter(shard)
+        logger.debug(f"Current global counter of shard {shard}: {last_assigned_index}")
+        self.ensure_index_committed(last_assigned_index, shard)
+        committed = (last_assigned_index.prev_stream_id, last_assigned_index.prev_changeset_id)
+        unindexed = [k for k in unindexed if k != committed]
+
+        for i in range(0, len(unindexed), max_reserved_indexes):
+            last_assigned_index = self.reserve_range(last_assigned_index, unindexed[i:i + max_reserved_indexes], shard)
+
+    def collect_unindexed(self, keys):
+        # Returns the changesets that have to be indexed, including their
+        # streams' unindexed preceding changesets, in the order they have
+        # to be assigned. The changesets and their direct predecessors are
+        # read in one batch; longer gaps are found with one ranged query
+        # per stream.
+        predecessors = [(s, c - 1) for (s, c) in keys if c > 1]
+        known = self.db.get_global_index_values(keys + predecessors)
+
+        result = []
+        pending = set()
+        for key in keys:
+            index = known.get(key)
+            if not index:
+                # Skipping it would consume its stream record without indexing
+                # it, failing the batch makes the stream records be retried
+                raise ValueError(f"The changeset {key[0]}/{key[1]} wasn't found")
+            if key in pending or index.page is not None:
+                continue
+
+            (stream_id, changeset_id) = key
+            prev = (stream_id, changeset_id - 1)
+            prev_index = known.get(prev)
+            if changeset_id == 1 or prev in pending or (prev_index and prev_index.page is not None):
+                gap = [key]
+            else:
+                logger.debug(f"Preceding changesets of {stream_id}/{changeset_id} have no global indexes")
+                gap = [(stream_id, c) for c in self.db.fetch_unindexed_changesets(stream_id, changeset_id)
+                       if (stream_id, c) not in pending]
+
+            pending.update(gap)
+            result.extend(gap)
+        return result
+
+    def reserve_range(self, prev_counter, keys, shard=0):
+        # The counter holds the shard's page, the changesets are written
+        # with the corresponding enumeration index's page. The counter's page
+        # size is the one the index's head is currently paged by.
+        checkpoint_calc = CheckpointCalc(prev_counter.page_size)
+        page_size = prev_counter.page_size
+        indexes = []
+        (page, page_item) = (prev_counter.page, prev_counter.page_item)
+        for (stream_id, changeset_id) in keys:
+            (page, page_item) = checkpoint_calc.next_page_and_item(page, page_item)
+            indexes.append(GlobalIndex(stream_id, changeset_id, self.shards.index_page(shard, page), page_item, page_size))
+
+        (stream_id, changeset_id) = keys[-1]
+        new_counter = GlobalCounter(page, page_item, stream_id, changeset_id, page_size)
+        self.db.reserve_global_indexes(prev_counter, new_counter, indexes, shard)
+        logger.debug(f"Counter increased from {prev_counter} to {new_counter}, reserved {len(indexes)} indexes")
+        return new_counter
+
+    def ensure_index_committed(self, index, shard=0):
         if not index.prev_stream_id:
             return
         
@@ -66,17 +138,15 @@ class GlobalIndexer:
             logger.info("The previous assigned index was not written. Repairing.")
             fixed_index = GlobalIndex(changeset_index.stream_id,
                                       changeset_index.changeset_id,
-                                      index.page,
-                                      index.page_item)
+                                      self.shards.index_page(shard, index.page),
+                                      index.page_item,
+                                      index.page_size)
 
             self.db.set_global_index(fixed_index)
 
-    def increment_counter(self, stream_id, changeset_id, prev_counter):
-        (p, i) = self.checkpoint_calc.next_page_and_item(prev_counter.page,
-                                                        prev_counter.page_item)
-        new_counter = GlobalCounter(p, i, stream_id, changeset_id)
-        self.db.update_global_counter(prev_counter, new_counter)
-        logger.debug(f"Counter increased from {prev_counter} to {new_counter}")
-        return new_counter
 
+def parse_timestamp(timestamp):
+    return datetime.fromisoformat(timestamp.rstrip("Z"))
 
+def to_ms(duration):
+    return max(int(duration.total_seconds() * 1000), 0)
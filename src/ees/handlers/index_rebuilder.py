@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+from ees.model import BatchConcurrencyException, ConcurrencyException, GlobalCounter, GlobalIndex, GlobalShards, CheckpointCalc, IndexAudit
+
+
+logger = logging.getLogger("ees.handlers.index_rebuilder")
+
+# Verifies and rebuilds the global index:
+# R   Scan the table's segments in parallel, collecting all the
+#     changesets' global indexes
+# R   Read the shards' counters
+#     Audit each shard: a changeset has to be re-indexed if it's unindexed,
+#     shares its position with another changeset, holds a position at or
+#     after the counter, or follows a changeset of its stream that
+#     has to be re-indexed
+# W   Repair: move the changesets that have to be re-indexed to the positions
+#     following the counter. Each chunk of changesets is written in a single
+#     transaction along with the counter, so an interrupted repair doesn't
+#     leave reserved positions without changesets.
+# W   Compact: re-number all the shard's changesets from 0, filling the gaps.
+#     Changes the checkpoints, so it's meant for an offline rebuild.
+# W   Bump the index settings' version, invalidating the cached pages
+#
+# Changesets are re-indexed in the order of their keys, so the results
+# are deterministic. The indexes are written conditionally on their scanned
+# values, a changeset that was concurrently indexed is reported as a conflict,
+# and the rest of its chunk is written without it. If the indexer moved the
+# counter meanwhile, the chunk is moved past the counter's new position.
+
+# A transaction is limited to 100 items, one of them is the counter
+max_chunk_size = 99
+
+class GlobalIndexRebuilder:
+    def __init__(self, db, shards=None, segments=8, workers=8, chunk_size=max_chunk_size):
+        self.db = db
+        self.shards = shards or GlobalShards()
+        self.segments = segments
+        self.workers = workers
+        self.chunk_size = min(chunk_size, max_chunk_size)
+
+    def execute(self, compact=False):
+        (indexes, counters, audit) = self.verify()
+        if not self.has_issues(audit) and not (compact and audit.gaps):
+            logger.info("The global index is consistent")
+            return (audit, [])
+
+        conflicts = []
+        for shard in range(self.shards.count):
+            conflicts.extend(self.rebuild_shard(shard, indexes, counters[shard], audit, compact))
+
+        # The re-indexed pages changed, bumping the settings' version makes
+        # the readers drop the pages they cached
+        settings = self.db.get_index_settings()
+        self.db.update_index_settings(settings, settings._replace(version=settings.version + 1))
+        return (audit, conflicts)
+
+    def verify(self):
+        settings = self.db.get_index_settings()
+        if settings.target_page_size:
+            raise ValueError(f"Re-indexing to page size {settings.target_page_size} is in progress")
+
+        indexes = self.scan()
+        # The counters are read after the scan, so that they cover
+        # all the scanned indexes
+        counters = [self.db.get_global_counter(shard) for shard in range(self.shards.count)]
+        audit = self.audit(indexes, counters, settings.page_size)
+        logger.info(f"Audited {audit.changesets} changesets: {len(audit.unindexed)} unindexed, "
+                    f"{len(audit.duplicated)} duplicated, {len(audit.misplaced)} misplaced, "
+                    f"{len(audit.out_of_order)} out of order, {len(audit.beyond_head)} beyond head, "
+                    f"{len(audit.gaps)} gaps")
+        return (indexes, counters, audit)
+
+    def scan(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            segments = executor.map(lambda s: self.db.scan_global_indexes(s, self.segments),
+                                    range(self.segments))
+            indexes = list(itertools.chain.from_iterable(segments))
+        return { (i.stream_id, i.changeset_id): i for i in indexes }
+
+    def audit(self, indexes, counters, page_size):
+        calc = CheckpointCalc(page_size)
+        heads = [self.head(c) for c in counters]
+        (unindexed, misplaced, beyond_head) = ([], [], [])
+        by_position = { }
+        for key in sorted(indexes):
+            index = indexes[key]
+            shard = self.shards.shard_of(index.stream_id)
+            if index.page is None:
+                unindexed.append(key)
+            elif index.page % self.shards.count != shard or \
+                 (index.page_size or calc.default_page_size) != calc.page_size:
+                misplaced.append(key)
+            else:
+                position = calc.to_checkpoint(self.shards.shard_page(index.page), index.page_item)
+                if position >= heads[shard]:
+                    beyond_head.append(key)
+                else:
+                    by_position.setdefault((shard, position), []).append(key)
+
+        # Of the changesets sharing a position, the one with the lowest key keeps it
+        positions = { }
+        duplicated = []
+        for position, keys in by_position.items():
+            positions[keys[0]] = position
+            duplicated.extend(keys[1:])
+
+        # A stream's changesets have to be enumerated in order
+        out_of_order = []
+        for stream_id, keys in itertools.groupby(sorted(indexes), key=lambda k: k[0]):
+            last_position = -1
+            broken = False
+            for key in keys:
+                if key not in positions:
+                    broken = True
+                elif broken or positions[key][1] <= last_position:
+                    out_of_order.append(key)
+                    del positions[key]
+                    broken = True
+                else:
+                    last_position = positions[key][1]
+
+        held = set(positions.values())
+        gaps = [(shard, p) for shard in range(self.shards.count)
+                for p in range(heads[shard]) if (shard, p) not in held]
+
+        return IndexAudit(len(indexes), unindexed, sorted(duplicated), misplaced,
+                          sorted(out_of_order), beyond_head, gaps)
+
+    def has_issues(self, audit):
+        return bool(audit.unindexed or audit.duplicated or audit.misplaced or
+                    audit.out_of_order or audit.beyond_head)
+
+    def rebuild_shard(self, shard, indexes, counter, audit, compact):
+        invalid = set(audit.unindexed + audit.duplicated + audit.misplaced +
+                      audit.out_of_order + audit.beyond_head)
+        keys = sorted(k for k in indexes if self.shards.shard_of(k[0]) == shard)
+        reindexed = [k for k in keys if k in invalid]
+        calc = CheckpointCalc(counter.page_size)
+
+        if compact:
+            kept = sorted((k for k in keys if k not in invalid), key=lambda k: self.position(indexes[k], calc))
+            order = kept + reindexed
+            first_position = 0
+        else:
+            order = reindexed
+            first_position = self.head(counter)
+        if not order:
+            return []
+
+        conflicts = []
+        pending = order
+        position = first_position
+        while pending:
+            chunk = pending[:self.chunk_size]
+            (new_counter, updates) = self.relocation(shard, chunk, position, counter, indexes, invalid)
+            try:
+                self.db.relocate_global_indexes(counter, new_counter, updates, shard)
+            except BatchConcurrencyException as e:
+                conflicted = [(c.stream_id, c.changeset_id) for c in e.conflicts]
+                logger.warning(f"The global indexes of {conflicted} were concurrently updated")
+                conflicts.extend(conflicted)
+                pending = [k for k in pending if k not in conflicted]
+                continue
+            except ConcurrencyException:
+                if compact:
+                    raise
+                counter = self.db.get_global_counter(shard)
+                position = self.head(counter)
+                continue
+            pending = pending[len(chunk):]
+            position += len(chunk)
+            counter = new_counter
+
+        logger.info(f"Shard {shard}: re-indexed {len(order) - len(conflicts)} changesets, {len(conflicts)} conflicts")
+        return conflicts
+
+    def relocation(self, shard, chunk, first_position, counter, indexes, invalid):
+        # Returns the counter following the chunk's positions, and the
+        # (prev_value, new_value) indexes of the chunk's moved changesets
+        calc = CheckpointCalc(counter.page_size)
+        updates = []
+        for i, key in enumerate(chunk):
+            (page, page_item) = calc.to_page_item(first_position + i)
+            new_index = GlobalIndex(key[0], key[1], self.shards.index_page(shard, page), page_item, calc.page_size)
+            prev_index = indexes[key]
+            if key in invalid or (new_index.page, new_index.page_item) != (prev_index.page, prev_index.page_item):
+                updates.append((prev_index, new_index))
+
+        (page, page_item) = calc.to_page_item(first_position + len(chunk) - 1)
+        (stream_id, changeset_id) = chunk[-1]
+        return (GlobalCounter(page, page_item, stream_id, changeset_id, counter.page_size), updates)
+
+    def position(self, index, calc):
+        return calc.to_checkpoint(self.shards.shard_page(index.page), index.page_item)
+
+    def head(self, counter):
+        return CheckpointCalc(counter.page_size).to_checkpoint(counter.page, counter.page_item) + 1
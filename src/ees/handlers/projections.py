@@ -0,0 +1,168 @@
+import copy
+import logging
+import time
+
+from ees.commands import FetchGlobalChangesets
+from ees.model import ConcurrencyException, GlobalShards, ProjectionState, parse_vector_checkpoint
+
+logger = logging.getLogger("ees.handlers.projections")
+
+# Projects the registered read models in shared passes over the global feed:
+# R   Load the projections' states and checkpoints
+#     Group the projections: the most advanced projection and the ones lagging
+#     it by up to max_shared_lag changesets share a pass starting at their
+#     lowest checkpoints. The rest are grouped the same way, and catch up in
+#     passes of their own, so they don't hold back the leading projections.
+# R   Each page of a pass is fed to all of its projections, a projection only
+#     reduces the changesets that follow its own checkpoint
+# W   The advanced projections are persisted every checkpoint_every changesets
+#     or checkpoint_interval seconds, and at the end of the pass
+#
+# A projection whose reducer fails, or whose state fails to be saved (e.g. it
+# was concurrently saved by another run), is left out of the rest of the run
+# without persisting its unsaved progress; the other projections continue.
+# A run stops once less than deadline_margin_ms of its time is left: a batch
+# has to be fetched, projected and persisted in the remaining time.
+max_shared_lag = 10000
+checkpoint_every = 10000
+checkpoint_interval = 60
+deadline_margin_ms = 30000
+
+
+class ProjectionRun:
+    def __init__(self, projection, state, checkpoint, version):
+        self.projection = projection
+        self.state = state
+        self.checkpoint = checkpoint
+        self.version = version
+        self.changed = False
+        self.stopped = False
+
+
+class ProjectionsEngine:
+    def __init__(self, db, global_changesets_handler, projections=None, shards=None, clock=time.monotonic):
+        self.db = db
+        self.global_changesets_handler = global_changesets_handler
+        self.projections = list(projections or [])
+        self.shards = shards or GlobalShards()
+        self.query_limit = 1000
+        self.clock = clock
+
+    def register(self, projection):
+        if any(p.projection_id == projection.projection_id for p in self.projections):
+            raise ValueError(f"Projection {projection.projection_id} is already registered")
+        self.projections.append(projection)
+
+    def execute(self, remaining_time_ms=None):
+        # remaining_time_ms returns the milliseconds left until the run's
+        # deadline, e.g. the Lambda context's get_remaining_time_in_millis
+        pending = [r for r in map(self.load, self.projections) if r]
+        while pending:
+            group = self.leading_group(pending)
+            pending = [r for r in pending if r not in group]
+            if not self.run_pass(group, remaining_time_ms):
+                break
+
+    def load(self, projection):
+        saved = self.store(projection).get_projection_state(projection.projection_id)
+        if not saved:
+            return ProjectionRun(projection, copy.deepcopy(projection.initial_state),
+                                 [0] * self.shards.count, None)
+        if len(saved.checkpoint) != self.shards.count:
+            logger.error(f"Projection {projection.projection_id} was projected from "
+                         f"{len(saved.checkpoint)} shards, skipping it")
+            return None
+        return ProjectionRun(projection, saved.state, list(saved.checkpoint), saved.version)
+
+    def leading_group(self, runs):
+        lead = max(sum(r.checkpoint) for r in runs)
+        return [r for r in runs if lead - sum(r.checkpoint) <= max_shared_lag]
+
+    def run_pass(self, group, remaining_time_ms):
+        # Returns False if the pass was stopped before the deadline
+        checkpoint = [min(r.checkpoint[shard] for r in group) for shard in range(self.shards.count)]
+        logger.info(f"Projecting {[r.projection.projection_id for r in group]} from checkpoint {checkpoint}")
+        scanned = 0
+        last_saved = self.clock()
+        while True:
+            if remaining_time_ms and remaining_time_ms() < deadline_margin_ms:
+                logger.info(f"Stopping before the deadline at checkpoint {checkpoint}.")
+                self.save(group)
+                return False
+            active = [r for r in group if not r.stopped]
+            if not active:
+                return True
+
+            response = self.global_changesets_handler.execute(
+                FetchGlobalChangesets(self.command_checkpoint(checkpoint), self.query_limit))
+            changesets = response.body["changesets"]
+            if not changesets:
+                break
+            next_checkpoint = self.parse_checkpoint(response.body["next_checkpoint"])
+            for r in active:
+                self.project(r, changesets, next_checkpoint)
+            checkpoint = next_checkpoint
+            scanned += len(changesets)
+
+            if scanned >= checkpoint_every or self.clock() - last_saved >= checkpoint_interval:
+                self.save(group)
+                scanned = 0
+                last_saved = self.clock()
+
+        self.save(group)
+        return True
+
+    def project(self, run, changesets, next_checkpoint):
+        for c in changesets:
+            shard = c.get("shard", 0)
+            if c["checkpoint"] < run.checkpoint[shard]:
+                continue
+            try:
+                run.state = run.projection.reducer(run.state, c)
+            except Exception:
+                logger.exception(f"Projection {run.projection.projection_id} failed to reduce "
+                                 f"{c['stream_id']}/{c['changeset_id']}")
+                run.stopped = True
+                return
+            run.checkpoint[shard] = c["checkpoint"] + 1
+            run.changed = True
+
+        # The changesets the pass scanned up to the next checkpoint
+        # were all fed to the projection
+        checkpoint = [max(c, n) for c, n in zip(run.checkpoint, next_checkpoint)]
+        if checkpoint != run.checkpoint:
+            run.checkpoint = checkpoint
+            run.changed = True
+
+    def save(self, group):
+        for r in group:
+            if r.stopped or not r.changed:
+                continue
+            state = ProjectionState(r.projection.projection_id, r.state, list(r.checkpoint), sum(r.checkpoint))
+            try:
+                self.store(r.projection).set_projection_state(state, r.version)
+            except ConcurrencyException:
+                logger.warning(f"Projection {r.projection.projection_id} was concurrently saved, "
+                               f"expected version {r.version}")
+                r.stopped = True
+                continue
+            except Exception:
+                # e.g. a state that can't be serialized, or exceeds the item size limit
+                logger.exception(f"Projection {r.projection.projection_id} failed to be saved")
+                r.stopped = True
+                continue
+            r.version = state.version
+            r.changed = False
+
+    def store(self, projection):
+        return projection.store or self.db
+
+    def command_checkpoint(self, checkpoint):
+        if self.shards.count == 1:
+            return checkpoint[0]
+        return list(checkpoint)
+
+    def parse_checkpoint(self, checkpoint):
+        if isinstance(checkpoint, str):
+            return parse_vector_checkpoint(checkpoint)
+        return [checkpoint]
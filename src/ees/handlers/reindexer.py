@@ -0,0 +1,124 @@
+from ees.model import ConcurrencyException, GlobalCounter, GlobalIndex, GlobalShards, CheckpointCalc, IndexSettings
+import logging
+import time
+
+
+logger = logging.getLogger("ees.handlers.reindexer")
+
+# Re-indexes the enumeration index to a different page size, while it
+# keeps being read and written:
+# W   Record the target page size in the index settings, along with a
+#     watermark per shard, starting at checkpoint 0
+#     Wait for the readers' cached settings to expire, so that all of them
+#     read the index as being re-indexed
+#     For each shard:
+# R       Read a chunk of changesets, starting at the shard's watermark
+# W       Write their target pages and advance the watermark, in a single
+#         transaction
+# W       Once the watermark reaches the shard's counter, switch the counter
+#         to the target page size; the indexer continues on the new pages
+# W   Once all the shards are switched, the target becomes the page size
+#
+# Checkpoints are positions within a shard, so they are not affected
+# by re-indexing.
+
+# A transaction is limited to 100 items, one of them is the settings
+max_chunk_size = 99
+
+
+class Reindexer:
+    def __init__(self, db, shards=None, chunk_size=max_chunk_size, sleep=time.sleep):
+        self.db = db
+        self.shards = shards or GlobalShards()
+        self.chunk_size = min(chunk_size, max_chunk_size)
+        self.sleep = sleep
+
+    def execute(self, page_size):
+        settings = self.start(page_size)
+        while settings.target_page_size:
+            try:
+                settings = self.migrate_chunk(settings)
+            except ConcurrencyException:
+                logger.debug("The index was concurrently updated, retrying")
+                settings = self.db.get_index_settings()
+        logger.info(f"The enumeration index is paged by {settings.page_size}")
+        return settings
+
+    def start(self, page_size):
+        settings = self.db.get_index_settings()
+        if settings.target_page_size:
+            if settings.target_page_size != page_size:
+                raise ValueError(f"Re-indexing to page size {settings.target_page_size} is in progress")
+            logger.info(f"Resuming re-indexing to page size {page_size}")
+            return settings
+
+        if settings.page_size == page_size:
+            return settings
+
+        logger.info(f"Re-indexing from page size {settings.page_size} to {page_size}")
+        new_settings = IndexSettings(settings.page_size, page_size,
+                                     [0] * self.shards.count, settings.version + 1)
+        self.db.update_index_settings(settings, new_settings)
+        if self.db.settings_ttl:
+            logger.info(f"Waiting {self.db.settings_ttl} seconds for the readers to notice the re-indexing")
+            self.sleep(self.db.settings_ttl)
+        return new_settings
+
+    def migrate_chunk(self, settings):
+        shard = next(s for (s, w) in enumerate(settings.watermarks) if w is not None)
+        watermark = settings.watermarks[shard]
+        target_calc = CheckpointCalc(settings.target_page_size)
+
+        counter = self.db.get_global_counter(shard)
+        head = CheckpointCalc(counter.page_size).to_checkpoint(counter.page, counter.page_item) + 1
+        if watermark >= head:
+            return self.switch_counter(settings, shard, counter, head)
+
+        fetched = self.db.fetch_global_changesets(watermark, self.chunk_size, shard, self.shards.count)
+        indexes = []
+        for c in fetched:
+            position = self.position(c)
+            if position >= head:
+                break
+            (page, page_item) = target_calc.to_page_item(position)
+            indexes.append(GlobalIndex(c.stream_id, c.changeset_id,
+                                       self.shards.index_page(shard, page), page_item,
+                                       settings.target_page_size))
+
+        # A short chunk means that all the changesets up to the head were read
+        new_watermark = head
+        if len(indexes) == self.chunk_size:
+            new_watermark = self.position(fetched[len(indexes) - 1]) + 1
+
+        new_settings = settings._replace(
+            watermarks=self.with_watermark(settings, shard, new_watermark),
+            version=settings.version + 1)
+        self.db.update_index_settings(settings, new_settings, global_indexes=indexes)
+        logger.debug(f"Shard {shard}: re-indexed {len(indexes)} changesets, watermark is {new_watermark}")
+        return new_settings
+
+    def switch_counter(self, settings, shard, counter, head):
+        (page, page_item) = (0, -1)
+        if head > 0:
+            (page, page_item) = CheckpointCalc(settings.target_page_size).to_page_item(head - 1)
+        new_counter = GlobalCounter(page, page_item, counter.prev_stream_id,
+                                    counter.prev_changeset_id, settings.target_page_size)
+
+        watermarks = self.with_watermark(settings, shard, None)
+        if all(w is None for w in watermarks):
+            new_settings = IndexSettings(settings.target_page_size, None, None, settings.version + 1)
+        else:
+            new_settings = settings._replace(watermarks=watermarks, version=settings.version + 1)
+
+        self.db.update_index_settings(settings, new_settings, counters=[(shard, counter, new_counter)])
+        logger.info(f"Shard {shard} was switched to page size {settings.target_page_size}")
+        return new_settings
+
+    def position(self, changeset):
+        return CheckpointCalc(changeset.page_size).to_checkpoint(
+            self.shards.shard_page(changeset.page), changeset.page_item)
+
+    def with_watermark(self, settings, shard, watermark):
+        watermarks = list(settings.watermarks)
+        watermarks[shard] = watermark
+        return watermarks
@@ -0,0 +1,49 @@
+from ees.model import Response, Snapshot
+
+
+class CommitSnapshotHandler:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, cmd):
+        changesets = self.db.fetch_stream_changesets(
+            cmd.stream_id,
+            from_changeset=cmd.changeset_id,
+            to_changeset=cmd.changeset_id)
+
+        if not changesets:
+            last_commit = self.db.fetch_last_commit(cmd.stream_id, meta_only=True)
+            if not last_commit:
+                return self.stream_not_found(cmd.stream_id)
+            return self.changeset_not_found(cmd.stream_id, cmd.changeset_id, last_commit.changeset_id)
+
+        self.db.save_snapshot(Snapshot(
+            stream_id=cmd.stream_id,
+            changeset_id=cmd.changeset_id,
+            last_event_id=changesets[0].last_event_id,
+            data=cmd.data))
+
+        return Response(
+            http_status=200,
+            body={
+                "stream_id": cmd.stream_id,
+                "changeset_id": cmd.changeset_id
+            })
+
+    def stream_not_found(self, stream_id):
+        return Response(
+            http_status=404,
+            body={
+                "stream_id": stream_id,
+                "error": "STREAM_NOT_FOUND",
+                "message": f'The specified stream({stream_id}) doesn\'t exist'
+            })
+
+    def changeset_not_found(self, stream_id, changeset_id, last_known):
+        return Response(
+            http_status=400,
+            body={
+                "stream_id": stream_id,
+                "error": "INVALID_SNAPSHOT_CHANGESET_ID",
+                "message": f'The specified changeset({changeset_id}) doesn\'t exist. The "{stream_id}" stream\'s most recent changeset is {last_known}.'
+            })
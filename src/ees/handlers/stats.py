@@ -14,12 +14,23 @@ class StatsHandler:
                     "error": "Statistics are not yet generated"
             })
 
+        body = {
+            'total_streams': v.total_streams,
+            'total_changesets': v.total_changesets,
+            'total_events': v.total_events,
+            'max_stream_length': v.max_stream_length,
+            'statistics_version': v.version
+        }
+        indexer = self.db.get_indexer_state()
+        if indexer:
+            body['indexer'] = {
+                'updated_at': indexer.timestamp,
+                'last_batch_indexed_changesets': indexer.last_batch_indexed_changesets,
+                'last_batch_oldest_record_age_ms': indexer.last_batch_oldest_record_age_ms,
+                'last_batch_average_latency_ms': indexer.last_batch_average_latency_ms,
+                'last_batch_max_latency_ms': indexer.last_batch_max_latency_ms
+            }
+
         return Response(
             http_status=200,
-            body={
-                'total_streams': v.total_streams,
-                'total_changesets': v.total_changesets,
-                'total_events': v.total_events,
-                'max_stream_length': v.max_stream_length,
-                'statistics_version': v.version
-            })
+            body=body)
@@ -1,11 +1,21 @@
+import base64
+import gzip
 import json
 import logging
-from ees.model import Response
+import zlib
+from ees.model import Response, parse_continuation_token, InvalidContinuationToken, \
+                      make_vector_checkpoint, parse_vector_checkpoint, parse_event_checkpoint
 from ees.commands import *
 from ees.infrastructure.dynamodb import DynamoDB
 
 logger = logging.getLogger("ees.infrastructure.aws_lambda")
 
+# DynamoDB limits the number of items a single transaction can write
+max_batch_commits = 100
+
+# Response bodies smaller than this aren't worth compressing
+min_compressed_size = 1024
+
 def event_to_command(event, context={}):
     logger.info(f"Parsing incoming event: {event}")
     cmd = None
@@ -22,6 +32,14 @@ def parse_api_gateway_event(event, context):
     parser = parsers[request_path]
     return parser(event, context)
 
+def request_body(event):
+    # The API's binary media types make the API Gateway pass
+    # the request bodies base64 encoded
+    body = event["body"]
+    if event.get("isBase64Encoded") and body is not None:
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
 def parse_dynamodb_event(event, context):
     changesets = []
     for e in event["Records"]:
@@ -29,10 +47,14 @@ def parse_dynamodb_event(event, context):
         stream_id = keys["stream_id"]["S"]
         changeset_id = int(keys["changeset_id"]["N"])
         if stream_id != DynamoDB.global_counter_key and e['eventName'] == "INSERT":
-            changesets.append({
+            changeset = {
                 "stream_id": stream_id,
                 "changeset_id": changeset_id,
-            })
+            }
+            timestamp = e["dynamodb"].get("NewImage", {}).get("timestamp")
+            if timestamp:
+                changeset["timestamp"] = timestamp["S"]
+            changesets.append(changeset)
     return AssignGlobalIndexes(changesets)
 
 def parse_version_request(event, context):
@@ -47,22 +69,29 @@ def parse_commit_request(event, context):
     if not stream_id:
         return missing_stream_id()     
 
-    expected_last_changeset = query_string.get("expected_last_changeset")
+    body = json.loads(request_body(event))
+
+    return make_commit_command(
+        stream_id,
+        query_string.get("expected_last_changeset"),
+        query_string.get("expected_last_event"),
+        body)
+
+def make_commit_command(stream_id, expected_last_changeset, expected_last_event, body):
     if expected_last_changeset is not None and expected_last_changeset != "":
         try:
             expected_last_changeset = int(expected_last_changeset)
-        except ValueError:
+        except (ValueError, TypeError):
             return invalid_expected_changeset_id(stream_id, expected_last_changeset)
         if expected_last_changeset < 0:
             return invalid_expected_changeset_id(stream_id, expected_last_changeset)
     else:
         expected_last_changeset = None
     
-    expected_last_event = query_string.get("expected_last_event")
     if expected_last_event is not None and expected_last_event != "":
         try:
             expected_last_event = int(expected_last_event)
-        except ValueError:
+        except (ValueError, TypeError):
             return invalid_expected_event_id(stream_id, expected_last_event)
         if expected_last_event < 0:
             return invalid_expected_event_id(stream_id, expected_last_event)
@@ -81,7 +110,6 @@ def parse_commit_request(event, context):
                 "message": 'Cannot use both "last_changeset_id" and "last_event_id" for concurrency management. Specify only one value.'
             })
 
-    body = json.loads(event["body"])
     metadata = body.get("metadata", { })
     events = body["events"]
     
@@ -93,6 +121,46 @@ def parse_commit_request(event, context):
         metadata=metadata
     )
 
+def parse_batch_commit_request(event, context):
+    body = json.loads(request_body(event))
+    commits = body.get("commits")
+    if not commits or not isinstance(commits, list):
+        return invalid_batch("The request has to contain a non-empty list of commits")
+
+    if len(commits) > max_batch_commits:
+        return invalid_batch(f'A batch cannot contain more than {max_batch_commits} commits')
+
+    result = []
+    for c in commits:
+        if not isinstance(c, dict):
+            return invalid_batch("Each commit has to be an object")
+        stream_id = c.get("stream_id")
+        if not stream_id:
+            return missing_stream_id()
+
+        cmd = make_commit_command(
+            stream_id,
+            c.get("expected_last_changeset"),
+            c.get("expected_last_event"),
+            c)
+        if isinstance(cmd, Response):
+            return cmd
+        result.append(cmd)
+
+    stream_ids = [c.stream_id for c in result]
+    if len(set(stream_ids)) != len(stream_ids):
+        return invalid_batch("A batch cannot contain more than one commit to the same stream")
+
+    return BatchCommit(result)
+
+def invalid_batch(message):
+    return Response(
+        http_status=400,
+        body={
+            "error": "INVALID_BATCH",
+            "message": message
+        })
+
 def parse_stream_changesets_request(event, context):
     query_string = event.get("queryStringParameters") or { }
     stream_id = event["pathParameters"].get("stream_id")
@@ -117,7 +185,39 @@ def parse_stream_changesets_request(event, context):
     if to_changeset and from_changeset and from_changeset > to_changeset:
         return invalid_filtering_values(stream_id, from_changeset, to_changeset, "CHANGESET")
 
-    return FetchStreamChangesets(stream_id, from_changeset, to_changeset)
+    limit = query_string.get("limit")
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return invalid_limit_value(limit)
+        if limit < 1:
+            return invalid_limit_value(limit)
+    else:
+        limit = None
+
+    from_snapshot = query_string.get("from_snapshot", "").lower() in ("true", "1")
+    if from_snapshot and from_changeset:
+        return invalid_snapshot_filtering(stream_id, "CHANGESET")
+
+    continuation_token = query_string.get("continuation_token")
+    if continuation_token:
+        try:
+            from_changeset = parse_continuation_token(
+                stream_id, "changeset", continuation_token)
+        except InvalidContinuationToken:
+            return invalid_continuation_token(stream_id, continuation_token)
+        # The token already points past the snapshot
+        from_snapshot = False
+
+    fields = query_string.get("fields")
+    try:
+        fields = parse_fields(fields, changeset_fields)
+    except ValueError:
+        return invalid_fields_value(fields, changeset_fields)
+
+    return FetchStreamChangesets(stream_id, from_changeset, to_changeset, limit, from_snapshot, fields,
+                                 request_header(event, "If-None-Match"))
 
 def parse_stream_events_request(event, context):
     query_string = event.get("queryStringParameters") or { }
@@ -143,7 +243,54 @@ def parse_stream_events_request(event, context):
     if to_event and from_event and from_event > to_event:
         return invalid_filtering_values(stream_id, from_event, to_event, "EVENT")
 
-    return FetchStreamEvents(stream_id, from_event, to_event)
+    limit = query_string.get("limit")
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return invalid_limit_value(limit)
+        if limit < 1:
+            return invalid_limit_value(limit)
+    else:
+        limit = None
+
+    from_snapshot = query_string.get("from_snapshot", "").lower() in ("true", "1")
+    if from_snapshot and from_event:
+        return invalid_snapshot_filtering(stream_id, "EVENT")
+
+    continuation_token = query_string.get("continuation_token")
+    if continuation_token:
+        try:
+            from_event = parse_continuation_token(
+                stream_id, "event", continuation_token)
+        except InvalidContinuationToken:
+            return invalid_continuation_token(stream_id, continuation_token)
+        # The token already points past the snapshot
+        from_snapshot = False
+
+    fields = query_string.get("fields")
+    try:
+        fields = parse_fields(fields, event_fields)
+    except ValueError:
+        return invalid_fields_value(fields, event_fields)
+
+    return FetchStreamEvents(stream_id, from_event, to_event, limit, from_snapshot, fields,
+                             request_header(event, "If-None-Match"))
+
+def parse_commit_snapshot_request(event, context):
+    stream_id = event["pathParameters"].get("stream_id")
+    if not stream_id:
+        return missing_stream_id()
+
+    body = json.loads(request_body(event))
+    changeset_id = body.get("changeset_id")
+    if not isinstance(changeset_id, int) or isinstance(changeset_id, bool) or changeset_id < 1:
+        return invalid_snapshot(stream_id, '"changeset_id" has to be a positive integer')
+
+    if "data" not in body:
+        return invalid_snapshot(stream_id, 'The snapshot\'s "data" is missing')
+
+    return CommitSnapshot(stream_id, changeset_id, body["data"])
 
 def missing_stream_id():
     return Response(
@@ -160,13 +307,29 @@ def parse_global_changesets_request(event, context):
 
     if checkpoint:
         try:
-            checkpoint = int(checkpoint)
+            if "," in checkpoint:
+                checkpoint = parse_vector_checkpoint(checkpoint)
+            else:
+                checkpoint = int(checkpoint)
         except ValueError:
             return invalid_checkpoint_value(checkpoint)
 
-    if checkpoint < 0:
+    if isinstance(checkpoint, int) and checkpoint < 0:
         return invalid_checkpoint_value(checkpoint)        
 
+    shard = query_string.get("shard")
+    if shard:
+        try:
+            shard = int(shard)
+        except ValueError:
+            return invalid_shard_value(shard)
+        if shard < 0:
+            return invalid_shard_value(shard)
+        if isinstance(checkpoint, list):
+            return invalid_checkpoint_value(make_vector_checkpoint(checkpoint))
+    else:
+        shard = None
+
     if limit:
         try:
             limit = int(limit)
@@ -175,8 +338,75 @@ def parse_global_changesets_request(event, context):
     
     if limit is not None and limit < 1:
         return invalid_limit_value(limit)
+
+    wait = query_string.get("wait")
+    if wait:
+        try:
+            wait = int(wait)
+        except ValueError:
+            return invalid_wait_value(wait)
+        if wait < 0:
+            return invalid_wait_value(wait)
+    else:
+        wait = None
+
+    stream_prefix = parse_filter_values(query_string.get("stream_prefix"))
+    event_type = parse_filter_values(query_string.get("event_type"))
+
+    fields = query_string.get("fields")
+    try:
+        fields = parse_fields(fields, global_changeset_fields)
+    except ValueError:
+        return invalid_fields_value(fields, global_changeset_fields)
     
-    return FetchGlobalChangesets(checkpoint, limit)
+    return FetchGlobalChangesets(checkpoint, limit, shard, wait, stream_prefix, event_type, fields)
+
+def parse_fields(value, allowed):
+    if not value:
+        return None
+    fields = tuple(f for f in value.split(",") if f)
+    if not fields or any(f not in allowed for f in fields):
+        raise ValueError(value)
+    return fields
+
+def parse_filter_values(value):
+    values = tuple(v for v in (value or "").split(",") if v)
+    return values or None
+
+def parse_global_events_request(event, context):
+    query_string = event.get("queryStringParameters") or { }
+    checkpoint = query_string.get("checkpoint") or "0"
+    limit = query_string.get("limit")
+
+    try:
+        positions = [parse_event_checkpoint(c) for c in checkpoint.split(",")]
+    except ValueError:
+        return invalid_events_checkpoint_value(checkpoint)
+    checkpoint = positions if len(positions) > 1 else positions[0]
+
+    shard = query_string.get("shard")
+    if shard:
+        try:
+            shard = int(shard)
+        except ValueError:
+            return invalid_shard_value(shard)
+        if shard < 0:
+            return invalid_shard_value(shard)
+        if isinstance(checkpoint, list):
+            return invalid_events_checkpoint_value(query_string.get("checkpoint"))
+    else:
+        shard = None
+
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return invalid_limit_value(limit)
+
+    if limit is not None and limit < 1:
+        return invalid_limit_value(limit)
+
+    return FetchGlobalEvents(checkpoint, limit, shard)
 
 def invalid_expected_changeset_id(stream_id, expected_last_changeset_id):
     return Response(
@@ -222,6 +452,14 @@ def invalid_checkpoint_value(checkpoint):
             "message": f'"{checkpoint}" is an invalid checkpoint value. Expected a positive integer value.'
         })
 
+def invalid_shard_value(shard):
+    return Response(
+        http_status=400,
+        body={
+            "error": "INVALID_SHARD",
+            "message": f'"{shard}" is an invalid shard value. Expected a non-negative integer value.'
+        })
+
 def invalid_events_checkpoint_value(checkpoint_string):
     return Response(
         http_status=400,
@@ -230,6 +468,22 @@ def invalid_events_checkpoint_value(checkpoint_string):
             "message": f'"{checkpoint_string}" is an invalid checkpoint value. Set a valid checkpoint(e.g. "42.1").'
         })
 
+def invalid_fields_value(fields, allowed):
+    return Response(
+        http_status=400,
+        body={
+            "error": "INVALID_FIELDS",
+            "message": f'"{fields}" is an invalid fields value. Expected a comma separated list of: {", ".join(allowed)}.'
+        })
+
+def invalid_wait_value(wait):
+    return Response(
+        http_status=400,
+        body={
+            "error": "INVALID_WAIT",
+            "message": f'"{wait}" is an invalid wait value. Expected a non-negative number of seconds.'
+        })
+
 def invalid_limit_value(limit):
     return Response(
         http_status=400,
@@ -238,6 +492,33 @@ def invalid_limit_value(limit):
             "message": f'"{limit}" is an invalid limit value. Expected an integer value greater than 0.'
         })
 
+def invalid_continuation_token(stream_id, continuation_token):
+    return Response(
+        http_status=400,
+        body={
+            "stream_id": stream_id,
+            "error": "INVALID_CONTINUATION_TOKEN",
+            "message": f'"{continuation_token}" is an invalid continuation token for the "{stream_id}" stream.'
+        })
+
+def invalid_snapshot(stream_id, message):
+    return Response(
+        http_status=400,
+        body={
+            "stream_id": stream_id,
+            "error": "INVALID_SNAPSHOT",
+            "message": message
+        })
+
+def invalid_snapshot_filtering(stream_id, filter_type):
+    return Response(
+        http_status=400,
+        body={
+            "stream_id": stream_id,
+            "error": f"INVALID_{filter_type}_FILTERING_PARAMS",
+            "message": 'The "from" and "from_snapshot" parameters cannot be combined'
+        })
+
 def parse_dynamodb_new_records(event, context):
     changesets = []
     for e in event["Records"]:
@@ -252,7 +533,74 @@ parsers = {
     "/version": parse_version_request,
     "/streams": parse_stats_request,
     "/streams/{stream_id}": parse_commit_request,
+    "/commits": parse_batch_commit_request,
     "/streams/{stream_id}/changesets": parse_stream_changesets_request,
     "/streams/{stream_id}/events": parse_stream_events_request,
-    "/changesets": parse_global_changesets_request
-}
\ No newline at end of file
+    "/streams/{stream_id}/snapshots": parse_commit_snapshot_request,
+    "/changesets": parse_global_changesets_request,
+    "/events": parse_global_events_request
+}
+
+def render_response(response, event):
+    # Renders a response for the API Gateway's proxy integration. The body is
+    # compact JSON, unless the "pretty" query string parameter is set, and
+    # is compressed if the client accepts gzip or deflate encoded responses.
+    query_string = event.get("queryStringParameters") or { }
+    if response.body is None:
+        body = ""
+    elif query_string.get("pretty", "").lower() in ("true", "1"):
+        body = json.dumps(response.body, indent=4)
+    else:
+        body = json.dumps(response.body, separators=(',', ':'))
+
+    headers = dict(response.headers or { })
+    headers["Content-Type"] = "application/json"
+    headers["Vary"] = "Accept-Encoding"
+    rendered = { "statusCode": response.http_status, "headers": headers }
+
+    encoding = None
+    if len(body) >= min_compressed_size:
+        encoding = negotiate_encoding(request_header(event, "Accept-Encoding"))
+    if not encoding:
+        rendered["body"] = body
+        return rendered
+
+    data = body.encode('utf-8')
+    data = gzip.compress(data, compresslevel=6) if encoding == "gzip" else zlib.compress(data)
+    headers["Content-Encoding"] = encoding
+    if "ETag" in headers:
+        # Each encoding is a different representation
+        headers["ETag"] = headers["ETag"][:-1] + f'-{encoding}"'
+    rendered["body"] = base64.b64encode(data).decode('ascii')
+    rendered["isBase64Encoded"] = True
+    return rendered
+
+def request_header(event, name):
+    # Header names are case insensitive
+    name = name.lower()
+    for (header, value) in (event.get("headers") or { }).items():
+        if header.lower() == name:
+            return value
+    return None
+
+def negotiate_encoding(accept_encoding):
+    # Returns the supported encoding with the highest quality, preferring gzip
+    if not accept_encoding:
+        return None
+    qualities = { }
+    for part in accept_encoding.split(","):
+        (coding, _, params) = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    candidates = [(qualities.get(coding, wildcard), preference, coding)
+                  for (preference, coding) in enumerate(["deflate", "gzip"])]
+    (quality, _, coding) = max(candidates)
+    return coding if quality > 0 else None
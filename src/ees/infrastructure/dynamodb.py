@@ -1,32 +1,59 @@
 import boto3
 import botocore
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import itertools
+import threading
+import time
+import base64
 import json
+import zlib
 import logging
-from ees.model import CommitData, ConcurrencyException, GlobalCounter, GlobalIndex, CheckpointCalc, AnalysisState
+from ees.infrastructure.page_cache import item_size
+from ees.infrastructure.storage import StorageEngine
+from ees.model import CommitData, ConcurrencyException, BatchConcurrencyException, GlobalCounter, GlobalIndex, CheckpointCalc, AnalysisState, IndexerState, ProjectionState, Snapshot, IndexSettings, page_size_segments
 
 logger = logging.getLogger("ees.infrastructure.dynamodb")
 
-class DynamoDB:
+class DynamoDB(StorageEngine):
     global_counter_key = '!!!RESERVED:GLOBAL-COUNTER!!!'
     global_counter_range = 0
+    # The index settings are stored alongside the global counters
+    index_settings_range = -1
 
-    def __init__(self, events_table, analysis_table):
+    # Version 1: events and metadata are stored as JSON strings
+    # Version 2: events and metadata are stored as zlib compressed JSON binaries
+    plain_format_version = 1
+    compressed_format_version = 2
+
+    # The columns of a changeset that are read regardless of the requested payload
+    changeset_columns = 'stream_id,changeset_id,first_event_id,last_event_id,page,page_item,page_size'
+    payload_columns = ('events', 'metadata')
+
+    def __init__(self, events_table, analysis_table, snapshots_table=None, compress_payloads=False, client=None,
+                 prefetch_pages=0, page_cache=None, settings_ttl=0, clock=time.monotonic):
         self.events_table = events_table
         self.analysis_table = analysis_table
-        self.dynamodb_ll = boto3.client('dynamodb') 
+        self.snapshots_table = snapshots_table
+        self.compress_payloads = compress_payloads
+        self.dynamodb_ll = client or boto3.client('dynamodb')
         self.checkpoint_calc = CheckpointCalc()
+        self.index_settings = None
+        self.index_settings_read_at = None
+        self.settings_ttl = settings_ttl
+        self.clock = clock
+        # The number of global index pages that are read ahead concurrently
+        self.prefetch_pages = prefetch_pages
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        # The completed global index pages, along with the number of each
+        # shard's pages known to be completed, by the settings' version
+        self.page_cache = page_cache
+        self.complete_pages = { }
     
     def append(self, commit):
-        item = {
-            'stream_id': { "S": commit.stream_id },
-            'changeset_id': { "N": str(commit.changeset_id) },
-            'metadata': { "S": json.dumps(commit.metadata) },
-            'events': { "S": json.dumps(commit.events) },
-            'first_event_id': { "N": str(commit.first_event_id) },
-            'last_event_id': { "N": str(commit.last_event_id) },
-            'timestamp': { "S": self.get_timestamp() }
-        }
+        item = self.commit_to_item(commit)
 
         condition = {
             'stream_id': { "Exists": False },
@@ -44,8 +71,72 @@ class DynamoDB:
             else:
                 raise e
         
+    def append_batch(self, commits):
+        transact_items = [{
+            'Put': {
+                'TableName': self.events_table,
+                'Item': self.commit_to_item(c),
+                'ConditionExpression': 'attribute_not_exists(stream_id)'
+            }
+        } for c in commits]
+
+        try:
+            self.dynamodb_ll.transact_write_items(TransactItems=transact_items)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                reasons = e.response.get('CancellationReasons', [])
+                conflicts = [ConcurrencyException(c.stream_id, c.changeset_id)
+                             for c, r in zip(commits, reasons)
+                             if r.get('Code') == 'ConditionalCheckFailed']
+                if conflicts:
+                    logger.debug(f"Transaction cancelled due to conflicts: {[(c.stream_id, c.changeset_id) for c in conflicts]}")
+                    raise BatchConcurrencyException(conflicts)
+            raise e
+
+    def commit_to_item(self, commit):
+        item = {
+            'stream_id': { "S": commit.stream_id },
+            'changeset_id': { "N": str(commit.changeset_id) },
+            'metadata': { "S": json.dumps(commit.metadata) },
+            'events': { "S": json.dumps(commit.events) },
+            'first_event_id': { "N": str(commit.first_event_id) },
+            'last_event_id': { "N": str(commit.last_event_id) },
+            'timestamp': { "S": self.get_timestamp() }
+        }
+
+        if self.compress_payloads:
+            item['metadata'] = { "B": DynamoDB.compress(commit.metadata) }
+            item['events'] = { "B": DynamoDB.compress(commit.events) }
+            item['format_version'] = { "N": str(self.compressed_format_version) }
+
+        return item
+
+    def item_projection(self, payload):
+        # The payload columns that weren't requested are neither read
+        # nor decoded
+        if payload is None:
+            return { 'Select': 'ALL_ATTRIBUTES' }
+        columns = [c for c in self.payload_columns if c in payload]
+        if columns:
+            columns.append('format_version')
+        return { 'ProjectionExpression': ','.join([self.changeset_columns] + columns) }
+
+    @classmethod
+    def compress(cls, value):
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def decode_payload(cls, attribute, format_version):
+        if format_version == cls.compressed_format_version:
+            value = attribute["B"]
+            # Binary values are base64 encoded in DynamoDB Streams' JSON records
+            if isinstance(value, str):
+                value = base64.b64decode(value)
+            return json.loads(zlib.decompress(value).decode('utf-8'))
+        return json.loads(attribute["S"])
+
     def fetch_last_commit(self, stream_id, meta_only=False):
-        projection = 'stream_id,changeset_id,events,metadata,first_event_id,last_event_id'
+        projection = 'stream_id,changeset_id,events,metadata,first_event_id,last_event_id,format_version'
         if meta_only:
             projection = 'stream_id,changeset_id,first_event_id,last_event_id'
 
@@ -73,10 +164,15 @@ class DynamoDB:
     def fetch_stream_changesets(self,
                                 stream_id,
                                 from_changeset=None,
-                                to_changeset=None):
+                                to_changeset=None,
+                                limit=None,
+                                payload=None):
         if not from_changeset and not to_changeset:
             from_changeset = 1
 
+        if from_changeset and to_changeset and from_changeset > to_changeset:
+            return []
+
         range_condition = None
         if from_changeset and to_changeset:
             range_condition = {
@@ -109,9 +205,10 @@ class DynamoDB:
                 'ComparisonOperator': 'LE'
             }
 
-        response = self.dynamodb_ll.query(
+        items = self.paginate_query(
+            limit,
             TableName=self.events_table,
-            Select='ALL_ATTRIBUTES',
+            **self.item_projection(payload),
             ScanIndexForward=True,
             KeyConditions={
                 'stream_id': {
@@ -126,22 +223,31 @@ class DynamoDB:
             }
         )
 
-        return [DynamoDB.parse_commit(r) for r in response["Items"]]
+        return [DynamoDB.parse_commit(r) for r in items]
     
-    def fetch_stream_by_events(self, stream_id, from_event=None, to_event=None):
+    def iterate_stream_by_events(self,
+                                 stream_id,
+                                 from_event=None,
+                                 to_event=None,
+                                 page_size=None,
+                                 payload=None):
+        # Lazily yields the changesets containing the requested events range,
+        # the next query page is only fetched when the current one is consumed
         if not from_event and not to_event:
             from_event = 1
 
+        if from_event and to_event and from_event > to_event:
+            return
+
+        if from_event and to_event:
+            yield from self.iterate_changesets_by_events_range(
+                stream_id, from_event, to_event, page_size, payload)
+            return
+
         index_name = None
         range_condition = None
         column = None
 
-        if from_event and to_event and from_event == to_event:
-            return [self.read_changeset_containing_event(stream_id, from_event)]
-        
-        if from_event and to_event:
-            return self.fetch_changesets_by_events_range(stream_id, from_event, to_event)
-
         if from_event:
             index_name = 'LastEventId'
             column = 'last_event_id'
@@ -165,9 +271,10 @@ class DynamoDB:
                 'ComparisonOperator': 'LE'
             }
 
-        response = self.dynamodb_ll.query(
+        items = self.paginate_query(
+            page_size=page_size,
             TableName=self.events_table,
-            Select='ALL_ATTRIBUTES',
+            **self.item_projection(payload),
             IndexName=index_name,
             ScanIndexForward=True,
             KeyConditions={
@@ -183,19 +290,22 @@ class DynamoDB:
             }
         )
 
-        return [DynamoDB.parse_commit(r) for r in response["Items"]]
+        for r in items:
+            yield DynamoDB.parse_commit(r)
 
-    def fetch_changesets_by_events_range(self, stream_id, from_event, to_event):
-        first_changeset = self.read_changeset_containing_event(stream_id, from_event)
+    def iterate_changesets_by_events_range(self, stream_id, from_event, to_event, page_size=None, payload=None):
+        first_changeset = self.read_changeset_containing_event(stream_id, from_event, payload)
         if not first_changeset:
-            return None
-        
+            return
+
+        yield first_changeset
         if first_changeset.last_event_id >= to_event:
-            return [first_changeset]
+            return
 
-        response = self.dynamodb_ll.query(
+        items = self.paginate_query(
+            page_size=page_size,
             TableName=self.events_table,
-            Select='ALL_ATTRIBUTES',
+            **self.item_projection(payload),
             IndexName="FirstEventId",
             ScanIndexForward=True,
             KeyConditions={
@@ -210,7 +320,7 @@ class DynamoDB:
                 "first_event_id": {
                     'AttributeValueList': [
                         {
-                            'N': str(from_event)
+                            'N': str(first_changeset.last_event_id + 1)
                         },
                         {
                             'N': str(to_event)
@@ -221,12 +331,13 @@ class DynamoDB:
             }
         )
 
-        return [first_changeset] + [DynamoDB.parse_commit(r) for r in response["Items"]]
+        for r in items:
+            yield DynamoDB.parse_commit(r)
 
-    def read_changeset_containing_event(self, stream_id, event_id):
+    def read_changeset_containing_event(self, stream_id, event_id, payload=None):
         response = self.dynamodb_ll.query(
             TableName=self.events_table,
-            Select='ALL_ATTRIBUTES',
+            **self.item_projection(payload),
             IndexName='LastEventId',
             ScanIndexForward=True,
             Limit=1,
@@ -253,47 +364,122 @@ class DynamoDB:
         changesets = [DynamoDB.parse_commit(r) for r in response["Items"]]
         return changesets[0] if changesets else None
 
+    def paginate_query(self, limit=None, page_size=None, **query):
+        # A single query call returns at most 1MB of data, the rest
+        # has to be fetched by following the LastEvaluatedKey value
+        while True:
+            if limit or page_size:
+                query['Limit'] = min(limit or page_size, page_size or limit)
+            response = self.dynamodb_ll.query(**query)
+            for item in response["Items"]:
+                yield item
+
+            if limit:
+                limit -= len(response["Items"])
+                if limit <= 0:
+                    return
+
+            last_evaluated_key = response.get("LastEvaluatedKey")
+            if not last_evaluated_key:
+                return
+            query['ExclusiveStartKey'] = last_evaluated_key
+
     @classmethod
-    def parse_commit(cls, record):
+    def parse_commit(cls, record, payload=None):
+        # Only the payload columns (events, metadata) in payload are decoded,
+        # None decodes all of them
         logger.debug(f"Parsing DynamoDB record: {record}")
         stream_id = record["stream_id"]["S"]
         changeset_id = int(record["changeset_id"]["N"])
         first_event_id = int(record["first_event_id"]["N"])
         last_event_id = int(record["last_event_id"]["N"])
 
+        format_version = cls.plain_format_version
+        if "format_version" in record.keys():
+            format_version = int(record["format_version"]["N"])
+
         events = None
-        if "events" in record.keys():
-            events_json = record["events"]["S"]
-            events = json.loads(events_json)
+        if "events" in record.keys() and (payload is None or "events" in payload):
+            events = cls.decode_payload(record["events"], format_version)
 
         metadata = None
-        if "metadata" in record.keys():
-            metadata_json = record["metadata"]["S"]
-            metadata = json.loads(metadata_json)
+        if "metadata" in record.keys() and (payload is None or "metadata" in payload):
+            metadata = cls.decode_payload(record["metadata"], format_version)
         
         page = None
         page_item = None
+        page_size = None
         if "page" in record.keys():
             page = int(record["page"]["N"])
             page_item = int(record["page_item"]["N"])
+        if "page_size" in record.keys():
+            page_size = int(record["page_size"]["N"])
 
         return CommitData(stream_id, changeset_id, metadata, events,
-                          first_event_id, last_event_id, page, page_item)
+                          first_event_id, last_event_id, page, page_item, page_size)
+
+    def save_snapshot(self, snapshot):
+        item = {
+            'stream_id': { "S": snapshot.stream_id },
+            'changeset_id': { "N": str(snapshot.changeset_id) },
+            'last_event_id': { "N": str(snapshot.last_event_id) },
+            'data': { "S": json.dumps(snapshot.data) },
+            'timestamp': { "S": self.get_timestamp() }
+        }
+
+        self.dynamodb_ll.put_item(TableName=self.snapshots_table, Item=item)
+
+    def fetch_latest_snapshot(self, stream_id, to_changeset=None):
+        key_conditions = {
+            'stream_id': {
+                'AttributeValueList': [
+                    {
+                        'S': stream_id
+                    },
+                ],
+                'ComparisonOperator': 'EQ'
+            }
+        }
+        if to_changeset:
+            key_conditions['changeset_id'] = {
+                'AttributeValueList': [
+                    {
+                        'N': str(to_changeset)
+                    }
+                ],
+                'ComparisonOperator': 'LE'
+            }
+
+        response = self.dynamodb_ll.query(
+            TableName=self.snapshots_table,
+            Select='ALL_ATTRIBUTES',
+            Limit=1,
+            ScanIndexForward=False,
+            KeyConditions=key_conditions
+        )
+        if response["Count"] == 0:
+            return None
+
+        data = response["Items"][0]
+        return Snapshot(stream_id,
+                        int(data["changeset_id"]["N"]),
+                        int(data["last_event_id"]["N"]),
+                        json.loads(data["data"]["S"]))
 
     def get_timestamp(self):
         return datetime.utcnow().isoformat("T") + "Z"
     
-    def get_global_counter(self):
-        counter = self.__get_global_counter()
+    def get_global_counter(self, shard=0):
+        counter = self.__get_global_counter(shard)
         if not counter:
-            self.init_global_counter()
-            counter = self.__get_global_counter()
+            self.init_global_counter(shard)
+            counter = self.__get_global_counter(shard)
         return counter
 
-    def __get_global_counter(self):
+    def __get_global_counter(self, shard):
         response = self.dynamodb_ll.query(
             TableName=self.events_table,
-            ProjectionExpression='page,page_item,prev_stream_id,prev_changeset_id',
+            ProjectionExpression='page,page_item,prev_stream_id,prev_changeset_id,page_size',
             Limit=1,
             ScanIndexForward=False,
             KeyConditions={
@@ -308,7 +494,7 @@ class DynamoDB:
                 'changeset_id': {
                     'AttributeValueList': [
                         {
-                            'N': str(self.global_counter_range)
+                            'N': str(self.global_counter_range + shard)
                         },
                     ],
                     'ComparisonOperator': 'EQ'
@@ -322,12 +508,13 @@ class DynamoDB:
         return GlobalCounter(int(data["page"]["N"]),
                              int(data["page_item"]["N"]),
                              data["prev_stream_id"]["S"],
-                             int(data["prev_changeset_id"]["N"]))
+                             int(data["prev_changeset_id"]["N"]),
+                             int(data["page_size"]["N"]) if "page_size" in data else None)
     
-    def init_global_counter(self):
+    def init_global_counter(self, shard=0):
         item = {
             'stream_id': { "S": self.global_counter_key },
-            'changeset_id': { "N": str(self.global_counter_range) },
+            'changeset_id': { "N": str(self.global_counter_range + shard) },
             'page': { "N": str(0) },
             'page_item': { "N": str(-1) },
             'prev_stream_id': { "S": "" },
@@ -349,20 +536,24 @@ class DynamoDB:
             else:
                 raise e
     
-    def update_global_counter(self, prev_value, new_value):
+    def update_global_counter(self, prev_value, new_value, shard=0):
+        attribute_updates = {
+            'page': { "Value": { "N": str(new_value.page) } },
+            'page_item': { "Value": { "N": str(new_value.page_item) } },
+            'prev_stream_id': { "Value": { "S": new_value.prev_stream_id } },
+            'prev_changeset_id': { "Value": { "N": str(new_value.prev_changeset_id) } }
+        }
+        if new_value.page_size:
+            attribute_updates['page_size'] = { "Value": { "N": str(new_value.page_size) } }
+
         try:
             self.dynamodb_ll.update_item(
                 TableName=self.events_table,
                 Key={
                     'stream_id': { "S": self.global_counter_key },
-                    'changeset_id': { "N": str(self.global_counter_range) }
-                },
-                AttributeUpdates={
-                    'page': { "Value": { "N": str(new_value.page) } },
-                    'page_item': { "Value": { "N": str(new_value.page_item) } },
-                    'prev_stream_id': { "Value": { "S": new_value.prev_stream_id } },
-                    'prev_stream_changeset_id': { "Value": { "N": str(new_value.prev_changeset_id) } }
+                    'changeset_id': { "N": str(self.global_counter_range + shard) }
                 },
+                AttributeUpdates=attribute_updates,
                 Expected={
                     'page': { "Value": { "N": str(prev_value.page) } },
                     'page_item': { "Value": { "N": str(prev_value.page_item) } }
@@ -370,14 +561,14 @@ class DynamoDB:
             )
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                raise ConcurrencyException(self.global_counter_key, self.global_counter_range)
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
             else:
                 raise e
     
     def get_global_index_value(self, stream_id, changeset_id):
         response = self.dynamodb_ll.query(
             TableName=self.events_table,
-            ProjectionExpression='page,page_item',
+            ProjectionExpression='page,page_item,page_size',
             Limit=1,
             ScanIndexForward=False,
             KeyConditions={
@@ -405,12 +596,15 @@ class DynamoDB:
         data = response["Items"][0]
         page = data.get("page")
         page_item = data.get("page_item")
+        page_size = data.get("page_size")
         if page:
             page = int(page["N"])
         if page_item:
             page_item = int(page_item["N"])
+        if page_size:
+            page_size = int(page_size["N"])
 
-        return GlobalIndex(stream_id, changeset_id, page, page_item)
+        return GlobalIndex(stream_id, changeset_id, page, page_item, page_size)
 
     def set_global_index(self, global_index):
         stream_id = global_index.stream_id
@@ -418,6 +612,13 @@ class DynamoDB:
         page = global_index.page
         page_item = global_index.page_item
 
+        attribute_updates = {
+            'page': { "Value": { "N": str(page) } },
+            'page_item': { "Value": { "N": str(page_item) } }
+        }
+        if global_index.page_size:
+            attribute_updates['page_size'] = { "Value": { "N": str(global_index.page_size) } }
+
         try:
             self.dynamodb_ll.update_item(
                 TableName=self.events_table,
@@ -425,13 +626,10 @@ class DynamoDB:
                     'stream_id': { "S": stream_id },
                     'changeset_id': { "N": str(changeset_id) }
                 },
-                AttributeUpdates={
-                    'page': { "Value": { "N": str(page) } },
-                    'page_item': { "Value": { "N": str(page_item) } }
-                },
+                AttributeUpdates=attribute_updates,
                 Expected={
                     'page': { "Exists": False },
-                    'item': { "Exists": False }
+                    'page_item': { "Exists": False }
                 }
             )
         except botocore.exceptions.ClientError as e:
@@ -440,62 +638,352 @@ class DynamoDB:
             else:
                 raise e
 
-    def fetch_global_changesets(self, checkpoint, limit):
-        def fetch_batch(page, since_item, limit):
-            response = self.dynamodb_ll.query(
-                TableName=self.events_table,
-                Select='ALL_ATTRIBUTES',
-                IndexName='EmumerationIndex',
-                ScanIndexForward=True,
-                Limit=limit,
-                KeyConditions={
-                    'page': {
-                        'AttributeValueList': [
-                            {
-                                'N': str(page)
-                            },
-                        ],
-                        'ComparisonOperator': 'EQ'
-                    },
-                    'page_item': {
-                        'AttributeValueList': [
-                            {
-                                'N': str(since_item)
-                            }
-                        ],
-                        'ComparisonOperator': 'GE'
-                    }
+    def get_global_index_values(self, keys):
+        keys = list(dict.fromkeys(keys))
+        result = { }
+        # BatchGetItem is limited to 100 keys per request
+        for i in range(0, len(keys), 100):
+            request = {
+                self.events_table: {
+                    'Keys': [{
+                        'stream_id': { "S": stream_id },
+                        'changeset_id': { "N": str(changeset_id) }
+                    } for (stream_id, changeset_id) in keys[i:i + 100]],
+                    'ProjectionExpression': 'stream_id,changeset_id,page,page_item,page_size',
+                    # The stream records' changesets were just committed
+                    'ConsistentRead': True
                 }
+            }
+            while request:
+                response = self.dynamodb_ll.batch_get_item(RequestItems=request)
+                for data in response["Responses"].get(self.events_table, []):
+                    stream_id = data["stream_id"]["S"]
+                    changeset_id = int(data["changeset_id"]["N"])
+                    page = int(data["page"]["N"]) if "page" in data else None
+                    page_item = int(data["page_item"]["N"]) if "page_item" in data else None
+                    page_size = int(data["page_size"]["N"]) if "page_size" in data else None
+                    result[(stream_id, changeset_id)] = GlobalIndex(stream_id, changeset_id, page, page_item, page_size)
+                request = response.get("UnprocessedKeys")
+        return result
+
+    def update_global_index(self, prev_value, new_value):
+        attribute_updates = {
+            'page': { "Value": { "N": str(new_value.page) } },
+            'page_item': { "Value": { "N": str(new_value.page_item) } }
+        }
+        if new_value.page_size:
+            attribute_updates['page_size'] = { "Value": { "N": str(new_value.page_size) } }
+
+        expected = {
+            'stream_id': { "Value": { "S": prev_value.stream_id } }
+        }
+        for attribute in ('page', 'page_item', 'page_size'):
+            value = getattr(prev_value, attribute)
+            expected[attribute] = { "Value": { "N": str(value) } } if value is not None else { "Exists": False }
+
+        try:
+            self.dynamodb_ll.update_item(
+                TableName=self.events_table,
+                Key={
+                    'stream_id': { "S": new_value.stream_id },
+                    'changeset_id': { "N": str(new_value.changeset_id) }
+                },
+                AttributeUpdates=attribute_updates,
+                Expected=expected
             )
-            return [DynamoDB.parse_commit(r) for r in response["Items"] if r["stream_id"]["S"] != self.global_counter_key]
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise ConcurrencyException(new_value.stream_id, new_value.changeset_id)
+            else:
+                raise e
+
+    def relocate_global_indexes(self, prev_counter, new_counter, updates, shard=0):
+        counter_update = self.counter_update(shard, prev_counter, new_counter)
 
-        (page, page_item) = self.checkpoint_calc.to_page_item(checkpoint)
+        index_updates = []
+        for (prev_value, new_value) in updates:
+            condition = ['attribute_exists(stream_id)']
+            values = { }
+            for attribute in ('page', 'page_item', 'page_size'):
+                value = getattr(prev_value, attribute)
+                if value is None:
+                    condition.append(f'attribute_not_exists({attribute})')
+                else:
+                    condition.append(f'{attribute} = :expected_{attribute}')
+                    values[f':expected_{attribute}'] = { "N": str(value) }
+            update = self.index_update(new_value, ' AND '.join(condition))
+            update['Update']['ExpressionAttributeValues'].update(values)
+            index_updates.append(update)
 
-        changesets_left = limit
-        last_batch = None
+        try:
+            self.dynamodb_ll.transact_write_items(TransactItems=[counter_update] + index_updates)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                reasons = e.response.get('CancellationReasons', [])
+                if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                    raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
+                conflicts = [ConcurrencyException(new_value.stream_id, new_value.changeset_id)
+                             for (_, new_value), r in zip(updates, reasons[1:])
+                             if r.get('Code') == 'ConditionalCheckFailed']
+                if conflicts:
+                    raise BatchConcurrencyException(conflicts)
+            raise e
+
+    def scan_global_indexes(self, segment, total_segments):
         result = []
+        exclusive_start_key = None
         while True:
-            last_batch = fetch_batch(page, page_item, changesets_left)
-            if len(last_batch) > 0:
-                result.extend(last_batch)
-                (page, page_item) = self.checkpoint_calc.next_page_and_item(page, page_item)
-                changesets_left = changesets_left - len(last_batch)
+            scan = dict(
+                TableName=self.events_table,
+                ConsistentRead=True,
+                ProjectionExpression='stream_id,changeset_id,page,page_item,page_size',
+                Segment=segment,
+                TotalSegments=total_segments
+            )
+            if exclusive_start_key:
+                scan['ExclusiveStartKey'] = exclusive_start_key
+            response = self.dynamodb_ll.scan(**scan)
+            for data in response["Items"]:
+                stream_id = data["stream_id"]["S"]
+                if stream_id == self.global_counter_key:
+                    continue
+                result.append(GlobalIndex(
+                    stream_id,
+                    int(data["changeset_id"]["N"]),
+                    int(data["page"]["N"]) if "page" in data else None,
+                    int(data["page_item"]["N"]) if "page_item" in data else None,
+                    int(data["page_size"]["N"]) if "page_size" in data else None))
+            exclusive_start_key = response.get("LastEvaluatedKey")
+            if not exclusive_start_key:
+                return result
+
+    def counter_update(self, shard, prev_counter, new_counter):
+        # The counter's page size is part of its expected value, so that
+        # indexes are never reserved with an outdated page size
+        update = 'SET page = :page, page_item = :page_item, ' \
+                 'prev_stream_id = :prev_stream_id, prev_changeset_id = :prev_changeset_id'
+        condition = 'page = :expected_page AND page_item = :expected_page_item'
+        values = {
+            ':page': { "N": str(new_counter.page) },
+            ':page_item': { "N": str(new_counter.page_item) },
+            ':prev_stream_id': { "S": new_counter.prev_stream_id },
+            ':prev_changeset_id': { "N": str(new_counter.prev_changeset_id) },
+            ':expected_page': { "N": str(prev_counter.page) },
+            ':expected_page_item': { "N": str(prev_counter.page_item) }
+        }
+        if new_counter.page_size:
+            update += ', page_size = :page_size'
+            values[':page_size'] = { "N": str(new_counter.page_size) }
+        if prev_counter.page_size:
+            condition += ' AND page_size = :expected_page_size'
+            values[':expected_page_size'] = { "N": str(prev_counter.page_size) }
+        else:
+            condition += ' AND attribute_not_exists(page_size)'
+
+        return {
+            'Update': {
+                'TableName': self.events_table,
+                'Key': {
+                    'stream_id': { "S": self.global_counter_key },
+                    'changeset_id': { "N": str(self.global_counter_range + shard) }
+                },
+                'UpdateExpression': update,
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values
+            }
+        }
+
+    def index_update(self, global_index, condition):
+        update = 'SET page = :page, page_item = :page_item'
+        values = {
+            ':page': { "N": str(global_index.page) },
+            ':page_item': { "N": str(global_index.page_item) }
+        }
+        if global_index.page_size:
+            update += ', page_size = :page_size'
+            values[':page_size'] = { "N": str(global_index.page_size) }
+
+        return {
+            'Update': {
+                'TableName': self.events_table,
+                'Key': {
+                    'stream_id': { "S": global_index.stream_id },
+                    'changeset_id': { "N": str(global_index.changeset_id) }
+                },
+                'UpdateExpression': update,
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values
+            }
+        }
+
+    def get_index_settings(self):
+        response = self.dynamodb_ll.query(
+            TableName=self.events_table,
+            ConsistentRead=True,
+            KeyConditions={
+                'stream_id': {
+                    'AttributeValueList': [
+                        {
+                            'S': self.global_counter_key
+                        },
+                    ],
+                    'ComparisonOperator': 'EQ'
+                },
+                'changeset_id': {
+                    'AttributeValueList': [
+                        {
+                            'N': str(self.index_settings_range)
+                        },
+                    ],
+                    'ComparisonOperator': 'EQ'
+                }
+            }
+        )
+        if response["Count"] == 0:
+            return IndexSettings(CheckpointCalc.default_page_size)
+
+        data = response["Items"][0]
+        return IndexSettings(
+            page_size=int(data["page_size"]["N"]),
+            target_page_size=int(data["target_page_size"]["N"]) if "N" in data["target_page_size"] else None,
+            watermarks=json.loads(data["watermarks"]["S"]),
+            version=int(data["settings_version"]["N"]))
+
+    def update_index_settings(self, prev_settings, new_settings, global_indexes=(), counters=()):
+        settings_update = {
+            'Update': {
+                'TableName': self.events_table,
+                'Key': {
+                    'stream_id': { "S": self.global_counter_key },
+                    'changeset_id': { "N": str(self.index_settings_range) }
+                },
+                'UpdateExpression': 'SET page_size = :page_size, target_page_size = :target_page_size, '
+                                    'watermarks = :watermarks, settings_version = :version',
+                'ConditionExpression': 'settings_version = :expected_version',
+                'ExpressionAttributeValues': {
+                    ':page_size': { "N": str(new_settings.page_size) },
+                    ':target_page_size': { "N": str(new_settings.target_page_size) } \
+                        if new_settings.target_page_size else { "NULL": True },
+                    ':watermarks': { "S": json.dumps(new_settings.watermarks) },
+                    ':version': { "N": str(new_settings.version) },
+                    ':expected_version': { "N": str(prev_settings.version) }
+                }
+            }
+        }
+        if prev_settings.version == 0:
+            settings_update['Update']['ConditionExpression'] = 'attribute_not_exists(settings_version)'
+            del settings_update['Update']['ExpressionAttributeValues'][':expected_version']
+
+        transact_items = [settings_update]
+        transact_items += [self.counter_update(shard, prev, new) for (shard, prev, new) in counters]
+        transact_items += [self.index_update(i, 'attribute_exists(page)') for i in global_indexes]
+
+        try:
+            self.dynamodb_ll.transact_write_items(TransactItems=transact_items)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                raise ConcurrencyException(self.global_counter_key, self.index_settings_range)
             else:
-                break
+                raise e
 
-            if changesets_left <= 0:
+    def fetch_unindexed_changesets(self, stream_id, to_changeset):
+        # Changesets are indexed in order, so the unindexed ones are found by
+        # scanning the stream backwards, up to the first indexed changeset
+        items = self.paginate_query(
+            page_size=1000,
+            TableName=self.events_table,
+            ProjectionExpression='changeset_id,page,page_item',
+            ScanIndexForward=False,
+            KeyConditions={
+                'stream_id': {
+                    'AttributeValueList': [
+                        {
+                            'S': stream_id
+                        },
+                    ],
+                    'ComparisonOperator': 'EQ'
+                },
+                'changeset_id': {
+                    'AttributeValueList': [
+                        {
+                            'N': str(to_changeset)
+                        },
+                    ],
+                    'ComparisonOperator': 'LE'
+                }
+            }
+        )
+
+        result = []
+        for item in items:
+            if "page" in item:
                 break
+            result.append(int(item["changeset_id"]["N"]))
+        return result[::-1]
 
-        return result
-    
-    def fetch_global_events(self, checkpoint, event_in_checkpoint, limit):
-        def fetch_batch(page, since_item, limit):
-            response = self.dynamodb_ll.query(
+    def reserve_global_indexes(self, prev_counter, new_counter, global_indexes, shard=0):
+        counter_update = self.counter_update(shard, prev_counter, new_counter)
+
+        index_updates = [self.index_update(i, 'attribute_exists(stream_id) AND attribute_not_exists(page)')
+                         for i in global_indexes]
+
+        try:
+            self.dynamodb_ll.transact_write_items(TransactItems=[counter_update] + index_updates)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
+            else:
+                raise e
+
+    def fetch_global_changesets(self, checkpoint, limit, shard=0, shards=1, payload=None):
+        # The index can be re-indexed with a different page size while it's
+        # being read, the read is repeated if the settings changed meanwhile
+        settings = self.cached_index_settings()
+        while True:
+            result = []
+            # The pages don't change unless the index is being re-indexed
+            cache_version = None if settings.target_page_size else settings.version
+            for (page_size, from_checkpoint, to_checkpoint) in page_size_segments(settings, shard, checkpoint):
+                segment = self.fetch_global_range(
+                    page_size, from_checkpoint, to_checkpoint, limit - len(result), shard, shards, payload,
+                    cache_version)
+                result.extend(segment)
+                if len(result) >= limit:
+                    break
+                # The re-indexed items may not be visible in the eventually
+                # consistent index yet, continuing with the following segment
+                # would skip them
+                if to_checkpoint is not None and len(segment) < to_checkpoint - from_checkpoint:
+                    break
+
+            if not settings.target_page_size:
+                return result
+            current = self.cached_index_settings(refresh=True)
+            if current.version == settings.version:
+                return result
+            settings = current
+
+    def cached_index_settings(self, refresh=False):
+        # Outside of re-indexing, the settings are re-read once they are
+        # settings_ttl seconds old. The re-indexer waits as long before it
+        # moves any changesets, so no reader is still using the previous layout.
+        settings = self.index_settings
+        if refresh or not settings or settings.target_page_size or \
+           self.clock() - self.index_settings_read_at >= self.settings_ttl:
+            settings = self.get_index_settings()
+            self.index_settings = settings
+            self.index_settings_read_at = self.clock()
+        return settings
+
+    def fetch_global_range(self, page_size, from_checkpoint, to_checkpoint, limit, shard, shards, payload=None,
+                           cache_version=None):
+        def fetch_batch(page, since_item, limit, exclusive_start_key, payload):
+            # Returns the raw items, along with the query's count and last evaluated key
+            query = dict(
                 TableName=self.events_table,
-                Select='ALL_ATTRIBUTES',
+                **self.item_projection(payload),
                 IndexName='EmumerationIndex',
                 ScanIndexForward=True,
-                Limit=limit,
                 KeyConditions={
                     'page': {
                         'AttributeValueList': [
@@ -515,27 +1003,133 @@ class DynamoDB:
                     }
                 }
             )
-            return [DynamoDB.parse_commit(r) for r in response["Items"] if r["stream_id"]["S"] != self.global_counter_key]
+            if limit:
+                query['Limit'] = limit
+            if exclusive_start_key:
+                query['ExclusiveStartKey'] = exclusive_start_key
+            response = self.dynamodb_ll.query(**query)
+            items = [r for r in response["Items"] if r["stream_id"]["S"] != self.global_counter_key]
+            return (items, response["Count"], response.get("LastEvaluatedKey"))
+
+        # During re-indexing, the pages may also contain items that are
+        # paged by the other page size, these are skipped. The pages of
+        # each page size are contiguous, so a page without any of its
+        # page size's items ends the range.
+        def in_layout(item):
+            return (int(item["page_size"]["N"]) if "page_size" in item else calc.default_page_size) == page_size
+
+        def in_range(page, c):
+            return to_checkpoint is None or calc.to_checkpoint(page, c.page_item) < to_checkpoint
+
+        def fetch_page(page, since_item, limit):
+            # Returns up to limit of the page's changesets, along with the
+            # number of the page's items paged by page_size
+            if page < complete_pages:
+                items = read_complete_page(page)
+                changesets = [DynamoDB.parse_commit(i, payload) for i in items
+                              if int(i["page_item"]["N"]) >= since_item]
+                changesets = [c for c in changesets[:limit] if in_range(page, c)]
+                return (changesets, len(items))
 
-        (page, page_item) = self.checkpoint_calc.to_page_item(checkpoint)
+            exclusive_start_key = None
+            page_changesets = 0
+            result = []
+            while len(result) < limit:
+                (batch, items_read, exclusive_start_key) = \
+                    fetch_batch(page * shards + shard, since_item, limit - len(result), exclusive_start_key, payload)
+                batch = [DynamoDB.parse_commit(i) for i in batch if in_layout(i)]
+                page_changesets += len(batch)
+                result.extend(c for c in batch if in_range(page, c))
+                if not exclusive_start_key:
+                    break
+            return (result, page_changesets)
+
+        def read_complete_page(page):
+            # Completed pages are read, and cached, in full. The raw items are
+            # cached, so that the cache's size is bounded by the items' size
+            # rather than their decoded payloads', and are parsed on each read.
+            key = (cache_version, page_size, page * shards + shard)
+            items = self.page_cache.get(key)
+            if items is not None:
+                return items
+
+            (items, exclusive_start_key) = ([], None)
+            while True:
+                (batch, _, exclusive_start_key) = \
+                    fetch_batch(page * shards + shard, 0, None, exclusive_start_key, None)
+                items.extend(i for i in batch if in_layout(i))
+                if not exclusive_start_key:
+                    break
+            # Positions can be missing while the index's replica is catching up
+            if len(items) == page_size:
+                self.page_cache.put(key, items, sum(item_size(i) for i in items))
+            return items
+
+        calc = CheckpointCalc(page_size)
+        (page, page_item) = calc.to_page_item(from_checkpoint)
+        complete_pages = 0
+        if self.page_cache and cache_version is not None:
+            complete_pages = self.count_complete_pages(cache_version, shard, page_size, page)
+        pages = itertools.count(page)
+        if to_checkpoint is not None:
+            pages = range(page, calc.to_page_item(to_checkpoint - 1)[0] + 1)
 
-        changesets_left = limit
-        last_batch = None
         result = []
-        while True:
-            last_batch = fetch_batch(page, page_item, changesets_left)
-            if len(last_batch) > 0:
-                result.extend(last_batch)
-                (page, page_item) = self.checkpoint_calc.next_page_and_item(page, page_item)
-                changesets_left = changesets_left - len(last_batch)
-            else:
+        for (changesets, page_changesets) in self.read_pages(fetch_page, pages, page_item,
+                                                             lambda: limit - len(result)):
+            result.extend(changesets[:limit - len(result)])
+            if len(result) >= limit or page_changesets == 0:
                 break
+        return result
 
-            if changesets_left <= 0:
-                break
+    def count_complete_pages(self, version, shard, page_size, page):
+        # The shard's pages preceding its counter's page are complete. The
+        # counter is only read when the requested page isn't known to be.
+        key = (version, shard)
+        complete_pages = self.complete_pages.get(key, 0)
+        if page >= complete_pages:
+            counter = self.get_global_counter(shard)
+            calc = CheckpointCalc(counter.page_size)
+            if calc.page_size == page_size:
+                head = calc.to_checkpoint(counter.page, counter.page_item) + 1
+                complete_pages = calc.to_page_item(head)[0]
+                self.complete_pages[key] = complete_pages
+        return complete_pages
+
+    def read_pages(self, fetch_page, pages, first_page_item, changesets_left):
+        # Yields the pages' (changesets, page_changesets) in order. In the
+        # read-ahead mode the following pages are queried concurrently,
+        # while the current one is consumed.
+        if not self.prefetch_pages:
+            for page in pages:
+                yield fetch_page(page, first_page_item, changesets_left())
+                first_page_item = 0
+            return
+
+        pages = iter(pages)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) <= self.prefetch_pages:
+                    page = next(pages, None)
+                    if page is None:
+                        break
+                    pending.append(self.prefetch_executor().submit(
+                        fetch_page, page, first_page_item, changesets_left()))
+                    first_page_item = 0
+                if not pending:
+                    return
+                yield pending.popleft().result()
+        finally:
+            for f in pending:
+                f.cancel()
+
+    def prefetch_executor(self):
+        with self.executor_lock:
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(max_workers=self.prefetch_pages)
+            return self.executor
 
-        return result
-    
     def get_analysis_state(self):
         def fetch_state():
             projection = 'projection_id,proj_state,version'
@@ -565,7 +1159,8 @@ class DynamoDB:
                 total_changesets=data["total_changesets"],
                 total_events=data["total_events"],
                 max_stream_length=data["max_stream_length"],
-                version=int(response["Items"][0]["version"]["N"])
+                version=int(response["Items"][0]["version"]["N"]),
+                checkpoint=data.get("checkpoint")
             )
         result = fetch_state()
         if not result:
@@ -609,7 +1204,8 @@ class DynamoDB:
             "total_changesets": state.total_changesets,
             "total_events": state.total_events,
             "max_stream_length": state.max_stream_length,
-            "version": state.version
+            "version": state.version,
+            "checkpoint": state.checkpoint
         }
 
         item = {
@@ -631,4 +1227,93 @@ class DynamoDB:
                 logger.debug(f"ConditionalCheckFailedException for analysis model, expected version {expected_version}")
                 raise ConcurrencyException("analysis_model", expected_version)
             else:
-                raise e
\ No newline at end of file
+                raise e
+
+    def get_projection_state(self, projection_id):
+        response = self.dynamodb_ll.query(
+            TableName=self.analysis_table,
+            ProjectionExpression='projection_id,proj_state,version',
+            Limit=1,
+            KeyConditions={
+                'projection_id': {
+                    'AttributeValueList': [
+                        {
+                            'S': self.projection_key(projection_id)
+                        },
+                    ],
+                    'ComparisonOperator': 'EQ'
+                }
+            }
+        )
+        if response["Count"] == 0:
+            return None
+
+        item = response["Items"][0]
+        data = json.loads(item["proj_state"]["S"])
+        return ProjectionState(
+            projection_id=projection_id,
+            state=data["state"],
+            checkpoint=data["checkpoint"],
+            version=int(item["version"]["N"])
+        )
+
+    def set_projection_state(self, state, expected_version):
+        item = {
+            'projection_id': { "S": self.projection_key(state.projection_id) },
+            'proj_state': { "S": json.dumps({ "state": state.state, "checkpoint": state.checkpoint }) },
+            'version': { "N": str(state.version) }
+        }
+
+        if expected_version is None:
+            condition = { 'projection_id': { "Exists": False } }
+        else:
+            condition = { 'version': { "Value": { "N": str(expected_version) } } }
+
+        try:
+            self.dynamodb_ll.put_item(
+                TableName=self.analysis_table, Item=item, Expected=condition
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logger.debug(f"ConditionalCheckFailedException for projection {state.projection_id}, expected version {expected_version}")
+                raise ConcurrencyException(state.projection_id, expected_version)
+            else:
+                raise e
+
+    def projection_key(self, projection_id):
+        # The projections share the analysis table with the built-in states
+        return f"projection:{projection_id}"
+
+    def get_indexer_state(self):
+        response = self.dynamodb_ll.query(
+            TableName=self.analysis_table,
+            ProjectionExpression='projection_id,proj_state',
+            Limit=1,
+            KeyConditions={
+                'projection_id': {
+                    'AttributeValueList': [
+                        {
+                            'S': "indexer_state"
+                        },
+                    ],
+                    'ComparisonOperator': 'EQ'
+                }
+            }
+        )
+        if response["Count"] == 0:
+            return None
+
+        data = json.loads(response["Items"][0]["proj_state"]["S"])
+        if set(data) != set(IndexerState._fields):
+            # Recorded by a previous version, the next batch replaces it
+            return None
+        return IndexerState(**data)
+
+    def set_indexer_state(self, state):
+        # Written by concurrent indexer invocations, the last one wins
+        self.dynamodb_ll.put_item(
+            TableName=self.analysis_table,
+            Item={
+                'projection_id': { "S": "indexer_state" },
+                'proj_state': { "S": json.dumps(state._asdict()) }
+            })
\ No newline at end of file
@@ -0,0 +1,304 @@
+import bisect
+import copy
+import logging
+import threading
+from ees.infrastructure.storage import StorageEngine
+from ees.model import ConcurrencyException, BatchConcurrencyException, GlobalCounter, GlobalIndex, CheckpointCalc, AnalysisState, IndexSettings, page_size_segments
+
+logger = logging.getLogger("ees.infrastructure.in_memory")
+
+
+class InMemoryStream:
+    # Changesets are kept sorted by changeset_id, along with the parallel
+    # arrays of their ids and last event ids for binary searching.
+    def __init__(self):
+        self.changesets = []
+        self.changeset_ids = []
+        self.last_event_ids = []
+
+    def insert(self, commit):
+        i = bisect.bisect_left(self.changeset_ids, commit.changeset_id)
+        if i < len(self.changeset_ids) and self.changeset_ids[i] == commit.changeset_id:
+            raise ConcurrencyException(commit.stream_id, commit.changeset_id)
+        self.changesets.insert(i, commit)
+        self.changeset_ids.insert(i, commit.changeset_id)
+        self.last_event_ids.insert(i, commit.last_event_id)
+
+    def find(self, changeset_id):
+        i = bisect.bisect_left(self.changeset_ids, changeset_id)
+        if i < len(self.changeset_ids) and self.changeset_ids[i] == changeset_id:
+            return i
+        return None
+
+
+class InMemoryStorage(StorageEngine):
+    global_counter_key = '!!!RESERVED:GLOBAL-COUNTER!!!'
+    global_counter_range = 0
+
+    def __init__(self):
+        self.streams = { }
+        self.global_indexes = { }
+        # Changeset keys by (page size, page, page item). A corrupted index
+        # can have multiple changesets in the same position.
+        self.global_pages = { }
+        self.max_pages = { }
+        self.index_settings = IndexSettings(CheckpointCalc.default_page_size)
+        self.global_counters = { }
+        self.analysis_state = None
+        self.projection_states = { }
+        self.indexer_state = None
+        self.snapshots = { }
+        self.checkpoint_calc = CheckpointCalc()
+        self.lock = threading.RLock()
+
+    def append(self, commit):
+        with self.lock:
+            stream = self.streams.get(commit.stream_id)
+            if not stream:
+                stream = self.streams[commit.stream_id] = InMemoryStream()
+            stream.insert(commit._replace(page=None, page_item=None))
+
+    def append_batch(self, commits):
+        with self.lock:
+            conflicts = [ConcurrencyException(c.stream_id, c.changeset_id) for c in commits
+                         if c.stream_id in self.streams and
+                            self.streams[c.stream_id].find(c.changeset_id) is not None]
+            if conflicts:
+                raise BatchConcurrencyException(conflicts)
+
+            for c in commits:
+                self.append(c)
+
+    def fetch_last_commit(self, stream_id, meta_only=False):
+        stream = self.streams.get(stream_id)
+        if not stream or not stream.changesets:
+            return None
+
+        commit = stream.changesets[-1]
+        if meta_only:
+            return commit._replace(events=None, metadata=None)
+        return commit
+
+    def fetch_stream_changesets(self,
+                                stream_id,
+                                from_changeset=None,
+                                to_changeset=None,
+                                limit=None,
+                                payload=None):
+        stream = self.streams.get(stream_id)
+        if not stream:
+            return []
+
+        start = bisect.bisect_left(stream.changeset_ids, from_changeset or 1)
+        end = len(stream.changeset_ids)
+        if to_changeset:
+            end = bisect.bisect_right(stream.changeset_ids, to_changeset)
+        if limit:
+            end = min(end, start + limit)
+
+        return [self.with_payload(self.with_global_index(c), payload) for c in stream.changesets[start:end]]
+
+    def iterate_stream_by_events(self,
+                                 stream_id,
+                                 from_event=None,
+                                 to_event=None,
+                                 page_size=None,
+                                 payload=None):
+        stream = self.streams.get(stream_id)
+        if not stream:
+            return
+
+        i = bisect.bisect_left(stream.last_event_ids, from_event or 1)
+        while i < len(stream.changesets):
+            c = stream.changesets[i]
+            if to_event and c.first_event_id > to_event:
+                return
+            yield self.with_payload(self.with_global_index(c), payload)
+            i += 1
+
+    def with_global_index(self, commit):
+        index = self.global_indexes.get((commit.stream_id, commit.changeset_id))
+        if not index:
+            return commit
+        return commit._replace(page=index[0], page_item=index[1], page_size=index[2])
+
+    def save_snapshot(self, snapshot):
+        with self.lock:
+            snapshots = self.snapshots.setdefault(snapshot.stream_id, [])
+            changeset_ids = [s.changeset_id for s in snapshots]
+            i = bisect.bisect_left(changeset_ids, snapshot.changeset_id)
+            if i < len(snapshots) and snapshots[i].changeset_id == snapshot.changeset_id:
+                snapshots[i] = snapshot
+            else:
+                snapshots.insert(i, snapshot)
+
+    def fetch_latest_snapshot(self, stream_id, to_changeset=None):
+        snapshots = self.snapshots.get(stream_id, [])
+        candidates = [s for s in snapshots
+                      if not to_changeset or s.changeset_id <= to_changeset]
+        return candidates[-1] if candidates else None
+
+    def get_global_counter(self, shard=0):
+        return self.global_counters.get(shard, GlobalCounter(0, -1, "", 0))
+
+    def update_global_counter(self, prev_value, new_value, shard=0):
+        with self.lock:
+            counter = self.get_global_counter(shard)
+            if counter.page != prev_value.page or \
+               counter.page_item != prev_value.page_item or \
+               counter.page_size != prev_value.page_size:
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
+            self.global_counters[shard] = new_value
+
+    def get_global_index_value(self, stream_id, changeset_id):
+        stream = self.streams.get(stream_id)
+        if not stream or stream.find(changeset_id) is None:
+            return None
+
+        (page, page_item, page_size) = self.global_indexes.get((stream_id, changeset_id), (None, None, None))
+        return GlobalIndex(stream_id, changeset_id, page, page_item, page_size)
+
+    def get_global_index_values(self, keys):
+        result = { }
+        for (stream_id, changeset_id) in keys:
+            value = self.get_global_index_value(stream_id, changeset_id)
+            if value:
+                result[(stream_id, changeset_id)] = value
+        return result
+
+    def fetch_unindexed_changesets(self, stream_id, to_changeset):
+        stream = self.streams.get(stream_id)
+        if not stream:
+            return []
+
+        result = []
+        end = bisect.bisect_right(stream.changeset_ids, to_changeset)
+        for changeset_id in reversed(stream.changeset_ids[:end]):
+            if (stream_id, changeset_id) in self.global_indexes:
+                break
+            result.append(changeset_id)
+        return result[::-1]
+
+    def reserve_global_indexes(self, prev_counter, new_counter, global_indexes, shard=0):
+        with self.lock:
+            if any((i.stream_id, i.changeset_id) in self.global_indexes for i in global_indexes):
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
+            self.update_global_counter(prev_counter, new_counter, shard)
+            for i in global_indexes:
+                self.set_global_index(i)
+
+    def set_global_index(self, global_index):
+        key = (global_index.stream_id, global_index.changeset_id)
+        with self.lock:
+            if key in self.global_indexes:
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range)
+            self.place_global_index(global_index)
+
+    def place_global_index(self, global_index):
+        key = (global_index.stream_id, global_index.changeset_id)
+        if key in self.global_indexes:
+            (page, page_item, page_size) = self.global_indexes[key]
+            self.global_pages[(page_size or CheckpointCalc.default_page_size, page, page_item)].remove(key)
+
+        page_size = global_index.page_size or CheckpointCalc.default_page_size
+        self.global_indexes[key] = (global_index.page, global_index.page_item, global_index.page_size)
+        self.global_pages.setdefault((page_size, global_index.page, global_index.page_item), []).append(key)
+        self.max_pages[page_size] = max(self.max_pages.get(page_size, -1), global_index.page)
+
+    def update_global_index(self, prev_value, new_value):
+        key = (new_value.stream_id, new_value.changeset_id)
+        with self.lock:
+            (page, page_item, page_size) = self.global_indexes.get(key, (None, None, None))
+            if (page, page_item, page_size) != (prev_value.page, prev_value.page_item, prev_value.page_size):
+                raise ConcurrencyException(new_value.stream_id, new_value.changeset_id)
+            self.place_global_index(new_value)
+
+    def relocate_global_indexes(self, prev_counter, new_counter, updates, shard=0):
+        with self.lock:
+            counter = self.get_global_counter(shard)
+            if (counter.page, counter.page_item, counter.page_size) != \
+               (prev_counter.page, prev_counter.page_item, prev_counter.page_size):
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
+            conflicts = [ConcurrencyException(new.stream_id, new.changeset_id) for (prev, new) in updates
+                         if self.global_indexes.get((new.stream_id, new.changeset_id), (None, None, None)) !=
+                            (prev.page, prev.page_item, prev.page_size)]
+            if conflicts:
+                raise BatchConcurrencyException(conflicts)
+            self.global_counters[shard] = new_counter
+            for (_, new) in updates:
+                self.place_global_index(new)
+
+    def scan_global_indexes(self, segment, total_segments):
+        with self.lock:
+            stream_ids = sorted(self.streams.keys())
+            return [self.get_global_index_value(stream_id, changeset_id)
+                    for stream_id in stream_ids[segment::total_segments]
+                    for changeset_id in self.streams[stream_id].changeset_ids]
+
+    def get_index_settings(self):
+        return self.index_settings
+
+    def update_index_settings(self, prev_settings, new_settings, global_indexes=(), counters=()):
+        with self.lock:
+            if self.index_settings.version != prev_settings.version:
+                raise ConcurrencyException(self.global_counter_key, self.global_counter_range)
+            for (shard, prev_counter, new_counter) in counters:
+                counter = self.get_global_counter(shard)
+                if (counter.page, counter.page_item, counter.page_size) != \
+                   (prev_counter.page, prev_counter.page_item, prev_counter.page_size):
+                    raise ConcurrencyException(self.global_counter_key, self.global_counter_range + shard)
+
+            self.index_settings = new_settings
+            for (shard, prev_counter, new_counter) in counters:
+                self.global_counters[shard] = new_counter
+            for i in global_indexes:
+                self.place_global_index(i)
+
+    def fetch_global_changesets(self, checkpoint, limit, shard=0, shards=1, payload=None):
+        result = []
+        with self.lock:
+            for (page_size, from_checkpoint, to_checkpoint) in \
+                    page_size_segments(self.index_settings, shard, checkpoint):
+                calc = CheckpointCalc(page_size)
+                position = from_checkpoint
+                while len(result) < limit and (to_checkpoint is None or position < to_checkpoint):
+                    (page, page_item) = calc.to_page_item(position)
+                    if page * shards + shard > self.max_pages.get(page_size, -1):
+                        break
+                    position += 1
+                    for key in self.global_pages.get((page_size, page * shards + shard, page_item), []):
+                        stream = self.streams[key[0]]
+                        result.append(self.with_payload(
+                            self.with_global_index(stream.changesets[stream.find(key[1])]), payload))
+        return result
+
+    def get_analysis_state(self):
+        with self.lock:
+            if not self.analysis_state:
+                self.analysis_state = AnalysisState(0, 0, 0, 0, 0)
+            return self.analysis_state
+
+    def set_analysis_state(self, state, expected_version):
+        with self.lock:
+            if self.get_analysis_state().version != expected_version:
+                logger.debug(f"Concurrency conflict for analysis model, expected version {expected_version}")
+                raise ConcurrencyException("analysis_model", expected_version)
+            self.analysis_state = state
+
+    def get_projection_state(self, projection_id):
+        # The states are copied, so that the reducers can't modify the stored ones
+        return copy.deepcopy(self.projection_states.get(projection_id))
+
+    def set_projection_state(self, state, expected_version):
+        with self.lock:
+            prev_state = self.projection_states.get(state.projection_id)
+            if (prev_state.version if prev_state else None) != expected_version:
+                logger.debug(f"Concurrency conflict for projection {state.projection_id}, expected version {expected_version}")
+                raise ConcurrencyException(state.projection_id, expected_version)
+            self.projection_states[state.projection_id] = copy.deepcopy(state)
+
+    def get_indexer_state(self):
+        return self.indexer_state
+
+    def set_indexer_state(self, state):
+        self.indexer_state = state
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+import threading
+
+
+class GlobalPageCache:
+    # A memory bounded LRU cache of the raw items of the enumeration index's
+    # completed pages. Once a shard's counter moved past a page, and all of the page's
+    # positions were read, its changesets never change. The pages are keyed
+    # by the index settings' version, so the pages of a previous layout
+    # are never hit after re-indexing, and are eventually evicted.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.pages.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.pages.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, changesets, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.pages:
+                self.size -= self.pages.pop(key)[1]
+            self.pages[key] = (changesets, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                (_, (_, evicted_size)) = self.pages.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+            self.size = 0
+
+
+# The memory taken by a DynamoDB item's dicts and strings, besides the
+# attributes' names and values
+item_overhead = 400
+attribute_overhead = 400
+
+def item_size(item):
+    # Approximates a raw DynamoDB item's memory footprint
+    size = item_overhead
+    for name, value in item.items():
+        size += attribute_overhead + len(name)
+        for v in value.values():
+            size += len(v) if isinstance(v, (str, bytes)) else 8
+    return size
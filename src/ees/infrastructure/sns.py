@@ -6,9 +6,9 @@ logger = logging.getLogger("ees.infrastructure.sns")
 
 
 class SNS:
-    def __init__(self, topic):
+    def __init__(self, topic, client=None):
         self.topic = topic
-        self.sns = boto3.client('sns') 
+        self.sns = client or boto3.client('sns')
     
     def publish(self, message, group):
         logger.debug(f"Publishing message to {self.topic}: {message}")
@@ -0,0 +1,178 @@
+from abc import ABC, abstractmethod
+
+
+class StorageEngine(ABC):
+    # The persistence operations the handlers depend on. An engine is
+    # responsible for enforcing the optimistic concurrency conditions and
+    # signals violations by raising ees.model.ConcurrencyException.
+
+    # Seconds the readers may keep using the enumeration index's settings
+    # without re-reading them, while it isn't being re-indexed
+    settings_ttl = 0
+
+    @abstractmethod
+    def append(self, commit):
+        # Stores a new changeset, fails if the stream already
+        # contains the commit's changeset_id
+        pass
+
+    @abstractmethod
+    def append_batch(self, commits):
+        # Atomically stores changesets of multiple streams. If any of the
+        # changesets already exists, none are stored, and the conflicting
+        # ones are reported as a BatchConcurrencyException
+        pass
+
+    @abstractmethod
+    def fetch_last_commit(self, stream_id, meta_only=False):
+        # Returns the stream's most recent changeset or None if the stream
+        # doesn't exist. The events and metadata are omitted if meta_only is set.
+        pass
+
+    # The changeset reads accept the payload columns ("events", "metadata")
+    # to read; None reads all of them. The columns that aren't read are
+    # returned as None.
+
+    @abstractmethod
+    def fetch_stream_changesets(self, stream_id, from_changeset=None, to_changeset=None, limit=None,
+                                payload=None):
+        pass
+
+    @abstractmethod
+    def iterate_stream_by_events(self, stream_id, from_event=None, to_event=None, page_size=None,
+                                 payload=None):
+        # Lazily yields the changesets that contain the requested events range
+        pass
+
+    def fetch_stream_by_events(self, stream_id, from_event=None, to_event=None):
+        return list(self.iterate_stream_by_events(stream_id, from_event, to_event))
+
+    def with_payload(self, commit, payload):
+        if payload is None:
+            return commit
+        return commit._replace(events=commit.events if "events" in payload else None,
+                               metadata=commit.metadata if "metadata" in payload else None)
+
+    @abstractmethod
+    def save_snapshot(self, snapshot):
+        pass
+
+    @abstractmethod
+    def fetch_latest_snapshot(self, stream_id, to_changeset=None):
+        # Returns the stream's most recent snapshot, taken at or
+        # before to_changeset if specified, or None
+        pass
+
+    @abstractmethod
+    def get_global_counter(self, shard=0):
+        pass
+
+    @abstractmethod
+    def update_global_counter(self, prev_value, new_value, shard=0):
+        # Fails if the shard counter's current value is not prev_value
+        pass
+
+    @abstractmethod
+    def get_global_index_value(self, stream_id, changeset_id):
+        pass
+
+    @abstractmethod
+    def set_global_index(self, global_index):
+        # Fails if the changeset already has a global index
+        pass
+
+    @abstractmethod
+    def get_global_index_values(self, keys):
+        # Reads the global indexes of multiple (stream_id, changeset_id) keys.
+        # Returns a dict by key, without the changesets that don't exist
+        pass
+
+    @abstractmethod
+    def fetch_unindexed_changesets(self, stream_id, to_changeset):
+        # Returns the ids of the stream's changesets, up to to_changeset, that
+        # follow its last changeset with a global index, in ascending order
+        pass
+
+    @abstractmethod
+    def reserve_global_indexes(self, prev_counter, new_counter, global_indexes, shard=0):
+        # Atomically moves the shard's counter from prev_counter to new_counter and
+        # sets the global indexes. Nothing is written if the counter's current
+        # value is not prev_counter or any of the changesets already has a
+        # global index
+        pass
+
+    @abstractmethod
+    def get_index_settings(self):
+        # Returns the enumeration index's IndexSettings, or the
+        # default settings if they were never changed
+        pass
+
+    def cached_index_settings(self, refresh=False):
+        # Storage engines that cache the settings may return them
+        # up to the engine's settings TTL late
+        return self.get_index_settings()
+
+    @abstractmethod
+    def update_index_settings(self, prev_settings, new_settings, global_indexes=(), counters=()):
+        # Atomically replaces the settings, overwrites the changesets' global
+        # indexes, and moves the (shard, prev_counter, new_counter) counters.
+        # Nothing is written if the stored settings' version is not
+        # prev_settings.version or any counter's value is not prev_counter
+        pass
+
+    @abstractmethod
+    def update_global_index(self, prev_value, new_value):
+        # Overwrites the changeset's global index. Fails if its current
+        # value is not prev_value (an unindexed changeset's page is None)
+        pass
+
+    @abstractmethod
+    def relocate_global_indexes(self, prev_counter, new_counter, updates, shard=0):
+        # Atomically moves the shard's counter from prev_counter to new_counter and
+        # overwrites the (prev_value, new_value) global indexes. Nothing is written
+        # if the counter's current value is not prev_counter, or any of the
+        # indexes' current value is not its prev_value; the latter are reported
+        # as a BatchConcurrencyException
+        pass
+
+    @abstractmethod
+    def scan_global_indexes(self, segment, total_segments):
+        # Returns the global indexes of all the changesets in one of the
+        # table's total_segments disjoint segments, including the unindexed
+        # ones. The segments can be scanned in parallel.
+        pass
+
+    @abstractmethod
+    def fetch_global_changesets(self, checkpoint, limit, shard=0, shards=1, payload=None):
+        # The checkpoint is relative to the shard. The returned changesets'
+        # pages are the enumeration index's pages, which interleave the shards
+        pass
+
+    @abstractmethod
+    def get_analysis_state(self):
+        pass
+
+    @abstractmethod
+    def set_analysis_state(self, state, expected_version):
+        # Fails if the stored state's version is not expected_version
+        pass
+
+    @abstractmethod
+    def get_projection_state(self, projection_id):
+        # Returns None if the projection wasn't saved yet
+        pass
+
+    @abstractmethod
+    def set_projection_state(self, state, expected_version):
+        # Fails if the stored state's version is not expected_version,
+        # or if expected_version is None and the state was already saved
+        pass
+
+    @abstractmethod
+    def get_indexer_state(self):
+        # Returns None if the indexer didn't run yet
+        pass
+
+    @abstractmethod
+    def set_indexer_state(self, state):
+        pass
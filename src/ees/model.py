@@ -1,3 +1,7 @@
+import base64
+import binascii
+import hashlib
+import json
 from collections import namedtuple
 
 CommitData = namedtuple(
@@ -9,26 +13,66 @@ CommitData = namedtuple(
     'first_event_id',
     'last_event_id',
     'page',
-    'page_item'])
+    'page_item',
+    'page_size'],
+    defaults=[None])
 
 GlobalCounter = namedtuple(
     'GlobalCounter',
     ['page',
     'page_item',
     'prev_stream_id',
-    'prev_changeset_id'])
+    'prev_changeset_id',
+    'page_size'],
+    defaults=[None])
 
 GlobalIndex = namedtuple(
     'GlobalIndex',
     ['stream_id',
     'changeset_id',
     'page',
-    'page_item'])
+    'page_item',
+    'page_size'],
+    defaults=[None])
+
+# The enumeration index's table-level settings. While the index is being
+# re-indexed to target_page_size, each shard's changesets preceding its
+# watermark are already paged by target_page_size (a watermark of None
+# means the whole shard is).
+IndexSettings = namedtuple(
+    'IndexSettings',
+    ['page_size',
+    'target_page_size',
+    'watermarks',
+    'version'],
+    defaults=[None, None, 0])
+
+# The inconsistencies found in the global index. The changesets (keys) that
+# have to be re-indexed, by the reason, and the (shard, checkpoint) positions
+# below the counters that no changeset holds.
+IndexAudit = namedtuple(
+    'IndexAudit',
+    ['changesets',
+    'unindexed',
+    'duplicated',
+    'misplaced',
+    'out_of_order',
+    'beyond_head',
+    'gaps'])
+
+Snapshot = namedtuple(
+    'Snapshot',
+    ['stream_id',
+    'changeset_id',
+    'last_event_id',
+    'data'])
 
 Response = namedtuple(
     'Response',
     ['http_status',
-     'body'])
+     'body',
+     'headers'],
+    defaults=[None])
 
 AnalysisState = namedtuple(
     'AnalysisState',
@@ -36,8 +80,46 @@ AnalysisState = namedtuple(
      'total_changesets',
      'total_events',
      'max_stream_length',
+     'version',
+     'checkpoint'],
+    defaults=[None])
+
+# A read model projected from the global feed: the reducer returns the
+# state after applying a changeset to it. The state is persisted by the
+# store's get_projection_state and set_projection_state, the storage
+# engine's by default.
+Projection = namedtuple(
+    'Projection',
+    ['projection_id',
+     'reducer',
+     'initial_state',
+     'store'],
+    defaults=[None, None])
+
+# A projection's persisted state, and the per shard checkpoints of the
+# changesets it was projected from. The version is the sum of the
+# checkpoints, so it grows with each save.
+ProjectionState = namedtuple(
+    'ProjectionState',
+    ['projection_id',
+     'state',
+     'checkpoint',
      'version'])
 
+# The global indexer's last batch: the changesets it indexed, including the
+# stream records' unindexed predecessors, the age of the batch's oldest
+# stream record when the batch started, and the latencies from the stream
+# records' commits to their indexing. The stream is processed in order, so
+# the oldest record's age approximates the stream's iterator age. The
+# backlog itself isn't known to the indexer.
+IndexerState = namedtuple(
+    'IndexerState',
+    ['timestamp',
+     'last_batch_indexed_changesets',
+     'last_batch_oldest_record_age_ms',
+     'last_batch_average_latency_ms',
+     'last_batch_max_latency_ms'])
+
 def make_initial_commit(stream_id, events, metadata={}):
     return CommitData(
         stream_id=stream_id,
@@ -63,17 +145,46 @@ def make_next_commit(prev_commit, events, metadata={}):
     )
 
 
+def make_continuation_token(stream_id, kind, position):
+    token = json.dumps({ "stream_id": stream_id, "kind": kind, "position": position })
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+def parse_continuation_token(stream_id, kind, token):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        position = int(data["position"])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidContinuationToken(token)
+
+    if data.get("stream_id") != stream_id or data.get("kind") != kind or position < 1:
+        raise InvalidContinuationToken(token)
+    return position
+
+
+class InvalidContinuationToken(Exception):
+    def __init__(self, token):
+        self.token = token
+
+
 class ConcurrencyException(Exception):
     def __init__(self, stream_id, changeset_id):
         self.stream_id = stream_id
         self.changeset_id = changeset_id
 
 
+class BatchConcurrencyException(Exception):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+
+
 class CheckpointCalc(object):
-    # The value is hardcoded because it's not meant to be changed
-    # a change in the page size requires rebuilding the index for
-    # the whole table. Currently not implemented.
-    page_size = 1000
+    # The page size is a table-level setting. Changing it requires
+    # re-indexing the table, items indexed before page sizes became
+    # configurable have no page_size attribute and use the default.
+    default_page_size = 1000
+
+    def __init__(self, page_size=None):
+        self.page_size = page_size or self.default_page_size
 
     def next_page_and_item(self, page, page_item):
         prev_page = page
@@ -93,3 +204,86 @@ class CheckpointCalc(object):
         i = checkpoint % self.page_size
         return (p, i)
 
+
+class GlobalShards(object):
+    # Streams are assigned to one of the global index's shards by hashing
+    # their ids. Each shard has its own counter, and its pages are
+    # interleaved with the other shards' pages in the enumeration index.
+    # The number of shards cannot be changed without rebuilding the index.
+    def __init__(self, count=1):
+        self.count = count
+
+    def shard_of(self, stream_id):
+        if self.count == 1:
+            return 0
+        digest = hashlib.sha224(stream_id.encode('utf-8')).hexdigest()
+        return int(digest, 16) % self.count
+
+    def index_page(self, shard, page):
+        return page * self.count + shard
+
+    def shard_page(self, index_page):
+        return index_page // self.count
+
+
+def make_etag(body):
+    digest = hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+def make_stream_etag(stream_id, last_ids, request):
+    # Streams are append-only, so a stream read's response is determined
+    # by the request and the tuple of the last ids it returned
+    return make_etag([stream_id, list(last_ids), list(request)])
+
+def etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        # The compressed representations' tags are suffixed with their encoding
+        for encoding in ("gzip", "deflate"):
+            if tag.endswith(f'-{encoding}"'):
+                tag = tag[:-len(encoding) - 2] + '"'
+        if tag == etag:
+            return True
+    return False
+
+def make_vector_checkpoint(checkpoints):
+    return ",".join(str(c) for c in checkpoints)
+
+def parse_vector_checkpoint(checkpoint):
+    checkpoints = [int(c) for c in checkpoint.split(",")]
+    if any(c < 0 for c in checkpoints):
+        raise ValueError(checkpoint)
+    return checkpoints
+
+# An event's position in the global feed is its changeset's checkpoint
+# and its offset in the changeset, e.g. "42.1"
+def make_event_checkpoint(position):
+    return f"{position[0]}.{position[1]}"
+
+def parse_event_checkpoint(checkpoint):
+    (changeset_checkpoint, _, event_offset) = checkpoint.partition(".")
+    position = (int(changeset_checkpoint), int(event_offset or 0))
+    if position[0] < 0 or position[1] < 0:
+        raise ValueError(checkpoint)
+    return position
+
+
+def page_size_segments(settings, shard, checkpoint):
+    # Splits the shard's positions, starting at the checkpoint, into
+    # (page_size, from_checkpoint, to_checkpoint) ranges of uniform paging.
+    # The last range is open ended.
+    page_size = settings.page_size or CheckpointCalc.default_page_size
+    if not settings.target_page_size:
+        return [(page_size, checkpoint, None)]
+
+    watermark = settings.watermarks[shard]
+    if watermark is None:
+        return [(settings.target_page_size, checkpoint, None)]
+    if checkpoint < watermark:
+        return [(settings.target_page_size, checkpoint, watermark),
+                (page_size, watermark, None)]
+    return [(page_size, checkpoint, None)]
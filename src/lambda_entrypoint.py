@@ -1,36 +1,24 @@
-import json
-import os
 import logging
-from ees.app import route_request
-from ees.handlers.analysis_projector import AnalysisProjector
-from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
-from ees.handlers.publisher import Publisher
-from ees.infrastructure.aws_lambda import event_to_command, parse_dynamodb_new_records
-from ees.infrastructure.dynamodb import DynamoDB
-from ees.infrastructure.sns import SNS
+from ees.app import route_request, resources
+from ees.infrastructure.aws_lambda import event_to_command, parse_dynamodb_new_records, render_response
 from ees.model import Response
-from ees.app import route_request
 
 logger = logging.getLogger("ees.entrypoint")
 
 def request_handler(event, context):
     logger.info(f"Processing incoming event: {event}")    
-    pretty_print = True
     parsed_event = event_to_command(event, context)
     logger.debug(f"Event was parsed to: {parsed_event}")
     if isinstance(parsed_event, Response):
-        return render(parsed_event, pretty_print)
+        return render(parsed_event, event)
 
     handler = route_request(parsed_event)
     response = handler.execute(parsed_event)
-    return render(response, pretty_print)
+    return render(response, event)
 
-def render(response, pretty_print):
+def render(response, event):
     logger.debug(f"Rendering response: {response}")
-    return {
-        "statusCode": response.http_status,
-        "body": json.dumps(response.body, indent=4 if pretty_print else None),
-    }
+    return render_response(response, event)
 
 def indexer(event, context):
     logger.info(f"Processing incoming event: {event}")
@@ -44,18 +32,8 @@ def publisher(event, context):
     changesets = parse_dynamodb_new_records(event, context)
     logger.debug(f"Event was parsed to: {changesets}")
 
-    changesets_topic_arn = os.getenv('ChangesetsTopic')
-    events_topic_arn = os.getenv('EventsTopic')
-    changesets_topic = SNS(changesets_topic_arn)
-    events_topic = SNS(events_topic_arn)
-    p = Publisher(changesets_topic, events_topic)
-    p.publish(changesets)
+    resources.publisher.publish(changesets)
 
 def analysis_projector(event, context):
-    events_table = os.getenv('EventStoreTable')
-    analysis_table = os.getenv('AnalysisTable')
-    db = DynamoDB(events_table, analysis_table)
-    global_changesets_handler = FetchGlobalChangesetsHandler(db)
-    projector = AnalysisProjector(db, global_changesets_handler)
-    projector.execute()
-    
\ No newline at end of file
+    remaining_time_ms = context.get_remaining_time_in_millis if context else None
+    resources.projections.execute(remaining_time_ms)
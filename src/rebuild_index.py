@@ -0,0 +1,45 @@
+import argparse
+import logging
+import sys
+
+from ees.app import resources
+from ees.handlers.index_rebuilder import GlobalIndexRebuilder
+from ees.model import ConcurrencyException
+
+# Verifies, and optionally repairs, the global index of the table configured
+# by the EventStoreTable (and GlobalIndexShards) environment variables:
+#   EventStoreTable=<events table> python rebuild_index.py --segments 32 --repair
+# Repairing can be done while the indexer is running. Compacting re-numbers
+# the changesets, which changes their checkpoints, and requires the indexer
+# to be stopped.
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Elastic Event Store global index verification and rebuild")
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repair", action="store_true")
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    rebuilder = GlobalIndexRebuilder(resources.db, resources.shards, args.segments, args.workers)
+    try:
+        if not args.repair and not args.compact:
+            (_, _, audit) = rebuilder.verify()
+            return 1 if rebuilder.has_issues(audit) else 0
+        (audit, conflicts) = rebuilder.execute(compact=args.compact)
+    except ValueError as e:
+        print(e)
+        return 1
+    except ConcurrencyException:
+        print("The global counter was concurrently updated, run the tool again")
+        return 1
+
+    if conflicts:
+        print(f"{len(conflicts)} changesets were concurrently indexed, run the tool again to verify them")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
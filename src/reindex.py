@@ -0,0 +1,33 @@
+import argparse
+import logging
+import sys
+
+from ees.app import resources
+from ees.handlers.reindexer import Reindexer, max_chunk_size
+
+# Re-indexes the enumeration index of the table configured by the
+# EventStoreTable (and GlobalIndexShards) environment variables:
+#   EventStoreTable=<events table> python reindex.py --page-size 5000
+# The global feed stays readable, and the indexer keeps running, while
+# the index is re-indexed. An interrupted run is resumed by running the
+# tool again with the same page size.
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Elastic Event Store enumeration index re-indexing")
+    parser.add_argument("--page-size", type=int, required=True)
+    parser.add_argument("--chunk-size", type=int, default=max_chunk_size)
+    args = parser.parse_args(argv)
+    if args.page_size <= 0:
+        parser.error("--page-size has to be a positive integer")
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        Reindexer(resources.db, resources.shards, args.chunk_size).execute(args.page_size)
+    except ValueError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+import bisect
+import zlib
+from botocore.exceptions import ClientError
+
+
+class TableSchema:
+    def __init__(self, hash_key, range_key=None, indexes=None):
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or { }
+
+    def key_attributes(self, index_name=None):
+        if index_name:
+            return self.indexes[index_name]
+        return (self.hash_key, self.range_key)
+
+
+events_table_schema = TableSchema(
+    'stream_id', 'changeset_id', {
+        'FirstEventId': ('stream_id', 'first_event_id'),
+        'LastEventId': ('stream_id', 'last_event_id'),
+        'EmumerationIndex': ('page', 'page_item')
+    })
+
+analysis_table_schema = TableSchema('projection_id')
+
+snapshots_table_schema = TableSchema('stream_id', 'changeset_id')
+
+
+def to_value(attribute):
+    (attribute_type, value) = next(iter(attribute.items()))
+    if attribute_type == 'N':
+        return int(value)
+    return value
+
+
+def item_size(item):
+    return sum(len(name) + len(str(value))
+               for name, attribute in item.items()
+               for value in attribute.values())
+
+
+class Highest:
+    # Sorts after any other value
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+highest = Highest()
+
+
+class Partition:
+    # Items sorted by their index range key, then by the primary key
+    def __init__(self):
+        self.sort_keys = []
+        self.items = []
+
+    def insert(self, sort_key, item):
+        i = bisect.bisect_right(self.sort_keys, sort_key)
+        self.sort_keys.insert(i, sort_key)
+        self.items.insert(i, item)
+
+    def remove(self, sort_key):
+        i = bisect.bisect_left(self.sort_keys, sort_key)
+        if i < len(self.sort_keys) and self.sort_keys[i] == sort_key:
+            del self.sort_keys[i]
+            del self.items[i]
+
+    def select(self, condition):
+        if not condition:
+            return self.items
+        operands = [to_value(v) for v in condition['AttributeValueList']]
+        operator = condition['ComparisonOperator']
+        start = 0
+        end = len(self.items)
+        if operator in ('EQ', 'GE', 'BETWEEN'):
+            start = bisect.bisect_left(self.sort_keys, (operands[0],))
+        if operator in ('EQ', 'LE'):
+            end = bisect.bisect_left(self.sort_keys, (operands[0], highest))
+        if operator == 'BETWEEN':
+            end = bisect.bisect_left(self.sort_keys, (operands[1], highest))
+        if operator not in ('EQ', 'GE', 'LE', 'BETWEEN'):
+            raise NotImplementedError(operator)
+        return self.items[start:end]
+
+
+class StubTable:
+    def __init__(self, schema):
+        self.schema = schema
+        self.items = { }
+        # index name (None for the table itself) -> hash value -> sorted list of items
+        self.partitions = { None: { } }
+        for index_name in schema.indexes:
+            self.partitions[index_name] = { }
+
+    def primary_key(self, item):
+        (hash_key, range_key) = self.schema.key_attributes()
+        if range_key:
+            return (to_value(item[hash_key]), to_value(item[range_key]))
+        return (to_value(item[hash_key]), None)
+
+    def get(self, key):
+        return self.items.get(self.primary_key(key))
+
+    def put(self, item):
+        key = self.primary_key(item)
+        if key in self.items:
+            self.unindex(self.items[key])
+        self.items[key] = item
+        self.index(item)
+
+    def sort_key(self, item, range_key):
+        if range_key:
+            return (to_value(item[range_key]), self.primary_key(item))
+        return (0, self.primary_key(item))
+
+    def index(self, item):
+        for index_name, partitions in self.partitions.items():
+            (hash_key, range_key) = self.schema.key_attributes(index_name)
+            if hash_key not in item or (range_key and range_key not in item):
+                continue
+            partition = partitions.setdefault(to_value(item[hash_key]), Partition())
+            partition.insert(self.sort_key(item, range_key), item)
+
+    def unindex(self, item):
+        for index_name, partitions in self.partitions.items():
+            (hash_key, range_key) = self.schema.key_attributes(index_name)
+            if hash_key not in item or (range_key and range_key not in item):
+                continue
+            partitions[to_value(item[hash_key])].remove(self.sort_key(item, range_key))
+
+
+class DynamoDBStub:
+    # A local stand-in for the low-level boto3 DynamoDB client. Supports the
+    # subset of the API used by ees.infrastructure.dynamodb, including query
+    # pagination: each page is capped at max_page_bytes, like DynamoDB's 1MB.
+    def __init__(self, tables, max_page_bytes=1024 * 1024):
+        self.tables = { name: StubTable(schema) for name, schema in tables.items() }
+        self.max_page_bytes = max_page_bytes
+        self.stream_records = { name: [] for name in tables }
+        self.calls = { }
+
+    def count_call(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def put_item(self, TableName, Item, Expected=None, **kwargs):
+        self.count_call('put_item')
+        table = self.tables[TableName]
+        self.check_expected(table.get(Item), Expected, 'PutItem')
+        is_new = table.get(Item) is None
+        table.put(dict(Item))
+        if is_new:
+            self.stream_records[TableName].append(self.make_stream_record(table, Item))
+        return { }
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self.count_call('transact_write_items')
+        reasons = []
+        for t in TransactItems:
+            (operation, request) = next(iter(t.items()))
+            key = request.get('Item') or request.get('Key')
+            existing = self.tables[request['TableName']].get(key)
+            if self.satisfies(existing, request.get('ConditionExpression'),
+                              request.get('ExpressionAttributeValues')):
+                reasons.append({ 'Code': 'None' })
+            else:
+                reasons.append({ 'Code': 'ConditionalCheckFailed' })
+
+        if any(r['Code'] != 'None' for r in reasons):
+            error = ClientError({
+                'Error': {
+                    'Code': 'TransactionCanceledException',
+                    'Message': 'Transaction cancelled'
+                }
+            }, 'TransactWriteItems')
+            error.response['CancellationReasons'] = reasons
+            raise error
+
+        for t in TransactItems:
+            if 'Put' in t:
+                self.put_item(t['Put']['TableName'], t['Put']['Item'])
+            else:
+                self.apply_update_expression(t['Update'])
+        return { }
+
+    def satisfies(self, existing, condition_expression, values=None):
+        # Supports conjunctions of attribute_exists(a), attribute_not_exists(a)
+        # and a = :value clauses
+        if not condition_expression:
+            return True
+        for clause in condition_expression.split(' AND '):
+            clause = clause.strip()
+            if clause.startswith('attribute_not_exists('):
+                attribute = clause[len('attribute_not_exists('):-1]
+                satisfied = existing is None or attribute not in existing
+            elif clause.startswith('attribute_exists('):
+                attribute = clause[len('attribute_exists('):-1]
+                satisfied = existing is not None and attribute in existing
+            elif ' = ' in clause:
+                (attribute, placeholder) = [p.strip() for p in clause.split(' = ')]
+                satisfied = existing is not None and existing.get(attribute) == values[placeholder]
+            else:
+                raise NotImplementedError(condition_expression)
+            if not satisfied:
+                return False
+        return True
+
+    def apply_update_expression(self, update):
+        # Supports SET a = :value, b = :value expressions
+        expression = update['UpdateExpression']
+        if not expression.startswith('SET '):
+            raise NotImplementedError(expression)
+        table = self.tables[update['TableName']]
+        item = dict(table.get(update['Key']) or update['Key'])
+        for assignment in expression[len('SET '):].split(','):
+            (attribute, placeholder) = [p.strip() for p in assignment.split('=')]
+            item[attribute] = update['ExpressionAttributeValues'][placeholder]
+        table.put(item)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.count_call('batch_get_item')
+        responses = { }
+        for table_name, request in RequestItems.items():
+            table = self.tables[table_name]
+            items = [table.get(key) for key in request['Keys']]
+            responses[table_name] = [self.project(item, request.get('ProjectionExpression'))
+                                     for item in items if item]
+        return { "Responses": responses, "UnprocessedKeys": { } }
+
+    def update_item(self, TableName, Key, AttributeUpdates, Expected=None, **kwargs):
+        self.count_call('update_item')
+        table = self.tables[TableName]
+        existing = table.get(Key)
+        self.check_expected(existing, Expected, 'UpdateItem')
+        item = dict(existing or Key)
+        for attribute, update in AttributeUpdates.items():
+            item[attribute] = update["Value"]
+        table.put(item)
+        return { }
+
+    def query(self, TableName, KeyConditions, IndexName=None, Limit=None,
+              ScanIndexForward=True, ExclusiveStartKey=None,
+              ProjectionExpression=None, **kwargs):
+        self.count_call('query')
+        table = self.tables[TableName]
+        (hash_key, range_key) = table.schema.key_attributes(IndexName)
+        hash_value = to_value(KeyConditions[hash_key]['AttributeValueList'][0])
+        partition = table.partitions[IndexName].get(hash_value)
+        candidates = partition.select(KeyConditions.get(range_key)) if partition else []
+        if not ScanIndexForward:
+            candidates = candidates[::-1]
+
+        if ExclusiveStartKey:
+            start_key = table.primary_key(ExclusiveStartKey)
+            for position, item in enumerate(candidates):
+                if table.primary_key(item) == start_key:
+                    candidates = candidates[position + 1:]
+                    break
+
+        items = []
+        page_bytes = 0
+        last_evaluated_key = None
+        for position, item in enumerate(candidates):
+            items.append(self.project(item, ProjectionExpression))
+            page_bytes += item_size(item)
+            reached_limit = Limit and len(items) >= Limit
+            if (reached_limit or page_bytes >= self.max_page_bytes) and \
+               (reached_limit or position + 1 < len(candidates)):
+                last_evaluated_key = self.key_of(table, item, IndexName)
+                break
+
+        response = { "Items": items, "Count": len(items) }
+        if last_evaluated_key:
+            response["LastEvaluatedKey"] = last_evaluated_key
+        return response
+
+    def scan(self, TableName, Segment=0, TotalSegments=1, Limit=None,
+             ExclusiveStartKey=None, ProjectionExpression=None, **kwargs):
+        # Items are assigned to segments by hashing their primary keys
+        self.count_call('scan')
+        table = self.tables[TableName]
+        candidates = [item for (key, item) in sorted(table.items.items(), key=lambda i: repr(i[0]))
+                      if zlib.crc32(repr(key).encode('utf-8')) % TotalSegments == Segment]
+
+        if ExclusiveStartKey:
+            start_key = table.primary_key(ExclusiveStartKey)
+            positions = [p for (p, item) in enumerate(candidates) if table.primary_key(item) == start_key]
+            candidates = candidates[positions[0] + 1:]
+
+        items = []
+        page_bytes = 0
+        last_evaluated_key = None
+        for position, item in enumerate(candidates):
+            items.append(self.project(item, ProjectionExpression))
+            page_bytes += item_size(item)
+            if ((Limit and len(items) >= Limit) or page_bytes >= self.max_page_bytes) and \
+               position + 1 < len(candidates):
+                last_evaluated_key = self.key_of(table, item, None)
+                break
+
+        response = { "Items": items, "Count": len(items) }
+        if last_evaluated_key:
+            response["LastEvaluatedKey"] = last_evaluated_key
+        return response
+
+    def project(self, item, projection_expression):
+        if not projection_expression:
+            return dict(item)
+        attributes = [a.strip() for a in projection_expression.split(',')]
+        return { a: item[a] for a in attributes if a in item }
+
+    def key_of(self, table, item, index_name):
+        attributes = set(table.schema.key_attributes()) | set(table.schema.key_attributes(index_name))
+        return { a: item[a] for a in attributes if a }
+
+    def check_expected(self, existing, expected, operation):
+        for attribute, condition in (expected or { }).items():
+            current = existing.get(attribute) if existing else None
+            if "Exists" in condition and not condition["Exists"]:
+                satisfied = current is None
+            else:
+                satisfied = current == condition["Value"]
+            if not satisfied:
+                raise ClientError({
+                    'Error': {
+                        'Code': 'ConditionalCheckFailedException',
+                        'Message': 'The conditional request failed'
+                    }
+                }, operation)
+
+    def make_stream_record(self, table, item):
+        (hash_key, range_key) = table.schema.key_attributes()
+        keys = { hash_key: item[hash_key] }
+        if range_key:
+            keys[range_key] = item[range_key]
+        return {
+            "eventName": "INSERT",
+            "dynamodb": {
+                "Keys": keys,
+                "NewImage": dict(item)
+            }
+        }
+
+    def take_stream_records(self, table_name):
+        records = self.stream_records[table_name]
+        self.stream_records[table_name] = []
+        return records
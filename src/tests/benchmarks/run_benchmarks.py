@@ -0,0 +1,236 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import lambda_entrypoint
+from ees import app
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema, snapshots_table_schema
+
+baselines_dir = os.path.join(os.path.dirname(__file__), 'baselines')
+
+# Relative slowdown of a scenario's p50 latency that is reported as a regression
+regression_threshold = 0.2
+
+
+def make_stub():
+    app.db.events_table = 'ees_db_benchmarks'
+    app.db.analysis_table = 'ees_analysis_benchmarks'
+    app.db.snapshots_table = 'ees_snapshots_benchmarks'
+    stub = DynamoDBStub({
+        app.db.events_table: events_table_schema,
+        app.db.analysis_table: analysis_table_schema,
+        app.db.snapshots_table: snapshots_table_schema
+    })
+    app.db.dynamodb_ll = stub
+    app.resources.stream_heads.clear()
+    return stub
+
+def make_events(count, payload_size):
+    return [{ "type": "benchmark", "data": "x" * payload_size } for _ in range(count)]
+
+def api_event(resource_path, path_parameters=None, query_string=None, body=None):
+    return {
+        "requestContext": { "resourcePath": resource_path },
+        "pathParameters": path_parameters,
+        "queryStringParameters": query_string,
+        "body": json.dumps(body) if body is not None else None
+    }
+
+def commit_event(stream_id, expected_last_changeset, events):
+    return api_event(
+        "/streams/{stream_id}",
+        { "stream_id": stream_id },
+        { "expected_last_changeset": str(expected_last_changeset) },
+        { "events": events, "metadata": { "issued_by": "benchmarks" } })
+
+def populate_stream(stream_id, length, events):
+    for i in range(length):
+        response = lambda_entrypoint.request_handler(commit_event(stream_id, i, events), None)
+        assert response["statusCode"] == 200, response
+
+def index_changesets(stub):
+    records = stub.take_stream_records(app.db.events_table)
+    for i in range(0, len(records), 10):
+        lambda_entrypoint.indexer({ "Records": records[i:i + 10] }, None)
+
+
+class Scenario:
+    def __init__(self, name, setup, run):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+
+def commit_scenario(stream_length, payload_size):
+    events = make_events(2, payload_size)
+    state = { }
+
+    def setup():
+        make_stub()
+        state["stream_id"] = str(uuid.uuid4())
+        state["next"] = stream_length
+        populate_stream(state["stream_id"], stream_length, events)
+
+    def run():
+        response = lambda_entrypoint.request_handler(
+            commit_event(state["stream_id"], state["next"], events), None)
+        assert response["statusCode"] == 200, response
+        state["next"] += 1
+
+    return Scenario(f"commit[stream={stream_length},payload={payload_size}]", setup, run)
+
+def stream_read_scenario(resource, stream_length, payload_size):
+    events = make_events(2, payload_size)
+    state = { }
+
+    def setup():
+        make_stub()
+        state["stream_id"] = str(uuid.uuid4())
+        populate_stream(state["stream_id"], stream_length, events)
+
+    def run():
+        response = lambda_entrypoint.request_handler(api_event(
+            "/streams/{stream_id}/" + resource,
+            { "stream_id": state["stream_id"] }), None)
+        assert response["statusCode"] == 200, response
+
+    return Scenario(f"read_{resource}[stream={stream_length},payload={payload_size}]", setup, run)
+
+def global_changesets_scenario(total_changesets, payload_size):
+    events = make_events(2, payload_size)
+    limit = 100
+
+    def setup():
+        stub = make_stub()
+        for i in range(total_changesets):
+            populate_stream(str(uuid.uuid4()), 1, events)
+        index_changesets(stub)
+
+    def run():
+        response = lambda_entrypoint.request_handler(api_event(
+            "/changesets", None, { "checkpoint": "0", "limit": str(limit) }), None)
+        assert response["statusCode"] == 200, response
+
+    return Scenario(f"global_changesets[changesets={total_changesets},payload={payload_size}]", setup, run)
+
+def analysis_projector_scenario(total_changesets, payload_size):
+    events = make_events(2, payload_size)
+
+    def setup():
+        stub = make_stub()
+        for i in range(total_changesets):
+            populate_stream(str(uuid.uuid4()), 1, events)
+        index_changesets(stub)
+
+    def run():
+        # Starts over from the beginning of the global feed on each run
+        stub = app.db.dynamodb_ll
+        stub.tables[app.db.analysis_table].items.clear()
+        stub.tables[app.db.analysis_table].partitions[None].clear()
+        lambda_entrypoint.analysis_projector({ }, None)
+
+    return Scenario(f"analysis_projector[changesets={total_changesets},payload={payload_size}]", setup, run)
+
+def make_scenarios(stream_lengths, payload_sizes):
+    scenarios = []
+    for length, payload in itertools.product(stream_lengths, payload_sizes):
+        scenarios.append(commit_scenario(length, payload))
+        scenarios.append(stream_read_scenario("changesets", length, payload))
+        scenarios.append(stream_read_scenario("events", length, payload))
+        scenarios.append(global_changesets_scenario(length, payload))
+        scenarios.append(analysis_projector_scenario(length, payload))
+    return scenarios
+
+
+def percentile(sorted_values, p):
+    return sorted_values[int(round(p * (len(sorted_values) - 1)))]
+
+def measure(scenario, iterations):
+    scenario.setup()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        scenario.run()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "ops_per_sec": iterations / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+def run_benchmarks(stream_lengths, payload_sizes, iterations, report=print):
+    results = { }
+    for scenario in make_scenarios(stream_lengths, payload_sizes):
+        results[scenario.name] = measure(scenario, iterations)
+        r = results[scenario.name]
+        report(f'{scenario.name:<60} {r["ops_per_sec"]:>10.1f} ops/s '
+               f'{r["p50_ms"]:>9.3f} ms p50 {r["p99_ms"]:>9.3f} ms p99')
+    return results
+
+def compare(results, baseline, report=print, normalize=False):
+    # The scenarios' absolute p50 changes are compared, so a uniform regression
+    # across all the scenarios is reported. On a machine other than the
+    # baseline's, normalize makes the changes relative to their geometric mean,
+    # reporting only the scenarios that slowed down relative to the others.
+    common = [name for name in results if name in baseline]
+    ratios = { name: results[name]["p50_ms"] / baseline[name]["p50_ms"] for name in common }
+    machine_factor = 1.0
+    if common and normalize:
+        machine_factor = math.exp(sum(math.log(r) for r in ratios.values()) / len(ratios))
+        report(f'{"machine speed factor":<60} {machine_factor:>8.2f}x p50 vs. baseline')
+
+    regressions = []
+    for name in common:
+        change = ratios[name] / machine_factor - 1
+        report(f'{name:<60} {change:>+8.1%} p50 vs. baseline')
+        if change > regression_threshold:
+            regressions.append(name)
+    return regressions
+
+def baseline_path(name):
+    return os.path.join(baselines_dir, f'{name}.json')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Elastic Event Store handler benchmarks")
+    parser.add_argument("--stream-lengths", default="10,100,1000")
+    parser.add_argument("--payload-sizes", default="100,10000")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--normalize", action="store_true",
+                        help="compare the timings relative to each other, when not on the baseline's machine")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        [int(l) for l in args.stream_lengths.split(",")],
+        [int(p) for p in args.payload_sizes.split(",")],
+        args.iterations)
+
+    if args.save_baseline:
+        os.makedirs(baselines_dir, exist_ok=True)
+        with open(baseline_path(args.save_baseline), 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            regressions = compare(results, json.load(f), normalize=args.normalize)
+        if regressions:
+            print(f"Regressions over {regression_threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -70,6 +70,13 @@ class ApiTestClient():
 
         return requests.post(url, json=payload)
     
+    def batch_commit(self, commits):
+        return requests.post(self.api_endpoint + 'commits', json={ "commits": commits })
+    
+    def commit_snapshot(self, stream_id, changeset_id, data):
+        url = self.api_endpoint + f'streams/{stream_id}/snapshots'
+        return requests.post(url, json={ "changeset_id": changeset_id, "data": data })
+    
     def query_changesets(self, stream_id, from_changeset=None, to_changeset=None):
         url = self.api_endpoint + f'streams/{stream_id}/changesets?&from={from_changeset or ""}&to={to_changeset or ""}'
         return requests.get(url)
@@ -0,0 +1,45 @@
+import pytest
+import uuid
+from unittest import TestCase
+from tests.integration.api_test_client import ApiTestClient
+
+
+@pytest.mark.slow
+class TestBatchCommit(TestCase):
+    api = None
+
+    def setUp(self) -> None:
+        self.api = self.api or ApiTestClient()
+        return super().setUp()
+
+    def test_commit_to_multiple_streams(self):
+        stream1 = str(uuid.uuid4())
+        stream2 = str(uuid.uuid4())
+        self.api.commit(stream_id=stream1, last_changeset_id=0, events=self.api.some_events)
+
+        response = self.api.batch_commit([
+            { "stream_id": stream1, "expected_last_changeset": 1, "events": self.api.some_events },
+            { "stream_id": stream2, "expected_last_changeset": 0, "events": self.api.some_events }
+        ])
+
+        assert response.status_code == 200
+        self.assertDictEqual(response.json(), {
+            "changesets": [
+                { "stream_id": stream1, "changeset_id": 2 },
+                { "stream_id": stream2, "changeset_id": 1 }
+            ]
+        })
+
+    def test_conflicting_batch_is_not_committed(self):
+        stream1 = str(uuid.uuid4())
+        stream2 = str(uuid.uuid4())
+        self.api.commit(stream_id=stream2, last_changeset_id=0, events=self.api.some_events)
+
+        response = self.api.batch_commit([
+            { "stream_id": stream1, "expected_last_changeset": 0, "events": self.api.some_events },
+            { "stream_id": stream2, "expected_last_changeset": 0, "events": self.api.some_events }
+        ])
+
+        assert response.status_code == 409
+        assert [c["stream_id"] for c in response.json()["conflicts"]] == [stream2]
+        assert self.api.query_changesets(stream1).status_code == 404
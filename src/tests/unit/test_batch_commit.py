@@ -0,0 +1,90 @@
+import botocore
+from unittest import TestCase
+from unittest.mock import Mock
+
+from .context import ees
+from ees.commands import BatchCommit, Commit
+from ees.handlers.batch_commit import BatchCommitHandler
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import BatchConcurrencyException, make_initial_commit, make_next_commit
+
+
+class TestBatchCommit(TestCase):
+    def setUp(self):
+        self.db = InMemoryStorage()
+        self.db.append(make_initial_commit("aaa", [{ "type": "init" }]))
+        self.db.append(make_initial_commit("bbb", [{ "type": "init" }]))
+
+    def test_commit_to_multiple_streams(self):
+        response = BatchCommitHandler(self.db).execute(BatchCommit([
+            Commit("aaa", 1, None, [{ "type": "update" }], { }),
+            Commit("bbb", None, 1, [{ "type": "update" }], { }),
+            Commit("ccc", 0, None, [{ "type": "init" }], { })
+        ]))
+
+        assert response.http_status == 200
+        assert response.body["changesets"] == [
+            { "stream_id": "aaa", "changeset_id": 2 },
+            { "stream_id": "bbb", "changeset_id": 2 },
+            { "stream_id": "ccc", "changeset_id": 1 }
+        ]
+        assert self.db.fetch_last_commit("bbb").first_event_id == 2
+
+    def test_outdated_expectation_rejects_the_whole_batch(self):
+        response = BatchCommitHandler(self.db).execute(BatchCommit([
+            Commit("aaa", 1, None, [{ "type": "update" }], { }),
+            Commit("bbb", 0, None, [{ "type": "init" }], { })
+        ]))
+
+        assert response.http_status == 409
+        assert [c["stream_id"] for c in response.body["conflicts"]] == ["bbb"]
+        assert response.body["conflicts"][0]["forthcoming_changesets"][0]["changeset_id"] == 1
+        assert self.db.fetch_last_commit("aaa").changeset_id == 1
+
+    def test_conflicts_detected_by_the_transaction(self):
+        racing_commit = make_next_commit(self.db.fetch_last_commit("bbb"), [{ "type": "race" }])
+        original_append_batch = self.db.append_batch
+        def append_batch_after_race(commits):
+            self.db.append(racing_commit)
+            original_append_batch(commits)
+        self.db.append_batch = append_batch_after_race
+
+        response = BatchCommitHandler(self.db).execute(BatchCommit([
+            Commit("aaa", 1, None, [{ "type": "update" }], { }),
+            Commit("bbb", 1, None, [{ "type": "update" }], { })
+        ]))
+
+        assert response.http_status == 409
+        assert [c["stream_id"] for c in response.body["conflicts"]] == ["bbb"]
+        assert self.db.fetch_last_commit("aaa").changeset_id == 1
+
+    def test_invalid_expectation(self):
+        response = BatchCommitHandler(self.db).execute(BatchCommit([
+            Commit("aaa", 5, None, [{ "type": "update" }], { }),
+            Commit("bbb", 0, None, [{ "type": "init" }], { })
+        ]))
+
+        assert response.http_status == 400
+        assert [e["error"] for e in response.body["errors"]] == ["INVALID_EXPECTED_CHANGESET_ID"]
+
+
+class TestTransactionalAppend(TestCase):
+    def test_cancellation_reasons_are_mapped_to_conflicts(self):
+        error = botocore.exceptions.ClientError({
+            'Error': { 'Code': 'TransactionCanceledException', 'Message': '' },
+            'CancellationReasons': [{ 'Code': 'None' }, { 'Code': 'ConditionalCheckFailed' }]
+        }, 'TransactWriteItems')
+        db = DynamoDB("events", "analysis")
+        db.dynamodb_ll = Mock()
+        db.dynamodb_ll.transact_write_items.side_effect = error
+
+        with self.assertRaises(BatchConcurrencyException) as e:
+            db.append_batch([
+                make_initial_commit("aaa", [{ "type": "init" }]),
+                make_initial_commit("bbb", [{ "type": "init" }])
+            ])
+
+        assert [(c.stream_id, c.changeset_id) for c in e.exception.conflicts] == [("bbb", 1)]
+        items = db.dynamodb_ll.transact_write_items.call_args[1]["TransactItems"]
+        assert [i["Put"]["Item"]["stream_id"]["S"] for i in items] == ["aaa", "bbb"]
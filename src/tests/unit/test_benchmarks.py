@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from .context import ees
+from tests.benchmarks import run_benchmarks
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema
+
+
+class TestBenchmarks(TestCase):
+    def test_all_scenarios_run(self):
+        results = run_benchmarks.run_benchmarks([3], [10], 2, report=lambda line: None)
+
+        assert len(results) == 5
+        for r in results.values():
+            assert r["ops_per_sec"] > 0
+
+    def test_comparing_to_baseline(self):
+        results = { "a": { "p50_ms": 1.5 }, "b": { "p50_ms": 1.0 } }
+        baseline = { "a": { "p50_ms": 1.0 }, "b": { "p50_ms": 1.0 } }
+
+        regressions = run_benchmarks.compare(results, baseline, report=lambda line: None)
+
+        assert regressions == ["a"]
+
+    def test_uniform_slowdown_is_a_regression(self):
+        results = { "a": { "p50_ms": 3.0 }, "b": { "p50_ms": 6.0 } }
+        baseline = { "a": { "p50_ms": 1.0 }, "b": { "p50_ms": 2.0 } }
+
+        assert run_benchmarks.compare(results, baseline, report=lambda line: None) == ["a", "b"]
+        assert run_benchmarks.compare(results, baseline, report=lambda line: None, normalize=True) == []
+
+    def test_normalized_relative_slowdown_is_a_regression(self):
+        results = { "a": { "p50_ms": 4.5 }, "b": { "p50_ms": 3.0 } }
+        baseline = { "a": { "p50_ms": 1.0 }, "b": { "p50_ms": 1.0 } }
+
+        assert run_benchmarks.compare(results, baseline, report=lambda line: None, normalize=True) == ["a"]
+
+    def test_stub_paginates_queries(self):
+        stub = DynamoDBStub({ "events": events_table_schema }, max_page_bytes=100)
+        for i in range(1, 4):
+            stub.put_item(TableName="events", Item={
+                "stream_id": { "S": "aaa" },
+                "changeset_id": { "N": str(i) },
+                "events": { "S": "x" * 100 }
+            })
+
+        query = dict(TableName="events", KeyConditions={
+            "stream_id": { "AttributeValueList": [{ "S": "aaa" }], "ComparisonOperator": "EQ" }
+        })
+        first_page = stub.query(**query)
+        second_page = stub.query(ExclusiveStartKey=first_page["LastEvaluatedKey"], **query)
+
+        assert first_page["Count"] == 1
+        assert second_page["Items"][0]["changeset_id"] == { "N": "2" }
@@ -17,6 +17,11 @@ def test_commit(mocker):
     handler = app.route_request(cmd)
     assert isinstance(handler, CommitHandler)
 
+def test_batch_commit(mocker):
+    cmd = BatchCommit([Commit("1", 2, None, [], [])])
+    handler = app.route_request(cmd)
+    assert isinstance(handler, BatchCommitHandler)
+
 def test_fetch_changesets(mocker):
     cmd = FetchStreamChangesets("1", None, None)
     handler = app.route_request(cmd)
@@ -32,6 +37,11 @@ def test_fetch_global_changesets(mocker):
     handler = app.route_request(cmd)    
     assert isinstance(handler, FetchGlobalChangesetsHandler)
 
+def test_fetch_global_events(mocker):
+    cmd = FetchGlobalEvents((0, 0), None)
+    handler = app.route_request(cmd)
+    assert isinstance(handler, FetchGlobalEventsHandler)
+
 def test_invalid_endpoint(mocker):
     cmd = "something-else"
     handler = app.route_request(cmd)
@@ -41,3 +51,13 @@ def test_assign_global_indexes(mocker):
     cmd = AssignGlobalIndexes([])
     handler = app.route_request(cmd)    
     assert isinstance(handler, GlobalIndexer)
+
+def test_commit_snapshot(mocker):
+    cmd = CommitSnapshot("1", 1, { })
+    handler = app.route_request(cmd)
+    assert isinstance(handler, CommitSnapshotHandler)
+
+def test_handlers_are_reused_across_requests(mocker):
+    cmd = Commit("1", 2, None, [], [])
+    assert app.route_request(cmd) is app.route_request(cmd)
+    assert app.route_request(cmd).db is app.db
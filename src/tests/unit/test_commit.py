@@ -0,0 +1,72 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from .context import ees
+from ees.commands import Commit
+from ees.handlers.commit import CommitHandler, StreamHeadCache
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import make_initial_commit
+
+
+class TestCommit(TestCase):
+    def setUp(self):
+        self.db = InMemoryStorage()
+        self.stream_heads = StreamHeadCache()
+        self.handler = CommitHandler(self.db, self.stream_heads)
+
+    def commit(self, stream_id, expected_last_changeset=None, expected_last_event=None, events=None):
+        return self.handler.execute(Commit(
+            stream_id, expected_last_changeset, expected_last_event,
+            events or [{ "type": "e" }], { }))
+
+    def test_appending_after_known_head_skips_read(self):
+        self.commit("aaa", 0, events=[{ "type": "e1" }, { "type": "e2" }])
+
+        with patch.object(self.db, 'fetch_last_commit', wraps=self.db.fetch_last_commit) as fetch:
+            response = self.commit("aaa", 1)
+            response = self.commit("aaa", expected_last_event=3)
+
+        assert fetch.call_count == 0
+        assert response.http_status == 200
+        assert response.body["changeset_id"] == 3
+        last = self.db.fetch_last_commit("aaa")
+        assert (last.first_event_id, last.last_event_id) == (4, 4)
+
+    def test_unknown_head_is_read_without_payloads(self):
+        self.db.append(make_initial_commit("aaa", [{ "type": "e1" }]))
+
+        with patch.object(self.db, 'fetch_last_commit', wraps=self.db.fetch_last_commit) as fetch:
+            response = self.commit("aaa", 1)
+
+        assert response.http_status == 200
+        fetch.assert_called_once_with("aaa", meta_only=True)
+        assert self.stream_heads.get("aaa").changeset_id == 2
+
+    def test_outdated_head_results_in_concurrency_exception(self):
+        self.commit("aaa", 0)
+        # Another instance appends to the stream
+        CommitHandler(self.db).execute(Commit("aaa", 1, None, [{ "type": "e" }], { }))
+
+        response = self.commit("aaa", 1)
+
+        assert response.http_status == 409
+        assert [c["changeset_id"] for c in response.body["forthcoming_changesets"]] == [2]
+
+    def test_missing_expected_changeset(self):
+        self.commit("aaa", 0)
+
+        response = self.commit("aaa", 5)
+
+        assert response.http_status == 400
+        assert response.body["error"] == "INVALID_EXPECTED_CHANGESET_ID"
+
+    def test_cache_evicts_least_recently_used_streams(self):
+        cache = StreamHeadCache(max_streams=2)
+        cache.put(make_initial_commit("aaa", [{ }]))
+        cache.put(make_initial_commit("bbb", [{ }]))
+        cache.get("aaa")
+        cache.put(make_initial_commit("ccc", [{ }]))
+
+        assert cache.get("aaa")
+        assert cache.get("bbb") is None
+        assert cache.get("ccc").events is None
@@ -0,0 +1,137 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import FetchStreamChangesets, FetchStreamEvents
+from ees.handlers.changesets import FetchChangesetsHandler
+from ees.handlers.events import FetchEventsHandler
+from ees.infrastructure.aws_lambda import render_response
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import etag_matches, make_initial_commit, make_next_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema, \
+                                           snapshots_table_schema
+
+
+class ConditionalReadsTests:
+    def setUp(self):
+        self.db = self.make_db()
+        self.head = make_initial_commit("aaa", [{ "type": "init" }, { "type": "add" }])
+        self.db.append(self.head)
+        self.changesets = FetchChangesetsHandler(self.db)
+        self.events = FetchEventsHandler(self.db)
+
+    def append(self, events):
+        self.head = make_next_commit(self.head, events)
+        self.db.append(self.head)
+
+    def test_unchanged_stream_is_not_modified(self):
+        etag = self.changesets.execute(FetchStreamChangesets("aaa", None, None)).headers["ETag"]
+
+        response = self.changesets.execute(FetchStreamChangesets("aaa", None, None, if_none_match=etag))
+        assert response.http_status == 304
+        assert response.body is None
+        assert response.headers["ETag"] == etag
+
+    def test_changed_stream_is_read(self):
+        etag = self.changesets.execute(FetchStreamChangesets("aaa", None, None)).headers["ETag"]
+        self.append([{ "type": "remove" }])
+
+        response = self.changesets.execute(FetchStreamChangesets("aaa", None, None, if_none_match=etag))
+        assert response.http_status == 200
+        assert len(response.body["changesets"]) == 2
+        assert response.headers["ETag"] != etag
+
+    def test_etag_depends_on_the_requested_range(self):
+        etag = self.changesets.execute(FetchStreamChangesets("aaa", None, None)).headers["ETag"]
+        response = self.changesets.execute(FetchStreamChangesets("aaa", 1, 1, if_none_match=etag))
+        assert response.http_status == 200
+
+    def test_full_pages_are_not_modified_by_later_commits(self):
+        self.append([{ "type": "remove" }])
+        etag = self.changesets.execute(FetchStreamChangesets("aaa", 1, None, 1)).headers["ETag"]
+        self.append([{ "type": "add" }])
+        response = self.changesets.execute(FetchStreamChangesets("aaa", 1, None, 1, if_none_match=etag))
+        assert response.http_status == 304
+
+        etag = self.events.execute(FetchStreamEvents("aaa", 2, 3)).headers["ETag"]
+        self.append([{ "type": "remove" }])
+        response = self.events.execute(FetchStreamEvents("aaa", 2, 3, if_none_match=etag))
+        assert response.http_status == 304
+
+    def test_commit_during_a_read_is_not_hidden(self):
+        fetch = self.db.fetch_stream_changesets
+        def fetch_then_commit(*args, **kwargs):
+            result = fetch(*args, **kwargs)
+            if self.head.changeset_id == 1:
+                self.append([{ "type": "remove" }])
+            return result
+        self.db.fetch_stream_changesets = fetch_then_commit
+
+        response = self.changesets.execute(FetchStreamChangesets("aaa", None, 2))
+        assert len(response.body["changesets"]) == 1
+        response = self.changesets.execute(FetchStreamChangesets("aaa", None, 2,
+                                                                 if_none_match=response.headers["ETag"]))
+        assert response.http_status == 200
+        assert len(response.body["changesets"]) == 2
+
+    def test_events_etag_ignores_changesets_without_events(self):
+        etag = self.events.execute(FetchStreamEvents("aaa", None, None)).headers["ETag"]
+        self.append([])
+        response = self.events.execute(FetchStreamEvents("aaa", None, None, if_none_match=etag))
+        assert response.http_status == 304
+
+        self.append([{ "type": "remove" }])
+        response = self.events.execute(FetchStreamEvents("aaa", None, None, if_none_match=etag))
+        assert response.http_status == 200
+        assert [e["id"] for e in response.body["events"]] == [1, 2, 3]
+
+    def test_snapshot_reads_have_no_etag(self):
+        response = self.events.execute(FetchStreamEvents("aaa", None, None, from_snapshot=True))
+        assert response.headers is None
+
+    def test_missing_stream_with_if_none_match(self):
+        response = self.changesets.execute(FetchStreamChangesets("bbb", None, None, if_none_match="*"))
+        assert response.http_status == 404
+
+
+class TestInMemoryConditionalReads(ConditionalReadsTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+class TestDynamoDBConditionalReads(ConditionalReadsTests, TestCase):
+    def make_db(self):
+        self.stub = DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema,
+            'snapshots': snapshots_table_schema
+        })
+        return DynamoDB('events', 'analysis', 'snapshots', client=self.stub)
+
+    def test_not_modified_costs_a_single_query(self):
+        etag = self.changesets.execute(FetchStreamChangesets("aaa", None, None)).headers["ETag"]
+        self.stub.calls.clear()
+        self.changesets.execute(FetchStreamChangesets("aaa", None, None, if_none_match=etag))
+        assert sum(self.stub.calls.values()) == 1
+
+    def test_reads_without_if_none_match_dont_query_the_head(self):
+        self.append([{ "type": "remove" }])
+        self.stub.calls.clear()
+        self.changesets.execute(FetchStreamChangesets("aaa", 1, None, 1))
+        self.events.execute(FetchStreamEvents("aaa", 1, None, 1))
+        assert sum(self.stub.calls.values()) == 2
+
+
+def test_matching_etags():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"xyz", "abc-gzip"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+
+def test_not_modified_is_rendered_without_body():
+    from ees.model import Response
+    rendered = render_response(Response(304, None, { "ETag": '"abc"' }), { })
+    assert rendered["statusCode"] == 304
+    assert rendered["body"] == ""
+    assert rendered["headers"]["ETag"] == '"abc"'
@@ -0,0 +1,107 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from .context import ees
+from ees.commands import FetchStreamChangesets
+from ees.handlers.changesets import FetchChangesetsHandler
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.model import CommitData, make_continuation_token, parse_continuation_token
+
+
+def make_changeset(stream_id, changeset_id):
+    return CommitData(stream_id, changeset_id, { }, [{ "type": "init" }],
+                      changeset_id, changeset_id, None, None)
+
+def make_item(stream_id, changeset_id):
+    return {
+        "stream_id": { "S": stream_id },
+        "changeset_id": { "N": str(changeset_id) },
+        "first_event_id": { "N": str(changeset_id) },
+        "last_event_id": { "N": str(changeset_id) },
+        "events": { "S": "[]" },
+        "metadata": { "S": "{}" }
+    }
+
+
+class TestFetchingStreamChangesets(TestCase):
+    def test_unlimited_read_has_no_continuation_token(self):
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset("aaa", 100)
+        db.fetch_stream_changesets.return_value = [make_changeset("aaa", 1), make_changeset("aaa", 2)]
+
+        response = FetchChangesetsHandler(db).execute(FetchStreamChangesets("aaa", None, None))
+
+        assert response.http_status == 200
+        assert "continuation_token" not in response.body
+        assert [c["changeset_id"] for c in response.body["changesets"]] == [1, 2]
+
+    def test_full_page_returns_continuation_token(self):
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset("aaa", 100)
+        db.fetch_stream_changesets.return_value = [make_changeset("aaa", 3), make_changeset("aaa", 4)]
+
+        response = FetchChangesetsHandler(db).execute(FetchStreamChangesets("aaa", 3, None, 2))
+
+        db.fetch_stream_changesets.assert_called_with("aaa", from_changeset=3, to_changeset=None, limit=2, payload=None)
+        token = response.body["continuation_token"]
+        assert parse_continuation_token("aaa", "changeset", token) == 5
+
+    def test_partial_page_ends_the_iteration(self):
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset("aaa", 100)
+        db.fetch_stream_changesets.return_value = [make_changeset("aaa", 3)]
+
+        response = FetchChangesetsHandler(db).execute(FetchStreamChangesets("aaa", 3, None, 2))
+
+        assert response.body["continuation_token"] is None
+
+    def test_page_reaching_upper_boundary_ends_the_iteration(self):
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset("aaa", 100)
+        db.fetch_stream_changesets.return_value = [make_changeset("aaa", 3), make_changeset("aaa", 4)]
+
+        response = FetchChangesetsHandler(db).execute(FetchStreamChangesets("aaa", 3, 4, 2))
+
+        assert response.body["continuation_token"] is None
+
+    def test_token_is_bound_to_stream(self):
+        token = make_continuation_token("aaa", "changeset", 5)
+        with self.assertRaises(Exception):
+            parse_continuation_token("bbb", "changeset", token)
+        with self.assertRaises(Exception):
+            parse_continuation_token("aaa", "event", token)
+        with self.assertRaises(Exception):
+            parse_continuation_token("aaa", "changeset", "garbage")
+
+
+class TestPaginatedStreamQueries(TestCase):
+    def test_following_last_evaluated_key(self):
+        db = DynamoDB("events", "analysis")
+        db.dynamodb_ll = Mock()
+        db.dynamodb_ll.query.side_effect = [
+            { "Items": [make_item("aaa", 1), make_item("aaa", 2)], "Count": 2,
+              "LastEvaluatedKey": { "stream_id": { "S": "aaa" }, "changeset_id": { "N": "2" } } },
+            { "Items": [make_item("aaa", 3)], "Count": 1 }
+        ]
+
+        changesets = db.fetch_stream_changesets("aaa")
+
+        assert [c.changeset_id for c in changesets] == [1, 2, 3]
+        second_query = db.dynamodb_ll.query.call_args_list[1][1]
+        assert second_query["ExclusiveStartKey"] == { "stream_id": { "S": "aaa" }, "changeset_id": { "N": "2" } }
+
+    def test_limit_is_spread_across_pages(self):
+        db = DynamoDB("events", "analysis")
+        db.dynamodb_ll = Mock()
+        db.dynamodb_ll.query.side_effect = [
+            { "Items": [make_item("aaa", 1)], "Count": 1,
+              "LastEvaluatedKey": { "stream_id": { "S": "aaa" }, "changeset_id": { "N": "1" } } },
+            { "Items": [make_item("aaa", 2), make_item("aaa", 3)], "Count": 2,
+              "LastEvaluatedKey": { "stream_id": { "S": "aaa" }, "changeset_id": { "N": "3" } } }
+        ]
+
+        changesets = db.fetch_stream_changesets("aaa", limit=3)
+
+        assert [c.changeset_id for c in changesets] == [1, 2, 3]
+        assert db.dynamodb_ll.query.call_count == 2
+        assert db.dynamodb_ll.query.call_args_list[1][1]["Limit"] == 2
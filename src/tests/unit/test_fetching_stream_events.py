@@ -0,0 +1,106 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from .context import ees
+from ees.commands import FetchStreamEvents
+from ees.handlers.events import FetchEventsHandler
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.model import CommitData, parse_continuation_token
+
+
+def make_changeset(changeset_id, first_event_id, events_count):
+    events = [{ "n": first_event_id + i } for i in range(events_count)]
+    return CommitData("aaa", changeset_id, { }, events, first_event_id,
+                      first_event_id + events_count - 1, None, None)
+
+def stream_of_changesets(total, on_exhausted=None):
+    for i in range(total):
+        yield make_changeset(i + 1, i * 2 + 1, 2)
+    if on_exhausted:
+        on_exhausted()
+
+
+class TestFetchingStreamEvents(TestCase):
+    def test_clipping_events_range(self):
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset(100, 199, 2)
+        db.iterate_stream_by_events.return_value = stream_of_changesets(3)
+
+        response = FetchEventsHandler(db).execute(FetchStreamEvents("aaa", 2, 5))
+
+        assert [e["id"] for e in response.body["events"]] == [2, 3, 4, 5]
+        assert "continuation_token" not in response.body
+
+    def test_changesets_are_consumed_lazily(self):
+        def fail():
+            raise AssertionError("The stream should not be read to its end")
+
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset(100, 199, 2)
+        db.iterate_stream_by_events.return_value = stream_of_changesets(100, fail)
+
+        response = FetchEventsHandler(db).execute(FetchStreamEvents("aaa", 1, 6))
+
+        assert [e["id"] for e in response.body["events"]] == [1, 2, 3, 4, 5, 6]
+
+    def test_limit_and_continuation_token(self):
+        db = Mock()
+        db.fetch_last_commit.return_value = make_changeset(100, 199, 2)
+        db.iterate_stream_by_events.return_value = stream_of_changesets(100)
+
+        response = FetchEventsHandler(db).execute(FetchStreamEvents("aaa", 4, None, 3))
+
+        db.iterate_stream_by_events.assert_called_with("aaa", from_event=4, to_event=None, page_size=3, payload=None)
+        assert [e["id"] for e in response.body["events"]] == [4, 5, 6]
+        token = response.body["continuation_token"]
+        assert parse_continuation_token("aaa", "event", token) == 7
+
+    def test_stream_not_found(self):
+        db = Mock()
+        db.iterate_stream_by_events.return_value = iter([])
+        db.fetch_last_commit.return_value = None
+
+        response = FetchEventsHandler(db).execute(FetchStreamEvents("aaa", None, None))
+
+        assert response.http_status == 404
+
+
+class TestIteratingStreamByEvents(TestCase):
+    def make_item(self, changeset_id, first_event_id, last_event_id):
+        return {
+            "stream_id": { "S": "aaa" },
+            "changeset_id": { "N": str(changeset_id) },
+            "first_event_id": { "N": str(first_event_id) },
+            "last_event_id": { "N": str(last_event_id) },
+            "events": { "S": "[]" },
+            "metadata": { "S": "{}" }
+        }
+
+    def test_range_query_starts_after_the_first_changeset(self):
+        db = DynamoDB("events", "analysis")
+        db.dynamodb_ll = Mock()
+        db.dynamodb_ll.query.side_effect = [
+            { "Items": [self.make_item(2, 3, 4)], "Count": 1 },
+            { "Items": [self.make_item(3, 5, 6)], "Count": 1 }
+        ]
+
+        changesets = list(db.iterate_stream_by_events("aaa", 3, 6))
+
+        assert [c.changeset_id for c in changesets] == [2, 3]
+        range_query = db.dynamodb_ll.query.call_args_list[1][1]
+        assert range_query["KeyConditions"]["first_event_id"]["AttributeValueList"][0] == { "N": "5" }
+
+    def test_pages_are_fetched_on_demand(self):
+        db = DynamoDB("events", "analysis")
+        db.dynamodb_ll = Mock()
+        db.dynamodb_ll.query.side_effect = [
+            { "Items": [self.make_item(1, 1, 2)], "Count": 1,
+              "LastEvaluatedKey": { "stream_id": { "S": "aaa" }, "changeset_id": { "N": "1" } } },
+            { "Items": [self.make_item(2, 3, 4)], "Count": 1 }
+        ]
+
+        changesets = db.iterate_stream_by_events("aaa", 1, None, page_size=1)
+        next(changesets)
+
+        assert db.dynamodb_ll.query.call_count == 1
+        assert db.dynamodb_ll.query.call_args[1]["Limit"] == 1
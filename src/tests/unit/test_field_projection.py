@@ -0,0 +1,97 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets, FetchStreamChangesets, FetchStreamEvents
+from ees.handlers.changesets import FetchChangesetsHandler
+from ees.handlers.events import FetchEventsHandler
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, make_initial_commit, make_next_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class FieldProjectionTests:
+    def setUp(self):
+        self.db = self.make_db()
+        commit = make_initial_commit("orders-1", [{ "type": "init" }, { "type": "add" }], { "user": "a" })
+        self.db.append(commit)
+        self.db.append(make_next_commit(commit, [{ "type": "remove" }], { "user": "b" }))
+        commit = make_initial_commit("users-1", [{ "type": "init" }], { "user": "c" })
+        self.db.append(commit)
+        GlobalIndexer(self.db).execute(AssignGlobalIndexes([
+            { "stream_id": "orders-1", "changeset_id": 1 },
+            { "stream_id": "orders-1", "changeset_id": 2 },
+            { "stream_id": "users-1", "changeset_id": 1 }]))
+
+    def test_stream_changesets_fields(self):
+        response = FetchChangesetsHandler(self.db).execute(
+            FetchStreamChangesets("orders-1", None, None, 1, fields=("changeset_id", "metadata")))
+
+        assert response.body["changesets"] == [{ "changeset_id": 1, "metadata": { "user": "a" } }]
+        assert response.body["continuation_token"]
+
+    def test_stream_events_ids_only(self):
+        response = FetchEventsHandler(self.db).execute(
+            FetchStreamEvents("orders-1", 2, None, 2, fields=("id",)))
+
+        assert response.body["events"] == [{ "id": 2 }, { "id": 3 }]
+
+    def test_stream_events_all_fields(self):
+        response = FetchEventsHandler(self.db).execute(
+            FetchStreamEvents("orders-1", 3, None, fields=("id", "data")))
+
+        assert response.body["events"] == [{ "id": 3, "data": { "type": "remove" } }]
+
+    def test_global_changesets_positions(self):
+        response = FetchGlobalChangesetsHandler(self.db).execute(
+            FetchGlobalChangesets(0, 10, fields=("stream_id", "changeset_id", "checkpoint")))
+
+        assert response.body["changesets"] == [
+            { "stream_id": "orders-1", "changeset_id": 1, "checkpoint": 0 },
+            { "stream_id": "orders-1", "changeset_id": 2, "checkpoint": 1 },
+            { "stream_id": "users-1", "changeset_id": 1, "checkpoint": 2 }]
+        assert response.body["next_checkpoint"] == 3
+
+    def test_filtering_by_type_without_events_field(self):
+        response = FetchGlobalChangesetsHandler(self.db).execute(
+            FetchGlobalChangesets(0, 10, event_type=("remove",), fields=("checkpoint",)))
+
+        assert response.body["changesets"] == [{ "checkpoint": 1 }]
+
+
+class TestInMemoryFieldProjection(FieldProjectionTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+class TestDynamoDBFieldProjection(FieldProjectionTests, TestCase):
+    def make_db(self):
+        stub = DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        })
+        self.queries = []
+        query = stub.query
+        def recording_query(**kwargs):
+            self.queries.append(kwargs)
+            return query(**kwargs)
+        stub.query = recording_query
+        return DynamoDB('events', 'analysis', client=stub)
+
+    def test_payload_columns_are_not_read(self):
+        self.queries.clear()
+        FetchEventsHandler(self.db).execute(FetchStreamEvents("orders-1", None, None, fields=("id",)))
+        FetchGlobalChangesetsHandler(self.db).execute(FetchGlobalChangesets(0, 10, fields=("metadata",)))
+
+        projections = [q.get("ProjectionExpression") for q in self.queries if "IndexName" in q]
+        assert projections
+        assert all(p and "events" not in p for p in projections)
+        assert any("metadata" in p for p in projections)
+
+    def test_all_columns_are_read_by_default(self):
+        self.queries.clear()
+        FetchChangesetsHandler(self.db).execute(FetchStreamChangesets("orders-1", None, None))
+        assert self.queries[0]["Select"] == "ALL_ATTRIBUTES"
+        assert "ProjectionExpression" not in self.queries[0]
@@ -0,0 +1,127 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalEvents
+from ees.handlers.global_events import FetchGlobalEventsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, make_initial_commit, make_next_commit, parse_event_checkpoint
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class GlobalEventsTests:
+    shards = GlobalShards()
+
+    def setUp(self):
+        self.db = self.make_db()
+        self.handler = FetchGlobalEventsHandler(self.db, self.shards)
+        # Changesets of 1, 2 and 3 events
+        self.events = []
+        keys = []
+        for i in range(6):
+            stream_id = f"stream-{i}"
+            commit = make_initial_commit(stream_id, [{ "n": n } for n in range(i % 3 + 1)])
+            self.db.append(commit)
+            commit = make_next_commit(commit, [{ "n": n } for n in range(2)])
+            self.db.append(commit)
+            keys.extend([(stream_id, 1), (stream_id, 2)])
+        GlobalIndexer(self.db, self.shards).execute(AssignGlobalIndexes([
+            { "stream_id": s, "changeset_id": c } for (s, c) in keys]))
+        self.total_events = sum(i % 3 + 1 + 2 for i in range(6))
+
+    def start(self):
+        return (0, 0) if self.shards.count == 1 else [(0, 0)] * self.shards.count
+
+    def parse(self, checkpoint):
+        positions = [parse_event_checkpoint(c) for c in checkpoint.split(",")]
+        return positions if len(positions) > 1 else positions[0]
+
+    def read_all(self, limit):
+        checkpoint = self.start()
+        result = []
+        while True:
+            response = self.handler.execute(FetchGlobalEvents(checkpoint, limit))
+            assert response.http_status == 200
+            events = response.body["events"]
+            assert len(events) <= limit
+            if not events:
+                return result
+            result.extend(events)
+            checkpoint = self.parse(response.body["next_checkpoint"])
+
+    def test_reading_the_feed_in_events(self):
+        events = self.read_all(limit=4)
+
+        assert len(events) == self.total_events
+        keys = [(e["stream_id"], e["event_id"]) for e in events]
+        assert len(set(keys)) == len(keys)
+        for stream_id in set(s for (s, _) in keys):
+            ids = [i for (s, i) in keys if s == stream_id]
+            assert ids == list(range(1, len(ids) + 1))
+
+    def test_partial_changesets_are_sliced(self):
+        response = self.handler.execute(FetchGlobalEvents(self.start(), 3))
+        events = response.body["events"]
+        assert len(events) == 3
+
+        # The next page starts with the rest of the cut changeset
+        checkpoint = self.parse(response.body["next_checkpoint"])
+        following = self.handler.execute(FetchGlobalEvents(checkpoint, 100)).body["events"]
+        keys = [(e["stream_id"], e["event_id"]) for e in events + following]
+        assert len(set(keys)) == len(keys)
+
+    def test_empty_feed_tail(self):
+        checkpoint = self.start()
+        while True:
+            response = self.handler.execute(FetchGlobalEvents(checkpoint, 100))
+            if not response.body["events"]:
+                break
+            checkpoint = self.parse(response.body["next_checkpoint"])
+        assert self.parse(response.body["next_checkpoint"]) == checkpoint
+
+
+class TestInMemoryGlobalEvents(GlobalEventsTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+    def test_starting_in_the_middle_of_a_changeset(self):
+        response = self.handler.execute(FetchGlobalEvents((1, 1), 2))
+        events = response.body["events"]
+        assert [(e["checkpoint"], e["event_id"]) for e in events] == [("1.1", 3), ("2.0", 1)]
+        assert response.body["checkpoint"] == "1.1"
+        assert response.body["next_checkpoint"] == "2.1"
+
+    def test_events_follow_the_changesets_order(self):
+        events = self.handler.execute(FetchGlobalEvents((0, 0), 4)).body["events"]
+        assert [(e["stream_id"], e["event_id"], e["checkpoint"]) for e in events] == [
+            ("stream-0", 1, "0.0"), ("stream-0", 2, "1.0"), ("stream-0", 3, "1.1"), ("stream-1", 1, "2.0")]
+
+    def test_last_event_of_a_changeset_moves_to_the_next_changeset(self):
+        response = self.handler.execute(FetchGlobalEvents((1, 0), 2))
+        assert response.body["next_checkpoint"] == "2.0"
+
+
+class TestDynamoDBGlobalEvents(GlobalEventsTests, TestCase):
+    def make_db(self):
+        return DynamoDB('events', 'analysis', client=DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        }))
+
+
+class TestShardedGlobalEvents(GlobalEventsTests, TestCase):
+    shards = GlobalShards(3)
+
+    def make_db(self):
+        return InMemoryStorage()
+
+    def test_reading_a_single_shard(self):
+        response = self.handler.execute(FetchGlobalEvents((0, 0), 100, 1))
+        assert response.body["shard"] == 1
+        assert all(self.shards.shard_of(e["stream_id"]) == 1 for e in response.body["events"])
+
+    def test_invalid_vector_checkpoint(self):
+        response = self.handler.execute(FetchGlobalEvents([(0, 0), (0, 0)], 10))
+        assert response.http_status == 400
+        assert response.body["error"] == "INVALID_CHECKPOINT"
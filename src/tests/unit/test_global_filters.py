@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets
+from ees.handlers import global_changesets
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, make_initial_commit, parse_vector_checkpoint
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class GlobalFiltersTests:
+    shards = GlobalShards()
+
+    def setUp(self):
+        self.db = self.make_db()
+        self.handler = FetchGlobalChangesetsHandler(self.db, self.shards)
+        keys = []
+        for i in range(30):
+            stream_id = f"orders-{i}" if i % 3 == 0 else f"users-{i}"
+            self.db.append(make_initial_commit(stream_id, [{ "type": "init" }, { "type": f"type-{i % 5}" }]))
+            keys.append({ "stream_id": stream_id, "changeset_id": 1 })
+        GlobalIndexer(self.db, self.shards).execute(AssignGlobalIndexes(keys))
+
+    def read_feed(self, limit, **filters):
+        checkpoint = 0 if self.shards.count == 1 else [0] * self.shards.count
+        result = []
+        while True:
+            response = self.handler.execute(FetchGlobalChangesets(checkpoint, limit, **filters))
+            changesets = response.body["changesets"]
+            assert len(changesets) <= limit
+            result.extend(changesets)
+            if response.body["next_checkpoint"] == response.body["checkpoint"]:
+                return result
+            checkpoint = response.body["next_checkpoint"]
+            if isinstance(checkpoint, str):
+                checkpoint = parse_vector_checkpoint(checkpoint)
+
+    def test_filtering_by_stream_prefix(self):
+        changesets = self.read_feed(3, stream_prefix=("orders-",))
+        assert sorted(c["stream_id"] for c in changesets) == sorted(f"orders-{i}" for i in range(0, 30, 3))
+
+    def test_filtering_by_event_type(self):
+        changesets = self.read_feed(4, event_type=("type-1", "type-2"))
+        assert len(changesets) == 12
+        assert all(len(c["events"]) == 1 for c in changesets)
+        assert all(c["events"][0]["type"] in ("type-1", "type-2") for c in changesets)
+
+    def test_combined_filters(self):
+        changesets = self.read_feed(10, stream_prefix=("orders-",), event_type=("type-0",))
+        assert sorted(c["stream_id"] for c in changesets) == ["orders-0", "orders-15"]
+
+    def test_limit_is_counted_in_matching_changesets(self):
+        cmd = FetchGlobalChangesets(0 if self.shards.count == 1 else [0] * self.shards.count, 5,
+                                    stream_prefix=("users-",))
+        assert len(self.handler.execute(cmd).body["changesets"]) == 5
+
+    def test_unfiltered_feed_is_not_affected(self):
+        assert len(self.read_feed(7)) == 30
+
+    def test_scanning_is_bounded(self):
+        max_scanned = global_changesets.max_scanned_changesets
+        global_changesets.max_scanned_changesets = 2
+        try:
+            cmd = FetchGlobalChangesets(0 if self.shards.count == 1 else [0] * self.shards.count, 1,
+                                        stream_prefix=("none-",))
+            response = self.handler.execute(cmd)
+        finally:
+            global_changesets.max_scanned_changesets = max_scanned
+        assert response.body["changesets"] == []
+        assert response.body["next_checkpoint"] != response.body["checkpoint"]
+
+
+class TestInMemoryGlobalFilters(GlobalFiltersTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+class TestDynamoDBGlobalFilters(GlobalFiltersTests, TestCase):
+    def make_db(self):
+        return DynamoDB('events', 'analysis', client=DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        }))
+
+
+class TestShardedGlobalFilters(GlobalFiltersTests, TestCase):
+    shards = GlobalShards(3)
+
+    def make_db(self):
+        return InMemoryStorage()
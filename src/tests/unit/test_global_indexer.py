@@ -0,0 +1,175 @@
+import json
+import pytest
+from unittest import TestCase
+
+from .context import ees
+from datetime import datetime, timedelta
+from ees.commands import AssignGlobalIndexes, Stats
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.stats import StatsHandler
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.model import ConcurrencyException, GlobalCounter, make_initial_commit, make_next_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class TestGlobalIndexer(TestCase):
+    def setUp(self):
+        self.stub = DynamoDBStub({ 'events': events_table_schema, 'analysis': analysis_table_schema })
+        self.db = DynamoDB('events', 'analysis', client=self.stub)
+        self.indexer = GlobalIndexer(self.db)
+
+    def append(self, stream_id, count=1):
+        commit = make_initial_commit(stream_id, [{ "type": "e" }])
+        self.db.append(commit)
+        for _ in range(count - 1):
+            commit = make_next_commit(commit, [{ "type": "e" }])
+            self.db.append(commit)
+
+    def index(self, *keys):
+        self.indexer.execute(AssignGlobalIndexes([
+            { "stream_id": s, "changeset_id": c } for (s, c) in keys]))
+
+    def checkpoints(self, *keys):
+        indexes = self.db.get_global_index_values(list(keys))
+        return [self.db.checkpoint_calc.to_checkpoint(indexes[k].page, indexes[k].page_item)
+                for k in keys]
+
+    def test_batch_is_indexed_with_one_transaction(self):
+        keys = [(f"stream-{i}", 1) for i in range(10)]
+        for (s, _) in keys:
+            self.append(s)
+        self.stub.calls.clear()
+
+        self.index(*keys)
+
+        assert self.stub.calls["transact_write_items"] == 1
+        assert self.stub.calls["batch_get_item"] == 1
+        assert self.checkpoints(*keys) == list(range(10))
+        counter = self.db.get_global_counter()
+        assert (counter.page_item, counter.prev_stream_id, counter.prev_changeset_id) == (9, "stream-9", 1)
+
+    def test_unindexed_predecessors_are_indexed_first(self):
+        self.append("aaa", 3)
+        self.append("bbb", 1)
+
+        self.index(("bbb", 1), ("aaa", 3))
+
+        assert self.checkpoints(("bbb", 1), ("aaa", 1), ("aaa", 2), ("aaa", 3)) == [0, 1, 2, 3]
+
+    def test_reindexing_is_a_noop(self):
+        self.append("aaa", 2)
+        self.index(("aaa", 1), ("aaa", 2))
+        self.stub.calls.clear()
+
+        self.index(("aaa", 1), ("aaa", 2))
+
+        assert "transact_write_items" not in self.stub.calls
+        assert self.checkpoints(("aaa", 1), ("aaa", 2)) == [0, 1]
+
+    def test_counter_ahead_of_written_index_is_repaired(self):
+        self.append("aaa", 1)
+        self.append("bbb", 1)
+        # A crash between incrementing the counter and writing the index
+        counter = self.db.get_global_counter()
+        self.db.update_global_counter(counter, GlobalCounter(0, 0, "aaa", 1))
+
+        self.index(("aaa", 1), ("bbb", 1))
+
+        assert self.checkpoints(("aaa", 1), ("bbb", 1)) == [0, 1]
+
+    def test_stale_counter_fails_without_writes(self):
+        self.append("aaa", 1)
+        self.append("bbb", 1)
+        self.index(("aaa", 1))
+        stale = GlobalCounter(0, -1, "", 0)
+
+        with pytest.raises(ConcurrencyException):
+            self.indexer.reserve_range(stale, [("bbb", 1)])
+
+        assert self.db.get_global_index_value("bbb", 1).page is None
+
+    def test_long_gap_is_found_with_ranged_query(self):
+        self.append("aaa", 2500)
+        self.index(("aaa", 1))
+        self.stub.calls.clear()
+
+        self.index(("aaa", 2500))
+
+        # 2499 unindexed changesets are read in 3 pages of 1000 items,
+        # plus reading the counter and verifying its last assigned index
+        assert self.stub.calls["query"] == 3 + 2
+        assert self.stub.calls["transact_write_items"] == 26
+        assert self.checkpoints(("aaa", 2), ("aaa", 1500), ("aaa", 2500)) == [1, 1499, 2499]
+
+    def test_gaps_in_multiple_streams(self):
+        self.append("aaa", 3)
+        self.append("bbb", 3)
+        self.index(("aaa", 1))
+
+        self.index(("bbb", 3), ("aaa", 3))
+
+        assert self.checkpoints(("bbb", 1), ("bbb", 2), ("bbb", 3),
+                                ("aaa", 2), ("aaa", 3)) == [1, 2, 3, 4, 5]
+
+    def test_lag_is_recorded(self):
+        self.append("aaa", 3)
+        self.append("bbb", 1)
+        now = datetime(2021, 2, 1, 12, 0, 0)
+        times = iter([now, now + timedelta(milliseconds=100)])
+        self.indexer.clock = lambda: next(times)
+
+        self.indexer.execute(AssignGlobalIndexes([
+            { "stream_id": "aaa", "changeset_id": 3, "timestamp": "2021-02-01T11:59:59.000000Z" },
+            { "stream_id": "bbb", "changeset_id": 1, "timestamp": "2021-02-01T11:59:59.500000Z" }]))
+
+        state = self.db.get_indexer_state()
+        assert state.timestamp == "2021-02-01T12:00:00.100000Z"
+        # The unindexed predecessors of aaa/3 are counted, but have no commit timestamps
+        assert state.last_batch_indexed_changesets == 4
+        assert state.last_batch_oldest_record_age_ms == 1000
+        assert (state.last_batch_average_latency_ms, state.last_batch_max_latency_ms) == (850, 1100)
+
+        response = StatsHandler(self.db).execute(Stats())
+        assert response.body["indexer"]["last_batch_indexed_changesets"] == 4
+        assert response.body["indexer"]["last_batch_max_latency_ms"] == 1100
+
+    def test_state_recorded_by_a_previous_version_is_ignored(self):
+        self.stub.put_item(TableName="analysis", Item={
+            "projection_id": { "S": "indexer_state" },
+            "proj_state": { "S": json.dumps({ "timestamp": "2021-02-01T12:00:00Z", "unindexed_changesets": 4,
+                                              "oldest_unindexed_age_ms": 0, "average_latency_ms": 0,
+                                              "max_latency_ms": 0 }) }
+        })
+
+        assert self.db.get_indexer_state() is None
+        assert "indexer" not in StatsHandler(self.db).execute(Stats()).body
+
+    def test_changeset_missing_from_the_batch_read_fails_the_batch(self):
+        self.append("aaa", 2)
+        batch_get_item = self.stub.batch_get_item
+        def omitting_aaa_2(RequestItems, **kwargs):
+            response = batch_get_item(RequestItems, **kwargs)
+            response["Responses"]["events"] = [i for i in response["Responses"]["events"]
+                                               if (i["stream_id"]["S"], i["changeset_id"]["N"]) != ("aaa", "2")]
+            return response
+        self.stub.batch_get_item = omitting_aaa_2
+
+        with pytest.raises(ValueError):
+            self.index(("aaa", 2))
+        assert self.db.get_global_counter().page_item == -1
+
+        self.stub.batch_get_item = batch_get_item
+        self.index(("aaa", 2))
+        assert self.checkpoints(("aaa", 1), ("aaa", 2)) == [0, 1]
+
+    def test_index_values_are_read_consistently(self):
+        self.append("aaa")
+        batch_get_item = self.stub.batch_get_item
+        requests = []
+        def recording(RequestItems, **kwargs):
+            requests.append(RequestItems)
+            return batch_get_item(RequestItems, **kwargs)
+        self.stub.batch_get_item = recording
+
+        self.index(("aaa", 1))
+        assert all(r["events"]["ConsistentRead"] for r in requests)
@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler, max_wait
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, make_initial_commit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = 0
+        self.on_sleep = None
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.sleeps += 1
+        if self.on_sleep:
+            self.on_sleep(self.sleeps)
+
+
+class CountingStorage(InMemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.fetches = 0
+
+    def fetch_global_changesets(self, *args, **kwargs):
+        self.fetches += 1
+        return super().fetch_global_changesets(*args, **kwargs)
+
+
+class LongPollingTests:
+    shards = GlobalShards()
+
+    def setUp(self):
+        self.db = CountingStorage()
+        self.clock = FakeClock()
+        self.indexer = GlobalIndexer(self.db, self.shards)
+        self.handler = FetchGlobalChangesetsHandler(self.db, self.shards, self.clock, self.clock.sleep)
+        self.streams = 0
+        self.add_stream()
+
+    def add_stream(self):
+        stream_id = f"stream-{self.streams}"
+        self.streams += 1
+        self.db.append(make_initial_commit(stream_id, [{ "type": "init" }]))
+        self.indexer.execute(AssignGlobalIndexes([{ "stream_id": stream_id, "changeset_id": 1 }]))
+
+    def head_checkpoint(self):
+        response = self.handler.execute(FetchGlobalChangesets(self.start(), 100))
+        return response.body["next_checkpoint"]
+
+    def start(self):
+        return 0 if self.shards.count == 1 else [0] * self.shards.count
+
+    def test_returns_immediately_when_changesets_exist(self):
+        response = self.handler.execute(FetchGlobalChangesets(self.start(), 10, None, 10))
+        assert len(response.body["changesets"]) == 1
+        assert self.clock.sleeps == 0
+
+    def test_times_out_at_the_head(self):
+        checkpoint = self.checkpoint_of(self.head_checkpoint())
+        fetches = self.db.fetches
+        response = self.handler.execute(FetchGlobalChangesets(checkpoint, 10, None, 2))
+
+        assert response.http_status == 200
+        assert response.body["changesets"] == []
+        assert self.clock.now == 2
+        # Only the counters are polled while there are no new changesets
+        assert self.db.fetches - fetches == self.shards.count
+
+    def test_returns_new_changesets_once_indexed(self):
+        checkpoint = self.checkpoint_of(self.head_checkpoint())
+        self.clock.on_sleep = lambda n: n == 3 and self.add_stream()
+        response = self.handler.execute(FetchGlobalChangesets(checkpoint, 10, None, 10))
+
+        assert [c["stream_id"] for c in response.body["changesets"]] == ["stream-1"]
+        assert self.clock.now < 1
+
+    def test_wait_is_limited(self):
+        checkpoint = self.checkpoint_of(self.head_checkpoint())
+        self.handler.execute(FetchGlobalChangesets(checkpoint, 10, None, 600))
+        assert self.clock.now == max_wait
+
+
+class TestLongPolling(LongPollingTests, TestCase):
+    def checkpoint_of(self, next_checkpoint):
+        return next_checkpoint
+
+
+class TestShardedLongPolling(LongPollingTests, TestCase):
+    shards = GlobalShards(3)
+
+    def checkpoint_of(self, next_checkpoint):
+        return [int(c) for c in next_checkpoint.split(",")]
@@ -0,0 +1,141 @@
+import sys
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler, complete_cache_control
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.reindexer import Reindexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.page_cache import GlobalPageCache
+from ees.model import make_initial_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class TestGlobalPageCache(TestCase):
+    def setUp(self):
+        self.stub = DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        })
+        self.queried_pages = []
+        query = self.stub.query
+        def recording_query(**kwargs):
+            if kwargs.get("IndexName") == "EmumerationIndex":
+                self.queried_pages.append(int(kwargs["KeyConditions"]["page"]["AttributeValueList"][0]["N"]))
+            return query(**kwargs)
+        self.stub.query = recording_query
+
+        self.cache = GlobalPageCache(1024 * 1024)
+        self.db = DynamoDB('events', 'analysis', client=self.stub, page_cache=self.cache)
+        # Small pages, so that the feed spans many of them
+        Reindexer(self.db).execute(5)
+        self.streams = 0
+        self.add_streams(42)
+        self.handler = FetchGlobalChangesetsHandler(self.db)
+
+    def add_streams(self, count):
+        keys = []
+        for i in range(self.streams, self.streams + count):
+            self.db.append(make_initial_commit(f"stream-{i}", [{ "type": "init" }]))
+            keys.append({ "stream_id": f"stream-{i}", "changeset_id": 1 })
+        self.streams += count
+        GlobalIndexer(self.db).execute(AssignGlobalIndexes(keys))
+
+    def read_feed(self, limit=7):
+        checkpoint = 0
+        result = []
+        while True:
+            changesets = self.db.fetch_global_changesets(checkpoint, limit)
+            if not changesets:
+                return result
+            result.extend(c.stream_id for c in changesets)
+            checkpoint += len(changesets)
+
+    def test_replay_reads_only_the_incomplete_pages(self):
+        feed = self.read_feed()
+        self.queried_pages.clear()
+
+        assert self.read_feed() == feed
+        assert len(feed) == 42
+        # Positions 40 and 41 are on the 9th page
+        assert set(self.queried_pages) == { 8 }
+        assert self.cache.hits > 0
+
+    def test_incomplete_pages_are_not_cached(self):
+        self.read_feed()
+        self.add_streams(6)
+        feed = self.read_feed()
+        assert feed == [f"stream-{i}" for i in range(48)]
+
+    def test_cached_pages_are_not_used_after_reindexing(self):
+        feed = self.read_feed()
+        Reindexer(self.db).execute(7)
+        self.queried_pages.clear()
+
+        assert self.read_feed() == feed
+        assert 0 in self.queried_pages
+
+    def test_projected_payload_of_cached_pages(self):
+        self.read_feed()
+        changesets = self.db.fetch_global_changesets(0, 3, payload=["metadata"])
+        assert [c.events for c in changesets] == [None] * 3
+
+    def test_complete_responses_are_cacheable(self):
+        response = self.handler.execute(FetchGlobalChangesets(0, 7))
+        assert response.headers["Cache-Control"] == complete_cache_control
+        etag = response.headers["ETag"]
+
+        assert self.handler.execute(FetchGlobalChangesets(0, 7)).headers["ETag"] == etag
+        assert self.handler.execute(FetchGlobalChangesets(1, 7)).headers["ETag"] != etag
+        assert self.handler.execute(FetchGlobalChangesets(0, 7, fields=("checkpoint",))).headers["ETag"] != etag
+
+    def test_repairing_the_index_changes_the_etags(self):
+        etag = self.handler.execute(FetchGlobalChangesets(0, 7)).headers["ETag"]
+
+        # As the rebuilder does after moving changesets
+        settings = self.db.get_index_settings()
+        self.db.update_index_settings(settings, settings._replace(version=settings.version + 1))
+
+        response = self.handler.execute(FetchGlobalChangesets(0, 7))
+        assert "immutable" not in response.headers["Cache-Control"]
+        assert response.headers["ETag"] != etag
+
+    def test_responses_at_the_head_are_not_cacheable(self):
+        assert self.handler.execute(FetchGlobalChangesets(40, 7)).headers is None
+        assert self.handler.execute(FetchGlobalChangesets(0, 7, stream_prefix=("stream-",))).headers is None
+
+    def test_cached_size_bounds_the_pages_footprint(self):
+        self.read_feed()
+        pages = list(self.cache.pages.values())
+
+        assert pages
+        assert sum(footprint(items) for (items, _) in pages) <= self.cache.size
+
+
+def footprint(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(footprint(k) + footprint(v) for k, v in value.items())
+    elif isinstance(value, list):
+        size += sum(footprint(v) for v in value)
+    return size
+
+
+def test_least_recently_used_pages_are_evicted():
+    cache = GlobalPageCache(25)
+    cache.put("a", ["a"], 10)
+    cache.put("b", ["b"], 10)
+    cache.get("a")
+    cache.put("c", ["c"], 10)
+
+    assert cache.get("a") == ["a"]
+    assert cache.get("b") is None
+    assert cache.get("c") == ["c"]
+    assert cache.size == 20
+
+def test_pages_exceeding_the_cache_are_not_cached():
+    cache = GlobalPageCache(5)
+    cache.put("a", ["a"], 10)
+    assert cache.get("a") is None
+    assert cache.size == 0
@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.reindexer import Reindexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.model import make_initial_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class TestGlobalPrefetch(TestCase):
+    def setUp(self):
+        self.stub = DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        })
+        self.db = DynamoDB('events', 'analysis', client=self.stub)
+        # Small pages, so that the feed spans many of them
+        Reindexer(self.db).execute(5)
+        keys = []
+        for i in range(42):
+            self.db.append(make_initial_commit(f"stream-{i}", [{ "type": "init" }]))
+            keys.append({ "stream_id": f"stream-{i}", "changeset_id": 1 })
+        GlobalIndexer(self.db).execute(AssignGlobalIndexes(keys))
+        self.prefetching = DynamoDB('events', 'analysis', client=self.stub, prefetch_pages=3)
+
+    def read(self, db, checkpoint, limit):
+        return [(c.stream_id, c.page, c.page_item) for c in db.fetch_global_changesets(checkpoint, limit)]
+
+    def test_prefetched_pages_are_merged_in_order(self):
+        for (checkpoint, limit) in [(0, 100), (0, 12), (3, 7), (38, 10), (42, 10)]:
+            assert self.read(self.prefetching, checkpoint, limit) == self.read(self.db, checkpoint, limit)
+
+    def test_read_ahead_is_bounded(self):
+        self.stub.calls.clear()
+        changesets = self.prefetching.fetch_global_changesets(0, 12)
+
+        assert len(changesets) == 12
+        # 3 pages are consumed, up to 3 more are read ahead, plus
+        # the index settings reads
+        assert self.stub.calls["query"] <= 3 + 3 + 2
@@ -0,0 +1,133 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets
+from ees.handlers.analysis_projector import statistics_projection
+from ees.handlers.projections import ProjectionsEngine
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, make_initial_commit, make_next_commit, parse_vector_checkpoint
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class ShardedIndexTests:
+    shards = GlobalShards(3)
+
+    def setUp(self):
+        self.db = self.make_db()
+        self.indexer = GlobalIndexer(self.db, self.shards)
+        self.handler = FetchGlobalChangesetsHandler(self.db, self.shards)
+        self.keys = []
+        for i in range(20):
+            commit = make_initial_commit(f"stream-{i}", [{ "type": "init" }])
+            self.db.append(commit)
+            self.db.append(make_next_commit(commit, [{ "type": "update" }]))
+            self.keys.extend([(f"stream-{i}", 1), (f"stream-{i}", 2)])
+        self.indexer.execute(AssignGlobalIndexes([
+            { "stream_id": s, "changeset_id": c } for (s, c) in self.keys]))
+
+    def test_shards_are_enumerated_independently(self):
+        for shard in range(self.shards.count):
+            response = self.handler.execute(FetchGlobalChangesets(0, 100, shard))
+
+            changesets = response.body["changesets"]
+            assert changesets
+            assert all(self.shards.shard_of(c["stream_id"]) == shard for c in changesets)
+            assert [c["checkpoint"] for c in changesets] == list(range(len(changesets)))
+            assert response.body["next_checkpoint"] == len(changesets)
+
+    def test_reading_all_shards_with_vector_checkpoint(self):
+        checkpoint = 0
+        read = []
+        while True:
+            response = self.handler.execute(FetchGlobalChangesets(checkpoint, 7))
+            if not response.body["changesets"]:
+                break
+            assert len(response.body["changesets"]) <= 7
+            read.extend((c["stream_id"], c["changeset_id"]) for c in response.body["changesets"])
+            checkpoint = parse_vector_checkpoint(response.body["next_checkpoint"])
+
+        assert sorted(read) == sorted(self.keys)
+        for stream_id in set(s for (s, _) in read):
+            assert [c for (s, c) in read if s == stream_id] == [1, 2]
+
+    def test_shards_are_read_for_their_share_of_the_limit(self):
+        requested = self.record_requested_limits()
+        response = self.handler.execute(FetchGlobalChangesets(0, 7))
+
+        assert len(response.body["changesets"]) == 7
+        assert requested == [3, 3, 3]
+
+    def test_shards_with_changesets_are_topped_up(self):
+        heads = [self.handler.execute(FetchGlobalChangesets(0, 100, shard)).body["next_checkpoint"]
+                 for shard in range(self.shards.count)]
+        requested = self.record_requested_limits()
+        response = self.handler.execute(FetchGlobalChangesets([heads[0], 0, 0], 7))
+
+        assert len(response.body["changesets"]) == 7
+        assert all(c["shard"] != 0 for c in response.body["changesets"])
+        assert requested == [3, 3, 3, 1, 1]
+        next_checkpoint = parse_vector_checkpoint(response.body["next_checkpoint"])
+        assert next_checkpoint[0] == heads[0]
+        assert sum(next_checkpoint[1:]) == 7
+
+    def record_requested_limits(self):
+        requested = []
+        fetch_global_changesets = self.db.fetch_global_changesets
+        def recording(checkpoint, limit, *args, **kwargs):
+            requested.append(limit)
+            return fetch_global_changesets(checkpoint, limit, *args, **kwargs)
+        self.db.fetch_global_changesets = recording
+        return requested
+
+    def test_projecting_analysis_over_shards(self):
+        for _ in range(2):
+            ProjectionsEngine(self.db, self.handler, [statistics_projection(self.db, self.shards)],
+                              self.shards).execute()
+
+        state = self.db.get_analysis_state()
+        assert state.total_streams == 20
+        assert state.total_changesets == 40
+        assert state.version == 40
+        assert len(parse_vector_checkpoint(state.checkpoint)) == 3
+
+    def test_invalid_shard(self):
+        response = self.handler.execute(FetchGlobalChangesets(0, 10, 3))
+        assert response.http_status == 400
+        assert response.body["error"] == "INVALID_SHARD"
+
+    def test_invalid_vector_checkpoint(self):
+        response = self.handler.execute(FetchGlobalChangesets([0, 0], 10))
+        assert response.http_status == 400
+        assert response.body["error"] == "INVALID_CHECKPOINT"
+
+
+class TestShardedDynamoDBIndex(ShardedIndexTests, TestCase):
+    def make_db(self):
+        return DynamoDB('events', 'analysis', client=DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        }))
+
+    def test_each_shard_has_its_own_counter(self):
+        counters = [self.db.get_global_counter(shard) for shard in range(self.shards.count)]
+        assert sum(c.page_item + 1 for c in counters) == len(self.keys)
+
+
+class TestShardedInMemoryIndex(ShardedIndexTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+def test_streams_are_assigned_to_shards_by_hash():
+    shards = GlobalShards(4)
+    assert shards.shard_of("aaa") == shards.shard_of("aaa")
+    assert set(shards.shard_of(f"stream-{i}") for i in range(100)) == { 0, 1, 2, 3 }
+    assert GlobalShards().shard_of("aaa") == 0
+
+def test_shard_pages_are_interleaved():
+    shards = GlobalShards(4)
+    assert shards.index_page(2, 5) == 22
+    assert shards.shard_page(22) == 5
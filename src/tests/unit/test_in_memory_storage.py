@@ -0,0 +1,95 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import *
+from ees.handlers.analysis_projector import statistics_projection
+from ees.handlers.projections import ProjectionsEngine
+from ees.handlers.changesets import FetchChangesetsHandler
+from ees.handlers.commit import CommitHandler
+from ees.handlers.events import FetchEventsHandler
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.infrastructure.storage import StorageEngine
+from ees.model import ConcurrencyException, GlobalCounter, GlobalIndex, make_initial_commit
+
+
+class TestInMemoryStorage(TestCase):
+    def setUp(self):
+        self.db = InMemoryStorage()
+
+    def commit(self, stream_id, expected_last_changeset, events):
+        return CommitHandler(self.db).execute(
+            Commit(stream_id, expected_last_changeset, None, events, { }))
+
+    def test_implements_storage_engine(self):
+        assert isinstance(self.db, StorageEngine)
+
+    def test_append_and_read_changesets(self):
+        self.commit("aaa", 0, [{ "type": "init" }])
+        self.commit("aaa", 1, [{ "type": "update" }, { "type": "delete" }])
+
+        response = FetchChangesetsHandler(self.db).execute(FetchStreamChangesets("aaa", 2, None))
+
+        assert response.body["changesets"] == [{
+            "changeset_id": 2,
+            "events": [{ "type": "update" }, { "type": "delete" }],
+            "metadata": { }
+        }]
+
+    def test_concurrency_conflict(self):
+        self.commit("aaa", 0, [{ "type": "init" }])
+
+        response = self.commit("aaa", 0, [{ "type": "init" }])
+
+        assert response.http_status == 409
+        with self.assertRaises(ConcurrencyException):
+            self.db.append(make_initial_commit("aaa", [{ "type": "init" }]))
+
+    def test_read_events_range(self):
+        self.commit("aaa", 0, [{ "n": 1 }, { "n": 2 }])
+        self.commit("aaa", 1, [{ "n": 3 }, { "n": 4 }])
+        self.commit("aaa", 2, [{ "n": 5 }])
+
+        response = FetchEventsHandler(self.db).execute(FetchStreamEvents("aaa", 2, 4))
+
+        assert [e["data"]["n"] for e in response.body["events"]] == [2, 3, 4]
+
+    def test_global_counter_conditions(self):
+        counter = self.db.get_global_counter()
+        self.db.update_global_counter(counter, GlobalCounter(0, 0, "aaa", 1))
+
+        with self.assertRaises(ConcurrencyException):
+            self.db.update_global_counter(counter, GlobalCounter(0, 0, "bbb", 1))
+
+    def test_global_indexing_and_enumeration(self):
+        self.commit("aaa", 0, [{ "type": "init" }])
+        self.commit("bbb", 0, [{ "type": "init" }])
+        self.commit("aaa", 1, [{ "type": "update" }])
+
+        GlobalIndexer(self.db).execute(AssignGlobalIndexes([
+            { "stream_id": "aaa", "changeset_id": 2 },
+            { "stream_id": "bbb", "changeset_id": 1 }
+        ]))
+
+        response = FetchGlobalChangesetsHandler(self.db).execute(FetchGlobalChangesets(0, 10))
+        assert [(c["stream_id"], c["changeset_id"], c["checkpoint"]) for c in response.body["changesets"]] == [
+            ("aaa", 1, 0),
+            ("aaa", 2, 1),
+            ("bbb", 1, 2)
+        ]
+        assert response.body["next_checkpoint"] == 3
+
+        with self.assertRaises(ConcurrencyException):
+            self.db.set_global_index(GlobalIndex("aaa", 1, 0, 5))
+
+    def test_analysis_projection(self):
+        self.commit("aaa", 0, [{ "type": "init" }, { "type": "set" }])
+        self.commit("aaa", 1, [{ "type": "update" }])
+        GlobalIndexer(self.db).execute(AssignGlobalIndexes([{ "stream_id": "aaa", "changeset_id": 2 }]))
+
+        ProjectionsEngine(self.db, FetchGlobalChangesetsHandler(self.db), [statistics_projection(self.db)]).execute()
+
+        state = self.db.get_analysis_state()
+        assert (state.total_streams, state.total_changesets, state.total_events, state.max_stream_length, state.version) == \
+               (1, 2, 3, 2, 2)
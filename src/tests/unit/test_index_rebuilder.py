@@ -0,0 +1,193 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import pytest
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.index_rebuilder import GlobalIndexRebuilder
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, make_initial_commit, make_next_commit, parse_vector_checkpoint
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class IndexRebuilderTests:
+    shards = GlobalShards()
+
+    def setUp(self):
+        self.db = self.make_db()
+        self.keys = []
+        for i in range(10):
+            commit = make_initial_commit(f"stream-{i}", [{ "type": "init" }])
+            self.db.append(commit)
+            self.db.append(make_next_commit(commit, [{ "type": "update" }]))
+            self.keys.extend([(f"stream-{i}", 1), (f"stream-{i}", 2)])
+        GlobalIndexer(self.db, self.shards).execute(AssignGlobalIndexes([
+            { "stream_id": s, "changeset_id": c } for (s, c) in self.keys]))
+        self.rebuilder = GlobalIndexRebuilder(self.db, self.shards, segments=4, workers=4)
+
+    def read_feed(self):
+        handler = FetchGlobalChangesetsHandler(self.db, self.shards)
+        checkpoint = 0 if self.shards.count == 1 else [0] * self.shards.count
+        result = []
+        while True:
+            response = handler.execute(FetchGlobalChangesets(checkpoint, 7))
+            if not response.body["changesets"]:
+                return result
+            result.extend((c["stream_id"], c["changeset_id"]) for c in response.body["changesets"])
+            checkpoint = response.body["next_checkpoint"]
+            if isinstance(checkpoint, str):
+                checkpoint = parse_vector_checkpoint(checkpoint)
+
+    def duplicate_index(self, stream_id, changeset_id, of_stream_id):
+        index = self.db.get_global_index_value(stream_id, changeset_id)
+        other = self.db.get_global_index_value(of_stream_id, 1)
+        self.db.update_global_index(index, index._replace(page=other.page, page_item=other.page_item))
+
+    def audit(self):
+        return self.rebuilder.verify()[2]
+
+    def test_consistent_index(self):
+        audit = self.audit()
+        assert audit.changesets == 20
+        assert not self.rebuilder.has_issues(audit)
+        assert audit.gaps == []
+        assert self.rebuilder.execute() == (audit, [])
+
+    def test_repairing_unindexed_changesets(self):
+        commit = make_initial_commit("stream-new", [{ "type": "init" }])
+        self.db.append(commit)
+        self.db.append(make_next_commit(commit, [{ "type": "update" }]))
+
+        audit = self.audit()
+        assert audit.unindexed == [("stream-new", 1), ("stream-new", 2)]
+
+        self.rebuilder.execute()
+        assert not self.rebuilder.has_issues(self.audit())
+        feed = self.read_feed()
+        assert sorted(feed) == sorted(self.keys + [("stream-new", 1), ("stream-new", 2)])
+        assert feed.index(("stream-new", 1)) < feed.index(("stream-new", 2))
+
+    def test_repairing_duplicated_positions(self):
+        streams = sorted(f"stream-{i}" for i in range(10)
+                         if self.shards.shard_of(f"stream-{i}") == self.shards.shard_of("stream-1"))
+        (keeper, loser) = (streams[0], streams[1])
+        self.duplicate_index(loser, 1, keeper)
+
+        audit = self.audit()
+        assert audit.duplicated == [(loser, 1)]
+        # The stream's following changeset can't precede the re-indexed one
+        assert audit.out_of_order == [(loser, 2)]
+        assert len(audit.gaps) == 2
+
+        (_, conflicts) = self.rebuilder.execute()
+        assert conflicts == []
+        audit = self.audit()
+        assert not self.rebuilder.has_issues(audit)
+        assert len(audit.gaps) == 2
+        feed = self.read_feed()
+        assert sorted(feed) == sorted(self.keys)
+        assert feed.index((loser, 1)) < feed.index((loser, 2))
+
+    def test_compacting_fills_the_gaps(self):
+        self.duplicate_index("stream-1", 1, "stream-0")
+        self.rebuilder.execute()
+        self.rebuilder.execute(compact=True)
+
+        audit = self.audit()
+        assert not self.rebuilder.has_issues(audit)
+        assert audit.gaps == []
+        assert sorted(self.read_feed()) == sorted(self.keys)
+
+    def test_rebuilding_is_deterministic(self):
+        feeds = []
+        for _ in range(2):
+            self.setUp()
+            self.duplicate_index("stream-1", 1, "stream-0")
+            self.duplicate_index("stream-3", 2, "stream-0")
+            self.rebuilder.execute()
+            feeds.append(self.read_feed())
+        assert feeds[0] == feeds[1]
+
+    def add_unindexed_streams(self, count):
+        keys = []
+        for i in range(count):
+            self.db.append(make_initial_commit(f"stream-new-{i}", [{ "type": "init" }]))
+            keys.append((f"stream-new-{i}", 1))
+        return keys
+
+    def test_repair_is_written_in_chunks(self):
+        keys = self.add_unindexed_streams(10)
+        GlobalIndexRebuilder(self.db, self.shards, segments=4, workers=4, chunk_size=3).execute()
+
+        audit = self.audit()
+        assert not self.rebuilder.has_issues(audit)
+        assert audit.gaps == []
+        assert sorted(self.read_feed()) == sorted(self.keys + keys)
+
+    def test_interrupted_repair_leaves_no_gaps(self):
+        self.add_unindexed_streams(10)
+        rebuilder = GlobalIndexRebuilder(self.db, self.shards, segments=4, workers=4, chunk_size=2)
+        relocate = self.db.relocate_global_indexes
+        calls = []
+        def interrupted(*args):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError("interrupted")
+            relocate(*args)
+        self.db.relocate_global_indexes = interrupted
+
+        with pytest.raises(RuntimeError):
+            rebuilder.execute()
+        self.db.relocate_global_indexes = relocate
+
+        assert self.audit().gaps == []
+        rebuilder.execute()
+        assert not self.rebuilder.has_issues(self.audit())
+
+    def test_repair_continues_after_the_indexer(self):
+        new_keys = self.add_unindexed_streams(6)
+        (indexes, counters, audit) = self.rebuilder.verify()
+        # The indexer assigns positions to other changesets meanwhile
+        commit = make_initial_commit("stream-live", [{ "type": "init" }])
+        self.db.append(commit)
+        GlobalIndexer(self.db, self.shards).execute(AssignGlobalIndexes([
+            { "stream_id": "stream-live", "changeset_id": 1 }]))
+
+        conflicts = []
+        for shard in range(self.shards.count):
+            conflicts.extend(self.rebuilder.rebuild_shard(shard, indexes, counters[shard], audit, False))
+
+        assert conflicts == []
+        audit = self.audit()
+        assert not self.rebuilder.has_issues(audit)
+        assert audit.gaps == []
+        assert sorted(self.read_feed()) == sorted(self.keys + new_keys + [("stream-live", 1)])
+
+
+class TestDynamoDBIndexRebuilder(IndexRebuilderTests, TestCase):
+    def make_db(self):
+        self.stub = DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        }, max_page_bytes=500)
+        return DynamoDB('events', 'analysis', client=self.stub)
+
+    def test_segments_are_scanned_in_pages(self):
+        self.audit()
+        assert self.stub.calls['scan'] > 4
+
+
+class TestInMemoryIndexRebuilder(IndexRebuilderTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+class TestShardedDynamoDBIndexRebuilder(TestDynamoDBIndexRebuilder):
+    shards = GlobalShards(3)
+
+
+class TestShardedInMemoryIndexRebuilder(TestInMemoryIndexRebuilder):
+    shards = GlobalShards(3)
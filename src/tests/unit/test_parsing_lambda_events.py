@@ -4,7 +4,7 @@ from unittest import TestCase
 from .context import ees
 from ees.infrastructure.aws_lambda import event_to_command, parse_dynamodb_new_records
 from ees.commands import *
-from ees.model import Response, CommitData
+from ees.model import Response, CommitData, make_continuation_token
 
 class TestParsingLambdaEvents(TestCase):
     def __init__(self, x):
@@ -154,6 +154,51 @@ class TestParsingLambdaEvents(TestCase):
         assert cmd.events == json.loads(event["body"])["events"]
         assert cmd.metadata == { }
 
+    def batch_commit_event(self, commits):
+        event = self.load_event("Commit")
+        event["requestContext"]["resourcePath"] = "/commits"
+        event["pathParameters"] = None
+        event["queryStringParameters"] = None
+        event["body"] = json.dumps({ "commits": commits })
+        return event
+
+    def test_batch_commit(self):
+        event = self.batch_commit_event([
+            { "stream_id": "aaa", "expected_last_changeset": 3, "events": [{ "type": "update" }], "metadata": { "a": 1 } },
+            { "stream_id": "bbb", "expected_last_event": 7, "events": [{ "type": "update" }] },
+            { "stream_id": "ccc", "events": [{ "type": "init" }] }
+        ])
+        cmd = event_to_command(event)
+        assert isinstance(cmd, BatchCommit)
+        assert cmd.commits == [
+            Commit("aaa", 3, None, [{ "type": "update" }], { "a": 1 }),
+            Commit("bbb", None, 7, [{ "type": "update" }], { }),
+            Commit("ccc", 0, None, [{ "type": "init" }], { })
+        ]
+
+    def test_batch_commit_without_commits(self):
+        err = event_to_command(self.batch_commit_event([]))
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_BATCH"
+
+    def test_batch_commit_to_the_same_stream_twice(self):
+        err = event_to_command(self.batch_commit_event([
+            { "stream_id": "aaa", "events": [{ "type": "init" }] },
+            { "stream_id": "aaa", "expected_last_changeset": 1, "events": [{ "type": "update" }] }
+        ]))
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_BATCH"
+
+    def test_batch_commit_with_invalid_expected_changeset(self):
+        err = event_to_command(self.batch_commit_event([
+            { "stream_id": "aaa", "expected_last_changeset": "test", "events": [{ "type": "init" }] }
+        ]))
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_EXPECTED_CHANGESET_ID"
+
     def test_fetch_stream_changesets(self):
         event = self.load_event("StreamChangesets")
         cmd = event_to_command(event)
@@ -162,6 +207,12 @@ class TestParsingLambdaEvents(TestCase):
         assert cmd.from_changeset == 1
         assert cmd.to_changeset == 5
     
+    def test_fetch_stream_changesets_with_fields(self):
+        event = self.load_event("StreamChangesets")
+        event["queryStringParameters"]["fields"] = "changeset_id,metadata"
+        cmd = event_to_command(event)
+        assert cmd.fields == ("changeset_id", "metadata")
+
     def test_fetch_stream_changesets_without_stream_id(self):
         event = self.load_event("StreamChangesets")
         del event["pathParameters"]["stream_id"]
@@ -236,6 +287,86 @@ class TestParsingLambdaEvents(TestCase):
             "message": f'The higher boundary cannot be lower than the lower boundary: 7(from) > 1(to)'
         })
 
+    def test_fetch_stream_changesets_with_limit(self):
+        event = self.load_event("StreamChangesets")
+        event["queryStringParameters"]["limit"] = "10"
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchStreamChangesets)
+        assert cmd.limit == 10
+
+    def test_fetch_stream_changesets_invalid_limit(self):
+        event = self.load_event("StreamChangesets")
+        event["queryStringParameters"]["limit"] = "0"
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_LIMIT"
+
+    def test_fetch_stream_changesets_with_continuation_token(self):
+        event = self.load_event("StreamChangesets")
+        event["queryStringParameters"]["to"] = "20"
+        event["queryStringParameters"]["continuation_token"] = \
+            make_continuation_token("fe80eaef-90c3-41be-9bc0-3f85458b9a8e", "changeset", 11)
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchStreamChangesets)
+        assert cmd.from_changeset == 11
+        assert cmd.to_changeset == 20
+
+    def test_fetch_stream_changesets_with_invalid_continuation_token(self):
+        event = self.load_event("StreamChangesets")
+        event["queryStringParameters"]["continuation_token"] = \
+            make_continuation_token("another-stream", "changeset", 11)
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_CONTINUATION_TOKEN"
+
+    def test_fetch_stream_changesets_from_snapshot(self):
+        event = self.load_event("StreamChangesets")
+        del event["queryStringParameters"]["from"]
+        event["queryStringParameters"]["from_snapshot"] = "true"
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchStreamChangesets)
+        assert cmd.from_snapshot
+        assert cmd.from_changeset is None
+
+    def test_fetch_stream_changesets_from_snapshot_and_from(self):
+        event = self.load_event("StreamChangesets")
+        event["queryStringParameters"]["from_snapshot"] = "true"
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_CHANGESET_FILTERING_PARAMS"
+
+    def test_continuation_token_overrides_from_snapshot(self):
+        event = self.load_event("StreamChangesets")
+        del event["queryStringParameters"]["from"]
+        event["queryStringParameters"]["from_snapshot"] = "true"
+        event["queryStringParameters"]["continuation_token"] = \
+            make_continuation_token("fe80eaef-90c3-41be-9bc0-3f85458b9a8e", "changeset", 11)
+        cmd = event_to_command(event)
+        assert cmd.from_changeset == 11
+        assert not cmd.from_snapshot
+
+    def test_commit_snapshot(self):
+        event = self.load_event("Commit")
+        event["requestContext"]["resourcePath"] = "/streams/{stream_id}/snapshots"
+        event["body"] = json.dumps({ "changeset_id": 3, "data": { "total": 10 } })
+        cmd = event_to_command(event)
+        assert isinstance(cmd, CommitSnapshot)
+        assert cmd.stream_id == "7ef3c378-8c97-49fe-97ba-f5afe719ea1c"
+        assert cmd.changeset_id == 3
+        assert cmd.data == { "total": 10 }
+
+    def test_commit_snapshot_with_invalid_changeset_id(self):
+        event = self.load_event("Commit")
+        event["requestContext"]["resourcePath"] = "/streams/{stream_id}/snapshots"
+        event["body"] = json.dumps({ "changeset_id": "3", "data": { } })
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_SNAPSHOT"
+
     def test_fetch_stream_events(self):
         event = self.load_event("StreamEvents")
         cmd = event_to_command(event)
@@ -244,6 +375,15 @@ class TestParsingLambdaEvents(TestCase):
         assert cmd.from_event == 1
         assert cmd.to_event == 5
     
+    def test_fetch_stream_events_with_invalid_fields(self):
+        event = self.load_event("StreamEvents")
+        event["queryStringParameters"]["fields"] = "id,metadata"
+        err = event_to_command(event)
+        self.assertDictEqual(err.body, {
+            "error": "INVALID_FIELDS",
+            "message": '"id,metadata" is an invalid fields value. Expected a comma separated list of: id, data.'
+        })
+
     def test_fetch_stream_events_without_stream_id(self):
         event = self.load_event("StreamEvents")
         del event["pathParameters"]["stream_id"]
@@ -318,6 +458,27 @@ class TestParsingLambdaEvents(TestCase):
             "message": f'The higher boundary cannot be lower than the lower boundary: 7(from) > 1(to)'
         })
     
+    def test_fetch_stream_events_with_limit_and_continuation_token(self):
+        event = self.load_event("StreamEvents")
+        event["queryStringParameters"]["to"] = "20"
+        event["queryStringParameters"]["limit"] = "5"
+        event["queryStringParameters"]["continuation_token"] = \
+            make_continuation_token("d2333e6b-65a7-4a10-9886-2dd2fe873bed", "event", 6)
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchStreamEvents)
+        assert cmd.from_event == 6
+        assert cmd.to_event == 20
+        assert cmd.limit == 5
+
+    def test_fetch_stream_events_with_changesets_continuation_token(self):
+        event = self.load_event("StreamEvents")
+        event["queryStringParameters"]["continuation_token"] = \
+            make_continuation_token("d2333e6b-65a7-4a10-9886-2dd2fe873bed", "changeset", 6)
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_CONTINUATION_TOKEN"
+
     def test_global_changesets(self):
         event = self.load_event("GlobalChangesets")
         cmd = event_to_command(event)
@@ -397,13 +558,129 @@ class TestParsingLambdaEvents(TestCase):
             "message": '"0" is an invalid limit value. Expected an integer value greater than 0.'
         })
     
+    def test_global_changesets_with_vector_checkpoint(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["checkpoint"] = "12,0,7"
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchGlobalChangesets)
+        assert cmd.checkpoint == [12, 0, 7]
+        assert cmd.shard is None
+
+    def test_global_changesets_of_shard(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["shard"] = "2"
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchGlobalChangesets)
+        assert cmd.shard == 2
+
+    def test_global_changesets_of_shard_with_vector_checkpoint(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["checkpoint"] = "12,0,7"
+        event["queryStringParameters"]["shard"] = "2"
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.body["error"] == "INVALID_CHECKPOINT"
+
+    def test_global_changesets_with_invalid_shard(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["shard"] = "-1"
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.body["error"] == "INVALID_SHARD"
+
+    def test_global_changesets_with_wait(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["wait"] = "15"
+        cmd = event_to_command(event)
+        assert isinstance(cmd, FetchGlobalChangesets)
+        assert cmd.wait == 15
+
+    def test_global_changesets_with_invalid_wait(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["wait"] = "-1"
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        self.assertDictEqual(err.body, {
+            "error": "INVALID_WAIT",
+            "message": '"-1" is an invalid wait value. Expected a non-negative number of seconds.'
+        })
+
+    def test_global_changesets_with_filters(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["stream_prefix"] = "orders-,users-"
+        event["queryStringParameters"]["event_type"] = "created"
+        cmd = event_to_command(event)
+        assert cmd.stream_prefix == ("orders-", "users-")
+        assert cmd.event_type == ("created",)
+
+    def test_global_changesets_without_filters(self):
+        cmd = event_to_command(self.load_event("GlobalChangesets"))
+        assert cmd.stream_prefix is None
+        assert cmd.event_type is None
+
+    def test_global_changesets_with_fields(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["fields"] = "stream_id,checkpoint"
+        cmd = event_to_command(event)
+        assert cmd.fields == ("stream_id", "checkpoint")
+
+    def test_global_changesets_with_invalid_fields(self):
+        event = self.load_event("GlobalChangesets")
+        event["queryStringParameters"]["fields"] = "stream_id,data"
+        err = event_to_command(event)
+        assert isinstance(err, Response)
+        assert err.http_status == 400
+        assert err.body["error"] == "INVALID_FIELDS"
+
+    def load_global_events_event(self, checkpoint=None, limit=None):
+        event = self.load_event("GlobalChangesets")
+        event["requestContext"]["resourcePath"] = "/events"
+        event["queryStringParameters"] = { }
+        if checkpoint is not None:
+            event["queryStringParameters"]["checkpoint"] = checkpoint
+        if limit is not None:
+            event["queryStringParameters"]["limit"] = limit
+        return event
+
+    def test_global_events(self):
+        cmd = event_to_command(self.load_global_events_event("42.1", "20"))
+        assert cmd == FetchGlobalEvents((42, 1), 20)
+
+    def test_global_events_without_explicit_params(self):
+        cmd = event_to_command(self.load_global_events_event())
+        assert cmd == FetchGlobalEvents((0, 0), None)
+
+    def test_global_events_with_changeset_checkpoint(self):
+        cmd = event_to_command(self.load_global_events_event("42"))
+        assert cmd.checkpoint == (42, 0)
+
+    def test_global_events_with_vector_checkpoint(self):
+        cmd = event_to_command(self.load_global_events_event("42.1,0.0,7"))
+        assert cmd.checkpoint == [(42, 1), (0, 0), (7, 0)]
+
+    def test_global_events_with_invalid_checkpoint(self):
+        for checkpoint in ["test", "42.a", "-1.0", "4.-1"]:
+            err = event_to_command(self.load_global_events_event(checkpoint))
+            assert isinstance(err, Response)
+            assert err.http_status == 400
+            self.assertDictEqual(err.body, {
+                "error": "INVALID_CHECKPOINT",
+                "message": f'"{checkpoint}" is an invalid checkpoint value. Set a valid checkpoint(e.g. "42.1").'
+            })
+
+    def test_global_events_with_invalid_limit(self):
+        err = event_to_command(self.load_global_events_event("42.1", "0"))
+        assert err.body["error"] == "INVALID_LIMIT"
+
     def test_assign_global_index(self):
         event = self.load_event("AssignGlobalIndex")
         cmd = event_to_command(event)
         assert isinstance(cmd, AssignGlobalIndexes)
         self.assertListEqual(cmd.changesets, [
-            { "stream_id": "99038933-e620-444d-9033-4128254f0cbd", "changeset_id": 2 },
-            { "stream_id": "206bc1ed-8e67-4a64-a596-8b32c0c20a97", "changeset_id": 1 }
+            { "stream_id": "99038933-e620-444d-9033-4128254f0cbd", "changeset_id": 2,
+              "timestamp": "2021-02-01T14:08:06.368556Z" },
+            { "stream_id": "206bc1ed-8e67-4a64-a596-8b32c0c20a97", "changeset_id": 1,
+              "timestamp": "2021-02-01T14:08:07.149329Z" }
         ])
     
     def test_new_dynamodb_records(self):
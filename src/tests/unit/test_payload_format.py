@@ -0,0 +1,53 @@
+import base64
+from unittest import TestCase
+
+from .context import ees
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.model import make_initial_commit, make_next_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema
+
+
+class TestPayloadFormat(TestCase):
+    def make_db(self, compress_payloads):
+        db = DynamoDB('events', 'analysis', compress_payloads=compress_payloads)
+        db.dynamodb_ll = self.stub
+        return db
+
+    def setUp(self):
+        self.stub = DynamoDBStub({ 'events': events_table_schema })
+
+    def test_compressed_items_are_binary_and_versioned(self):
+        db = self.make_db(True)
+        db.append(make_initial_commit("aaa", [{ "type": "init", "data": "x" * 1000 }], { "v": 1 }))
+
+        item = self.stub.tables['events'].get({ "stream_id": { "S": "aaa" }, "changeset_id": { "N": "1" } })
+        assert item["format_version"] == { "N": "2" }
+        assert len(item["events"]["B"]) < 1000
+
+        commit = db.fetch_last_commit("aaa")
+        assert commit.events == [{ "type": "init", "data": "x" * 1000 }]
+        assert commit.metadata == { "v": 1 }
+
+    def test_reading_mixed_formats(self):
+        first = make_initial_commit("aaa", [{ "type": "init" }], { "v": 1 })
+        self.make_db(False).append(first)
+        self.make_db(True).append(make_next_commit(first, [{ "type": "update" }], { "v": 2 }))
+
+        changesets = self.make_db(False).fetch_stream_changesets("aaa")
+        assert [c.events for c in changesets] == [[{ "type": "init" }], [{ "type": "update" }]]
+        assert [c.metadata for c in changesets] == [{ "v": 1 }, { "v": 2 }]
+
+    def test_parsing_base64_encoded_stream_record(self):
+        record = {
+            "stream_id": { "S": "aaa" },
+            "changeset_id": { "N": "1" },
+            "first_event_id": { "N": "1" },
+            "last_event_id": { "N": "1" },
+            "format_version": { "N": "2" },
+            "events": { "B": base64.b64encode(DynamoDB.compress([{ "type": "init" }])).decode() },
+            "metadata": { "B": base64.b64encode(DynamoDB.compress({ })).decode() }
+        }
+
+        commit = DynamoDB.parse_commit(record)
+        assert commit.events == [{ "type": "init" }]
+        assert commit.metadata == { }
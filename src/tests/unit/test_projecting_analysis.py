@@ -4,7 +4,8 @@ from unittest.mock import Mock, call
 
 from .context import ees
 from ees.commands import FetchGlobalChangesets
-from ees.handlers.analysis_projector import AnalysisProjector
+from ees.handlers.analysis_projector import statistics_projection
+from ees.handlers.projections import ProjectionsEngine
 from ees.model import Response, AnalysisState
 
 class TestProjectingAnalysisModel(TestCase):
@@ -70,7 +71,7 @@ class TestProjectingAnalysisModel(TestCase):
             version=0
         )
 
-        p = AnalysisProjector(dynamo_db, global_changesets_endpoint)
+        p = ProjectionsEngine(dynamo_db, global_changesets_endpoint, [statistics_projection(dynamo_db)])
         p.query_limit = 10
         p.execute()
 
@@ -144,7 +145,7 @@ class TestProjectingAnalysisModel(TestCase):
             version=3
         )
 
-        p = AnalysisProjector(dynamo_db, global_changesets_endpoint)
+        p = ProjectionsEngine(dynamo_db, global_changesets_endpoint, [statistics_projection(dynamo_db)])
         p.query_limit = 10
         p.execute()
 
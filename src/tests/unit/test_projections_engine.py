@@ -0,0 +1,181 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import pytest
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes
+from ees.handlers import projections
+from ees.handlers.analysis_projector import statistics_projection
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.projections import ProjectionsEngine
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, Projection, ProjectionState, make_initial_commit
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+def count_streams(state, changeset):
+    return state + 1 if changeset["changeset_id"] == 1 else state
+
+def count_event_types(state, changeset):
+    for e in changeset["events"]:
+        state[e["type"]] = state.get(e["type"], 0) + 1
+    return state
+
+def list_streams(state, changeset):
+    return state + [changeset["stream_id"]]
+
+
+class ProjectionsEngineTests:
+    shards = GlobalShards()
+
+    def setUp(self):
+        self.db = self.make_db()
+        self.indexer = GlobalIndexer(self.db, self.shards)
+        self.handler = Mock(wraps=FetchGlobalChangesetsHandler(self.db, self.shards))
+        self.streams = 0
+        self.add_streams(12)
+
+    def add_streams(self, count):
+        keys = []
+        for i in range(self.streams, self.streams + count):
+            self.db.append(make_initial_commit(f"stream-{i}", [{ "type": "init" }, { "type": f"type-{i % 2}" }]))
+            keys.append({ "stream_id": f"stream-{i}", "changeset_id": 1 })
+        self.streams += count
+        self.indexer.execute(AssignGlobalIndexes(keys))
+
+    def make_engine(self, *registered):
+        engine = ProjectionsEngine(self.db, self.handler, registered, self.shards)
+        engine.query_limit = 5
+        return engine
+
+    def state(self, projection_id):
+        return self.db.get_projection_state(projection_id).state
+
+    def test_projections_share_the_feed_reads(self):
+        self.make_engine(
+            Projection("streams", count_streams, 0),
+            Projection("types", count_event_types, { })).execute()
+
+        assert self.state("streams") == 12
+        assert self.state("types") == { "init": 12, "type-0": 6, "type-1": 6 }
+        # 3 pages and the empty one at the head
+        assert self.handler.execute.call_count == 4
+
+    def test_projections_continue_from_their_checkpoints(self):
+        self.make_engine(Projection("streams", list_streams, [])).execute()
+        self.add_streams(3)
+        self.make_engine(Projection("streams", list_streams, [])).execute()
+
+        assert sorted(self.state("streams")) == sorted(f"stream-{i}" for i in range(15))
+        assert self.db.get_projection_state("streams").version == 15
+
+    def test_lagging_projection_catches_up_independently(self):
+        self.make_engine(Projection("streams", count_streams, 0)).execute()
+        self.add_streams(3)
+        prev = projections.max_shared_lag
+        projections.max_shared_lag = 2
+        try:
+            self.handler.reset_mock()
+            self.make_engine(
+                Projection("streams", count_streams, 0),
+                Projection("new", count_streams, 0)).execute()
+        finally:
+            projections.max_shared_lag = prev
+
+        assert self.state("streams") == 15
+        assert self.state("new") == 15
+        first_pass = self.handler.execute.call_args_list[0].args[0].checkpoint
+        assert first_pass not in (0, [0] * self.shards.count)
+
+    def test_failing_projection_does_not_stop_the_others(self):
+        def failing(state, changeset):
+            if changeset["stream_id"] == "stream-7":
+                raise ValueError(changeset["stream_id"])
+            return state + 1
+        self.make_engine(
+            Projection("failing", failing, 0),
+            Projection("streams", count_streams, 0)).execute()
+
+        assert self.state("streams") == 12
+        assert self.db.get_projection_state("failing") is None
+
+    def test_concurrently_saved_projection_is_left_out(self):
+        def concurrently_saved(state, changeset):
+            if not self.db.get_projection_state("streams"):
+                self.db.set_projection_state(ProjectionState("streams", 100, [0] * self.shards.count, 1), None)
+            return state + 1
+        self.make_engine(
+            Projection("streams", concurrently_saved, 0),
+            Projection("types", count_event_types, { })).execute()
+
+        assert self.state("streams") == 100
+        assert self.state("types")["init"] == 12
+
+    def test_failing_save_does_not_stop_the_others(self):
+        store = Mock()
+        store.get_projection_state.return_value = None
+        store.set_projection_state.side_effect = ValueError("Item size has exceeded the maximum allowed size")
+        self.make_engine(
+            Projection("failing", count_streams, 0, store),
+            Projection("streams", count_streams, 0)).execute()
+
+        assert self.state("streams") == 12
+        store.set_projection_state.assert_called_once()
+
+    def test_statistics_share_the_feed_reads(self):
+        self.make_engine(
+            statistics_projection(self.db, self.shards),
+            Projection("streams", count_streams, 0)).execute()
+
+        statistics = self.db.get_analysis_state()
+        assert (statistics.total_streams, statistics.total_events, statistics.version) == (12, 24, 12)
+        assert self.state("streams") == 12
+        # A single pass, the feed's beginning was read once
+        checkpoints = [c.args[0].checkpoint for c in self.handler.execute.call_args_list]
+        assert checkpoints.count(checkpoints[0]) == 1
+
+    def test_stops_before_the_deadline(self):
+        self.make_engine(Projection("streams", count_streams, 0)).execute(lambda: 1000)
+
+        assert self.db.get_projection_state("streams") is None
+        self.handler.execute.assert_not_called()
+
+
+class TestDynamoDBProjectionsEngine(ProjectionsEngineTests, TestCase):
+    def make_db(self):
+        return DynamoDB('events', 'analysis', client=DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        }))
+
+
+class TestInMemoryProjectionsEngine(ProjectionsEngineTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+class TestShardedDynamoDBProjectionsEngine(TestDynamoDBProjectionsEngine):
+    shards = GlobalShards(3)
+
+    def test_projections_share_the_feed_reads(self):
+        self.make_engine(
+            Projection("streams", count_streams, 0),
+            Projection("types", count_event_types, { })).execute()
+
+        assert self.state("streams") == 12
+        assert self.state("types") == { "init": 12, "type-0": 6, "type-1": 6 }
+
+
+class TestShardedInMemoryProjectionsEngine(TestInMemoryProjectionsEngine):
+    shards = GlobalShards(3)
+
+    test_projections_share_the_feed_reads = TestShardedDynamoDBProjectionsEngine.test_projections_share_the_feed_reads
+
+
+def test_registering_a_projection_twice_is_rejected():
+    engine = ProjectionsEngine(InMemoryStorage(), Mock())
+    engine.register(Projection("streams", count_streams, 0))
+    with pytest.raises(ValueError):
+        engine.register(Projection("streams", list_streams, []))
@@ -0,0 +1,78 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from .context import ees
+from ees.handlers import projections
+from ees.handlers.analysis_projector import statistics_projection
+from ees.handlers.projections import ProjectionsEngine
+from ees.model import Response, AnalysisState
+
+
+def changesets_feed(total):
+    def execute(cmd):
+        changesets = [{
+            "stream_id": f"stream-{i}",
+            "changeset_id": 1,
+            "events": [{ "type": "init" }],
+            "metadata": { },
+            "checkpoint": i
+        } for i in range(cmd.checkpoint, min(cmd.checkpoint + cmd.limit, total))]
+        return Response(
+            http_status=200,
+            body={
+                "checkpoint": cmd.checkpoint,
+                "limit": cmd.limit,
+                "changesets": changesets,
+                "next_checkpoint": cmd.checkpoint + len(changesets)
+            })
+    handler = Mock()
+    handler.execute.side_effect = execute
+    return handler
+
+
+class TestProjectorCheckpointing(TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.db.get_analysis_state.return_value = AnalysisState(0, 0, 0, 0, 0)
+        self.now = 0
+        self.projector = ProjectionsEngine(self.db, changesets_feed(50), [statistics_projection(self.db)],
+                                           clock=lambda: self.now)
+        self.projector.query_limit = 10
+
+    def saved(self):
+        return [(c.args[0].version, c.args[1]) for c in self.db.set_analysis_state.call_args_list]
+
+    def test_state_is_persisted_every_n_changesets(self):
+        prev = projections.checkpoint_every
+        projections.checkpoint_every = 20
+        try:
+            self.projector.execute()
+        finally:
+            projections.checkpoint_every = prev
+
+        assert self.saved() == [(20, 0), (40, 20), (50, 40)]
+        assert self.db.set_analysis_state.call_args.args[0].total_streams == 50
+
+    def test_state_is_persisted_every_interval(self):
+        def execute(cmd):
+            self.now += 25
+            return feed.execute(cmd)
+        feed = self.projector.global_changesets_handler
+        handler = Mock()
+        handler.execute.side_effect = execute
+        self.projector.global_changesets_handler = handler
+
+        self.projector.execute()
+        assert self.saved() == [(30, 0), (50, 30)]
+
+    def test_stops_before_the_deadline(self):
+        remaining = iter([120000, 90000, 29000])
+        self.projector.execute(lambda: next(remaining))
+
+        assert self.saved() == [(20, 0)]
+
+    def test_nothing_to_project_is_not_persisted(self):
+        self.db.get_analysis_state.return_value = AnalysisState(50, 50, 50, 1, 50)
+        self.projector.execute()
+
+        self.db.set_analysis_state.assert_not_called()
@@ -0,0 +1,162 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import pytest
+
+from .context import ees
+from ees.commands import AssignGlobalIndexes, FetchGlobalChangesets
+from ees.handlers.global_changesets import FetchGlobalChangesetsHandler
+from ees.handlers.global_indexer import GlobalIndexer
+from ees.handlers.reindexer import Reindexer
+from ees.infrastructure.dynamodb import DynamoDB
+from ees.infrastructure.in_memory import InMemoryStorage
+from ees.model import GlobalShards, IndexSettings, make_initial_commit, page_size_segments, parse_vector_checkpoint
+from tests.benchmarks.dynamodb_stub import DynamoDBStub, events_table_schema, analysis_table_schema
+
+
+class ReindexingTests:
+    shards = GlobalShards()
+
+    def setUp(self):
+        self.db = self.make_db()
+        self.indexer = GlobalIndexer(self.db, self.shards)
+        self.handler = FetchGlobalChangesetsHandler(self.db, self.shards)
+        self.streams = 0
+        self.add_streams(30)
+
+    def add_streams(self, count):
+        keys = []
+        for i in range(self.streams, self.streams + count):
+            self.db.append(make_initial_commit(f"stream-{i}", [{ "type": "init" }]))
+            keys.append({ "stream_id": f"stream-{i}", "changeset_id": 1 })
+        self.streams += count
+        self.indexer.execute(AssignGlobalIndexes(keys))
+
+    def read_feed(self, limit=4):
+        checkpoint = 0 if self.shards.count == 1 else [0] * self.shards.count
+        result = []
+        while True:
+            response = self.handler.execute(FetchGlobalChangesets(checkpoint, limit))
+            if not response.body["changesets"]:
+                return result
+            result.extend((c["stream_id"], c["checkpoint"]) for c in response.body["changesets"])
+            checkpoint = response.body["next_checkpoint"]
+            if isinstance(checkpoint, str):
+                checkpoint = parse_vector_checkpoint(checkpoint)
+
+    def test_reindexing_to_smaller_pages(self):
+        feed = self.read_feed()
+        settings = Reindexer(self.db, self.shards, chunk_size=4).execute(7)
+
+        assert settings == IndexSettings(7, None, None, settings.version)
+        assert self.db.get_index_settings() == settings
+        assert self.read_feed() == feed
+        assert len(feed) == 30
+
+    def test_feed_is_readable_during_reindexing(self):
+        feed = self.read_feed(limit=5)
+        reindexer = Reindexer(self.db, self.shards, chunk_size=4)
+        settings = reindexer.start(7)
+        while settings.target_page_size:
+            settings = reindexer.migrate_chunk(settings)
+            assert self.read_feed(limit=5) == feed
+
+    def test_indexing_continues_during_and_after_reindexing(self):
+        reindexer = Reindexer(self.db, self.shards, chunk_size=4)
+        settings = reindexer.migrate_chunk(reindexer.start(7))
+        self.add_streams(5)
+        while settings.target_page_size:
+            settings = reindexer.migrate_chunk(settings)
+        self.add_streams(5)
+
+        feed = self.read_feed()
+        assert sorted(s for (s, _) in feed) == sorted(f"stream-{i}" for i in range(40))
+        assert all(self.db.get_global_counter(s).page_size == 7 for s in range(self.shards.count))
+
+    def test_reindexing_back_to_the_default_page_size(self):
+        feed = self.read_feed()
+        Reindexer(self.db, self.shards).execute(7)
+        settings = Reindexer(self.db, self.shards).execute(1000)
+
+        assert settings.page_size == 1000
+        assert self.read_feed() == feed
+
+    def test_conflicting_reindexing_is_rejected(self):
+        reindexer = Reindexer(self.db, self.shards, chunk_size=4)
+        reindexer.start(7)
+        with pytest.raises(ValueError):
+            Reindexer(self.db, self.shards).execute(50)
+
+        settings = Reindexer(self.db, self.shards).execute(7)
+        assert settings.page_size == 7
+
+
+class TestDynamoDBReindexing(ReindexingTests, TestCase):
+    def make_db(self):
+        return DynamoDB('events', 'analysis', client=DynamoDBStub({
+            'events': events_table_schema,
+            'analysis': analysis_table_schema
+        }))
+
+    def test_items_are_written_with_their_page_size(self):
+        Reindexer(self.db, self.shards).execute(7)
+        index = self.db.get_global_index_value("stream-15", 1)
+        assert (index.page, index.page_item, index.page_size) == (2, 1, 7)
+
+
+    def test_unseen_reindexed_items_are_not_skipped(self):
+        # The re-indexed items aren't visible in the index yet
+        settings = self.db.get_index_settings()
+        self.db.update_index_settings(settings, IndexSettings(
+            settings.page_size, 7, [10] * self.shards.count, settings.version + 1))
+        self.db.fetch_global_range = Mock(return_value=[])
+
+        assert self.db.fetch_global_changesets(0, 5) == []
+        self.db.fetch_global_range.assert_called_once()
+
+    def test_settings_are_cached_outside_of_reindexing(self):
+        now = [0]
+        self.db.clock = lambda: now[0]
+        self.db.settings_ttl = 60
+        self.db.get_index_settings = Mock(wraps=self.db.get_index_settings)
+
+        self.read_feed()
+        self.read_feed()
+        assert self.db.get_index_settings.call_count == 1
+
+        now[0] = 60
+        self.read_feed()
+        assert self.db.get_index_settings.call_count == 2
+
+    def test_reindexing_waits_for_the_cached_settings_to_expire(self):
+        self.db.settings_ttl = 60
+        sleep = Mock()
+        Reindexer(self.db, self.shards, sleep=sleep).execute(7)
+
+        sleep.assert_called_once_with(60)
+
+
+class TestInMemoryReindexing(ReindexingTests, TestCase):
+    def make_db(self):
+        return InMemoryStorage()
+
+
+class TestShardedDynamoDBReindexing(TestDynamoDBReindexing):
+    shards = GlobalShards(3)
+
+    def test_items_are_written_with_their_page_size(self):
+        Reindexer(self.db, self.shards).execute(7)
+        index = self.db.get_global_index_value("stream-15", 1)
+        assert index.page_size == 7
+        assert index.page % self.shards.count == self.shards.shard_of("stream-15")
+
+
+class TestShardedInMemoryReindexing(TestInMemoryReindexing):
+    shards = GlobalShards(3)
+
+
+def test_page_size_segments():
+    assert page_size_segments(IndexSettings(1000), 0, 5) == [(1000, 5, None)]
+    migrating = IndexSettings(1000, 10, [25, None])
+    assert page_size_segments(migrating, 0, 5) == [(10, 5, 25), (1000, 25, None)]
+    assert page_size_segments(migrating, 0, 30) == [(1000, 30, None)]
+    assert page_size_segments(migrating, 1, 5) == [(10, 5, None)]
@@ -0,0 +1,74 @@
+import base64
+import gzip
+import json
+import zlib
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import Commit
+from ees.infrastructure.aws_lambda import event_to_command, negotiate_encoding, render_response
+from ees.model import Response
+
+
+def api_event(accept_encoding=None, query_string=None):
+    event = { "queryStringParameters": query_string, "headers": { } }
+    if accept_encoding:
+        event["headers"]["accept-encoding"] = accept_encoding
+    return event
+
+large_body = { "events": [{ "type": "init", "data": "x" * 100 } for _ in range(20)] }
+
+
+class TestRenderingResponses(TestCase):
+    def test_compact_json_by_default(self):
+        rendered = render_response(Response(200, { "a": [1, 2] }), api_event())
+        assert rendered["statusCode"] == 200
+        assert rendered["body"] == '{"a":[1,2]}'
+        assert rendered["headers"]["Content-Type"] == "application/json"
+        assert "isBase64Encoded" not in rendered
+
+    def test_pretty_printing(self):
+        rendered = render_response(Response(200, { "a": 1 }), api_event(query_string={ "pretty": "true" }))
+        assert rendered["body"] == '{\n    "a": 1\n}'
+
+    def test_gzip_compression(self):
+        rendered = render_response(Response(200, large_body), api_event("deflate, gzip, br"))
+        assert rendered["isBase64Encoded"]
+        assert rendered["headers"]["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(base64.b64decode(rendered["body"]))) == large_body
+
+    def test_deflate_compression(self):
+        rendered = render_response(Response(200, large_body), api_event("deflate"))
+        assert rendered["headers"]["Content-Encoding"] == "deflate"
+        assert json.loads(zlib.decompress(base64.b64decode(rendered["body"]))) == large_body
+
+    def test_small_bodies_are_not_compressed(self):
+        rendered = render_response(Response(200, { "a": 1 }), api_event("gzip"))
+        assert rendered["body"] == '{"a":1}'
+        assert "Content-Encoding" not in rendered["headers"]
+
+    def test_compressed_representation_has_its_own_etag(self):
+        response = Response(200, large_body, { "ETag": '"abc"' })
+        assert render_response(response, api_event("gzip"))["headers"]["ETag"] == '"abc-gzip"'
+        assert render_response(response, api_event())["headers"]["ETag"] == '"abc"'
+
+    def test_negotiating_encoding(self):
+        assert negotiate_encoding(None) is None
+        assert negotiate_encoding("identity") is None
+        assert negotiate_encoding("gzip;q=0, deflate") == "deflate"
+        assert negotiate_encoding("deflate;q=0.5, gzip;q=0.4") == "deflate"
+        assert negotiate_encoding("*") == "gzip"
+        assert negotiate_encoding("*;q=0") is None
+
+    def test_base64_encoded_request_body(self):
+        body = json.dumps({ "events": [{ "type": "init" }], "metadata": { } })
+        event = {
+            "requestContext": { "resourcePath": "/streams/{stream_id}" },
+            "pathParameters": { "stream_id": "aaa" },
+            "queryStringParameters": { },
+            "body": base64.b64encode(body.encode('utf-8')).decode('ascii'),
+            "isBase64Encoded": True
+        }
+        cmd = event_to_command(event)
+        assert isinstance(cmd, Commit)
+        assert cmd.events == [{ "type": "init" }]
@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+from .context import ees
+from ees.commands import *
+from ees.handlers.changesets import FetchChangesetsHandler
+from ees.handlers.commit import CommitHandler
+from ees.handlers.events import FetchEventsHandler
+from ees.handlers.snapshots import CommitSnapshotHandler
+from ees.infrastructure.in_memory import InMemoryStorage
+
+
+class TestSnapshots(TestCase):
+    def setUp(self):
+        self.db = InMemoryStorage()
+        for i in range(5):
+            CommitHandler(self.db).execute(
+                Commit("aaa", i, None, [{ "type": f"e{i}.1" }, { "type": f"e{i}.2" }], { }))
+
+    def snapshot(self, changeset_id, data):
+        return CommitSnapshotHandler(self.db).execute(CommitSnapshot("aaa", changeset_id, data))
+
+    def test_commit_snapshot(self):
+        response = self.snapshot(3, { "state": 3 })
+
+        assert response.http_status == 200
+        snapshot = self.db.fetch_latest_snapshot("aaa")
+        assert snapshot.changeset_id == 3
+        assert snapshot.last_event_id == 6
+        assert snapshot.data == { "state": 3 }
+
+    def test_snapshot_of_unknown_stream(self):
+        response = CommitSnapshotHandler(self.db).execute(CommitSnapshot("bbb", 1, { }))
+        assert response.http_status == 404
+
+    def test_snapshot_of_unknown_changeset(self):
+        response = self.snapshot(6, { })
+        assert response.http_status == 400
+        assert response.body["error"] == "INVALID_SNAPSHOT_CHANGESET_ID"
+
+    def test_read_changesets_from_snapshot(self):
+        self.snapshot(2, { "state": 2 })
+        self.snapshot(4, { "state": 4 })
+
+        response = FetchChangesetsHandler(self.db).execute(
+            FetchStreamChangesets("aaa", None, None, from_snapshot=True))
+
+        assert response.body["snapshot"] == { "changeset_id": 4, "data": { "state": 4 } }
+        assert [c["changeset_id"] for c in response.body["changesets"]] == [5]
+
+    def test_read_changesets_from_snapshot_before_upper_bound(self):
+        self.snapshot(2, { "state": 2 })
+        self.snapshot(4, { "state": 4 })
+
+        response = FetchChangesetsHandler(self.db).execute(
+            FetchStreamChangesets("aaa", None, 3, from_snapshot=True))
+
+        assert response.body["snapshot"]["changeset_id"] == 2
+        assert [c["changeset_id"] for c in response.body["changesets"]] == [3]
+
+    def test_read_changesets_from_latest_changeset_snapshot(self):
+        self.snapshot(5, { "state": 5 })
+
+        response = FetchChangesetsHandler(self.db).execute(
+            FetchStreamChangesets("aaa", None, None, from_snapshot=True))
+
+        assert response.http_status == 200
+        assert response.body["snapshot"]["changeset_id"] == 5
+        assert response.body["changesets"] == []
+
+    def test_read_changesets_without_snapshots(self):
+        response = FetchChangesetsHandler(self.db).execute(
+            FetchStreamChangesets("aaa", None, None, from_snapshot=True))
+
+        assert response.body["snapshot"] is None
+        assert len(response.body["changesets"]) == 5
+
+    def test_read_events_from_snapshot(self):
+        self.snapshot(4, { "state": 4 })
+
+        response = FetchEventsHandler(self.db).execute(
+            FetchStreamEvents("aaa", None, None, from_snapshot=True))
+
+        assert response.body["snapshot"] == { "changeset_id": 4, "last_event_id": 8, "data": { "state": 4 } }
+        assert [e["id"] for e in response.body["events"]] == [9, 10]
+
+    def test_read_events_from_snapshot_before_upper_bound(self):
+        self.snapshot(2, { "state": 2 })
+        self.snapshot(4, { "state": 4 })
+
+        response = FetchEventsHandler(self.db).execute(
+            FetchStreamEvents("aaa", None, 7, from_snapshot=True))
+
+        assert response.body["snapshot"]["changeset_id"] == 2
+        assert [e["id"] for e in response.body["events"]] == [5, 6, 7]